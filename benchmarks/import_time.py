@@ -0,0 +1,164 @@
+"""
+
+Import-time budget for the sharelock command line.
+
+Imports sharelock.sharelock in fresh interpreters and exits with 1 if it takes longer than the budget,
+or if it loads any of the crypto backends that should only be imported by the mode that uses them.
+
+    python benchmarks/import_time.py
+
+"""
+
+
+
+import sys
+
+import argparse
+
+import subprocess
+
+import statistics
+
+
+
+
+# milliseconds that importing sharelock.sharelock may take, including the standard library modules it loads
+
+DEFAULT_BUDGET_MS = 50
+
+
+DEFAULT_RUNS = 7
+
+
+DEFERRED_MODULES = [ 'ecies', 'coincurve', 'eth_keys', 'Crypto', 'sharelock.kek', 'sharelock.encrypter', 'sharelock.decrypter', 'sharelock.rewrapper', 'sharelock.verifier', 'sharelock.dedup', 'sharelock.cipher_benchmark', 'sharelock.agent' ]
+
+
+CLI_MODULE = 'sharelock.sharelock'
+
+
+
+
+def measure_import( ) -> float:
+
+    """
+    Import the command line module in a fresh interpreter and return the cumulative import time in milliseconds.
+    """
+
+
+    result = subprocess.run(
+        [ sys.executable, '-X', 'importtime', '-c', f'import { CLI_MODULE }' ],
+        capture_output = True,
+        text = True,
+        check = True,
+    )
+
+
+
+    for line in result.stderr.splitlines( ):
+
+
+        fields = [ field.strip( ) for field in line.split( '|' ) ]
+
+
+        if len( fields ) == 3 and fields[ 2 ] == CLI_MODULE:
+
+            return int( fields[ 1 ] ) / 1000
+
+
+
+    raise RuntimeError( f'Could not find the import time of { CLI_MODULE }.' )
+
+
+
+
+
+def loaded_deferred_modules( ) -> list[ str ]:
+
+    """
+    The deferred modules that are loaded by importing the command line module.
+    """
+
+
+    script = f'import sys, { CLI_MODULE }; print( "\\n".join( sys.modules ) )'
+
+
+    loaded = subprocess.run( [ sys.executable, '-c', script ], capture_output = True, text = True, check = True ).stdout.split( )
+
+
+
+    return sorted(
+        module for module in loaded
+        if any( module == deferred or module.startswith( deferred + '.' ) for deferred in DEFERRED_MODULES )
+    )
+
+
+
+
+
+def main( ):
+
+
+    parser = argparse.ArgumentParser(
+        prog = 'benchmarks/import_time.py',
+        description = 'Check that the sharelock command line starts within its import-time budget.',
+    )
+
+
+    parser.add_argument(
+        '--budget',
+        help = 'The import-time budget in milliseconds',
+        type = float,
+        default = DEFAULT_BUDGET_MS,
+    )
+
+
+    parser.add_argument(
+        '--runs',
+        help = 'The number of fresh interpreters to take the median import time of',
+        type = int,
+        default = DEFAULT_RUNS,
+    )
+
+
+    args = parser.parse_args( )
+
+
+
+    import_time = statistics.median( measure_import( ) for _ in range( args.runs ) )
+
+    loaded = loaded_deferred_modules( )
+
+
+
+    print( f'import { CLI_MODULE }: { round( import_time, 1 ) } ms ( budget { args.budget } ms )' )
+
+
+    failed = False
+
+
+
+    if import_time > args.budget:
+
+        print( f'Import time is over budget by { round( import_time - args.budget, 1 ) } ms.', file = sys.stderr )
+
+        failed = True
+
+
+
+    if loaded:
+
+        print( f'Modules that should be imported lazily were loaded: { ", ".join( loaded ) }', file = sys.stderr )
+
+        failed = True
+
+
+
+    exit( 1 if failed else 0 )
+
+
+
+
+
+if __name__ == '__main__':
+
+    main( )
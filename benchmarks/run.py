@@ -0,0 +1,647 @@
+
+
+"""
+
+Benchmark suite covering every sharelock pipeline stage.
+
+
+Measures:
+---------
+    * End-to-end Encrypter.encrypt / Decrypter.decrypt throughput across input sizes
+    * KEK.encrypt / KEK.decrypt latency
+    * Segment throughput of each cipher ( what "--cipher auto" chooses between )
+    * sss.split / sss.combine latency across a grid of shares and thresholds
+
+Results are written as JSON and can be compared against a stored baseline:
+
+    python benchmarks/run.py --save-baseline
+    python benchmarks/run.py --compare
+
+"""
+
+
+
+import os
+
+import io
+
+import sys
+
+import json
+
+import time
+
+import argparse
+
+import platform
+
+import tempfile
+
+import contextlib
+
+import statistics
+
+
+from pathlib import Path
+
+
+
+
+import sharelock.sharelock as cli
+
+import sharelock.kek as kek
+
+import sharelock.encrypter as encrypter
+
+import sharelock.decrypter as decrypter
+
+import sharelock.cipher_benchmark as cipher_benchmark
+
+import sharelock.shamir_secret_sharing as sss
+
+
+
+
+DEFAULT_BASELINE_FILE = Path( __file__ ).resolve( ).parent / 'baseline.json'
+
+
+KB = 1024
+
+MB = 1024 * KB
+
+GB = 1024 * MB
+
+
+DEFAULT_SIZES = [ KB, 64 * KB, MB, 16 * MB, 128 * MB ]
+
+
+FULL_SIZES = DEFAULT_SIZES + [ GB, 4 * GB ]
+
+
+SHAMIR_GRID = [ ( 5, 3 ), ( 20, 10 ), ( 50, 25 ), ( 255, 50 ), ( 500, 50 ) ]
+
+
+# regressions smaller than this fraction of the baseline are treated as noise
+
+DEFAULT_TOLERANCE = 0.15
+
+
+WRITE_CHUNK = 16 * MB
+
+
+
+
+def measure( function, repeat: int ) -> float:
+
+    """
+    Run 'function' 'repeat' times and return the median wall time in seconds.
+    """
+
+
+    timings = [ ]
+
+
+    for _ in range( repeat ):
+
+        start = time.perf_counter( )
+
+        function( )
+
+        timings.append( time.perf_counter( ) - start )
+
+
+    return statistics.median( timings )
+
+
+
+
+
+def repeat_for( size: int ) -> int:
+
+    """
+    How many times to repeat an end-to-end run of 'size' bytes, so small inputs are not dominated by noise.
+    """
+
+
+    return max( 1, min( 20, ( 64 * MB ) // max( size, 1 ) ) )
+
+
+
+
+
+def format_size( size: int ) -> str:
+
+    for unit, name in ( ( GB, 'GB' ), ( MB, 'MB' ), ( KB, 'KB' ) ):
+
+        if size >= unit and size % unit == 0:
+
+            return f'{ size // unit }{ name }'
+
+
+    return f'{ size }B'
+
+
+
+
+
+def write_random_file( path: Path, size: int ):
+
+    with path.open( 'wb' ) as file:
+
+
+        remaining = size
+
+
+        while remaining > 0:
+
+            chunk = os.urandom( min( WRITE_CHUNK, remaining ) )
+
+            file.write( chunk )
+
+            remaining -= len( chunk )
+
+
+
+
+
+@contextlib.contextmanager
+def redirected_stdio( stdin_text: str ):
+
+    """
+    Feed 'stdin_text' to stdin and discard everything written to stdout, for the duration of the block.
+    """
+
+
+    with open( os.devnull, 'wb' ) as devnull:
+
+
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+
+
+        sys.stdin = io.StringIO( stdin_text )
+
+        sys.stdout = io.TextIOWrapper( devnull, write_through = True )
+
+
+        try:
+
+            yield
+
+        finally:
+
+            sys.stdout.detach( )
+
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+
+
+
+
+
+def generate_key( directory: Path, shares: int = 3, threshold: int = 2 ):
+
+    """
+    Generate a KEK in 'directory'. Returns the public key filename and the text of 'threshold' shares.
+    """
+
+
+    public_key_filename = str( directory / 'KEK.bin' )
+
+
+    output = io.StringIO( )
+
+
+    with contextlib.redirect_stdout( output ):
+
+        kek.KEK( ).generate( public_key_filename, shares, threshold, quiet = True )
+
+
+    share_lines = output.getvalue( ).strip( ).split( '\n' )
+
+
+    return public_key_filename, '\n'.join( share_lines[ : threshold ] ) + '\n'
+
+
+
+
+
+def bench_end_to_end( directory: Path, sizes: list[ int ], jobs: int ) -> dict:
+
+    results = { }
+
+
+    public_key_filename, share_text = generate_key( directory )
+
+
+
+    for size in sizes:
+
+
+        input_filename = directory / 'input.bin'
+
+        output_filename = directory / 'output.bin'
+
+        dek_filename = directory / 'DEK.bin'
+
+
+        write_random_file( input_filename, size )
+
+
+        repeat = repeat_for( size )
+
+
+
+        encrypt_time = measure(
+            lambda: encrypter.Encrypter( ).encrypt( public_key_filename, str( output_filename ), str( dek_filename ), jobs = jobs, input_filename = str( input_filename ) ),
+            repeat,
+        )
+
+
+        def decrypt( ):
+
+            with redirected_stdio( share_text ):
+
+                decrypter.Decrypter( ).decrypt( str( output_filename ), str( dek_filename ), jobs = jobs )
+
+
+        decrypt_time = measure( decrypt, repeat )
+
+
+
+        name = format_size( size )
+
+
+        results[ f'encrypt.{ name }' ] = { 'value': size / MB / encrypt_time, 'unit': 'MB/s', 'higher_is_better': True }
+
+        results[ f'decrypt.{ name }' ] = { 'value': size / MB / decrypt_time, 'unit': 'MB/s', 'higher_is_better': True }
+
+
+        print( f'{ name.rjust( 6 ) }  encrypt { format( size / MB / encrypt_time, "10.1f" ) } MB/s  decrypt { format( size / MB / decrypt_time, "10.1f" ) } MB/s', file = sys.stderr )
+
+
+        input_filename.unlink( )
+
+        output_filename.unlink( )
+
+
+
+    return results
+
+
+
+
+
+def bench_kek( repeat: int ) -> dict:
+
+    kek_context = kek.KEK( )
+
+
+    with contextlib.redirect_stdout( io.StringIO( ) ):
+
+        with tempfile.TemporaryDirectory( ) as directory:
+
+            public_key_filename, share_text = generate_key( Path( directory ) )
+
+            public_key = kek_context.load( public_key_filename )
+
+
+
+    with redirected_stdio( share_text ):
+
+        private_key = decrypter.Decrypter( ).read_private_kek( )
+
+
+
+    dek = os.urandom( 32 )
+
+    encrypted_dek = kek_context.encrypt( dek, public_key )
+
+
+    encrypt_time = measure( lambda: kek_context.encrypt( dek, public_key ), repeat )
+
+    decrypt_time = measure( lambda: kek_context.decrypt( encrypted_dek, private_key ), repeat )
+
+
+    print( f'KEK     encrypt { format( encrypt_time * 1000, "8.3f" ) } ms  decrypt { format( decrypt_time * 1000, "8.3f" ) } ms', file = sys.stderr )
+
+
+
+    return {
+        'kek.encrypt': { 'value': encrypt_time * 1000, 'unit': 'ms', 'higher_is_better': False },
+        'kek.decrypt': { 'value': decrypt_time * 1000, 'unit': 'ms', 'higher_is_better': False },
+    }
+
+
+
+
+
+def bench_ciphers( ) -> dict:
+
+    rates = cipher_benchmark.benchmark( )
+
+
+    for name, rate in rates.items( ):
+
+        print( f'{ name.ljust( 18 ) }  { format( rate / MB, "10.1f" ) } MB/s', file = sys.stderr )
+
+
+
+    return { f'cipher.{ name }': { 'value': rate / MB, 'unit': 'MB/s', 'higher_is_better': True } for name, rate in rates.items( ) }
+
+
+
+
+
+def bench_shamir( grid: list[ tuple[ int, int ] ], repeat: int ) -> dict:
+
+    results = { }
+
+
+    secret = os.urandom( 32 )
+
+
+
+    for shares, threshold in grid:
+
+
+        split_shares = sss.split( secret, shares, threshold )
+
+
+        split_time = measure( lambda: sss.split( secret, shares, threshold ), repeat )
+
+
+
+        def combine( ):
+
+            sss.lagrange_coefficients.cache_clear( )
+
+            sss.combine( split_shares[ : threshold ] )
+
+
+        combine_time = measure( combine, repeat )
+
+
+
+        name = f'{ shares }x{ threshold }'
+
+
+        results[ f'sss.split.{ name }' ] = { 'value': split_time * 1000, 'unit': 'ms', 'higher_is_better': False }
+
+        results[ f'sss.combine.{ name }' ] = { 'value': combine_time * 1000, 'unit': 'ms', 'higher_is_better': False }
+
+
+        print( f'{ name.rjust( 8 ) }  split { format( split_time * 1000, "8.3f" ) } ms  combine { format( combine_time * 1000, "8.3f" ) } ms', file = sys.stderr )
+
+
+
+    return results
+
+
+
+
+
+def compare( results: dict, baseline: dict, tolerance: float ) -> list[ str ]:
+
+    """
+    Compare 'results' against 'baseline' and print a line per shared metric.
+
+
+    Returns:
+    -------
+    list[ str ]
+        The names of the metrics that regressed by more than 'tolerance'
+
+    """
+
+
+    regressions = [ ]
+
+
+
+    for name, result in results[ 'results' ].items( ):
+
+
+        if name not in baseline[ 'results' ]:
+
+            continue
+
+
+        old = baseline[ 'results' ][ name ][ 'value' ]
+
+        new = result[ 'value' ]
+
+
+        if old == 0:
+
+            continue
+
+
+
+        change = ( new - old ) / old
+
+        regressed = ( -change if result[ 'higher_is_better' ] else change ) > tolerance
+
+
+        if regressed:
+
+            regressions.append( name )
+
+
+        print( f'{ name.ljust( 28 ) } { format( old, "12.3f" ) } -> { format( new, "12.3f" ) } { result[ "unit" ].ljust( 5 ) } { format( change, "+8.1%" ) }{ "  REGRESSION" if regressed else "" }' )
+
+
+
+    return regressions
+
+
+
+
+
+def create_parser( ) -> argparse.ArgumentParser:
+
+
+    parser = argparse.ArgumentParser(
+        prog = 'benchmarks/run.py',
+        description = 'Benchmark every sharelock pipeline stage.',
+    )
+
+
+    parser.add_argument(
+        '--sizes',
+        help = 'Comma separated end-to-end input sizes in bytes ( defaults to 1KB to 128MB )',
+    )
+
+
+    parser.add_argument(
+        '--full',
+        help = 'Also run the end-to-end benchmark on 1GB and 4GB inputs',
+        action = 'store_true',
+        default = False,
+    )
+
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help = 'The number of segments to encrypt and decrypt in parallel',
+        type = int,
+        default = 1,
+    )
+
+
+    parser.add_argument(
+        '--repeat',
+        help = 'How many times to repeat the KEK and Shamir measurements',
+        type = int,
+        default = 20,
+    )
+
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        help = 'File to which to write the results as JSON ( defaults to stdout )',
+    )
+
+
+    parser.add_argument(
+        '--baseline',
+        help = 'Baseline results file',
+        default = str( DEFAULT_BASELINE_FILE ),
+    )
+
+
+    parser.add_argument(
+        '--save-baseline',
+        help = 'Store the results as the baseline',
+        action = 'store_true',
+        default = False,
+    )
+
+
+    parser.add_argument(
+        '--compare',
+        help = 'Compare the results against the baseline and exit with 1 if any metric regressed',
+        action = 'store_true',
+        default = False,
+    )
+
+
+    parser.add_argument(
+        '--tolerance',
+        help = 'The fraction by which a metric may get worse before it counts as a regression',
+        type = float,
+        default = DEFAULT_TOLERANCE,
+    )
+
+
+    parser.add_argument(
+        '--work-dir',
+        help = 'Directory in which to create the temporary input and output files ( defaults to the system temporary directory )',
+    )
+
+
+
+    return parser
+
+
+
+
+
+def main( ):
+
+
+    args = create_parser( ).parse_args( )
+
+
+
+    if args.sizes is not None:
+
+        sizes = [ int( size ) for size in args.sizes.split( ',' ) ]
+
+    else:
+
+        sizes = FULL_SIZES if args.full else DEFAULT_SIZES
+
+
+
+    results = {
+        'meta': {
+            'sharelock_version': cli.__version__,
+            'python': platform.python_version( ),
+            'platform': platform.platform( ),
+            'machine': platform.machine( ),
+            'cpu_count': os.cpu_count( ),
+            'jobs': args.jobs,
+            'timestamp': time.strftime( '%Y-%m-%dT%H:%M:%SZ', time.gmtime( ) ),
+        },
+        'results': { },
+    }
+
+
+
+    with tempfile.TemporaryDirectory( dir = args.work_dir ) as directory:
+
+        results[ 'results' ].update( bench_end_to_end( Path( directory ), sizes, args.jobs ) )
+
+
+    results[ 'results' ].update( bench_kek( args.repeat ) )
+
+    results[ 'results' ].update( bench_ciphers( ) )
+
+    results[ 'results' ].update( bench_shamir( SHAMIR_GRID, args.repeat ) )
+
+
+
+    encoded_results = json.dumps( results, indent = 4 )
+
+
+    if args.output is None:
+
+        print( encoded_results )
+
+    else:
+
+        Path( args.output ).write_text( encoded_results )
+
+
+
+    if args.save_baseline:
+
+        Path( args.baseline ).write_text( encoded_results )
+
+
+
+    if args.compare:
+
+
+        try:
+
+            baseline = json.loads( Path( args.baseline ).read_text( ) )
+
+        except:
+
+            print( f'Could not read baseline from "{ args.baseline }". Create one with --save-baseline.', file = sys.stderr )
+
+            exit( 1 )
+
+
+
+        regressions = compare( results, baseline, args.tolerance )
+
+
+        if regressions:
+
+            print( f'{ len( regressions ) } metric(s) regressed: { ", ".join( regressions ) }', file = sys.stderr )
+
+            exit( 1 )
+
+
+
+
+
+if __name__ == '__main__':
+
+    main( )
+
+
+
@@ -0,0 +1,622 @@
+
+
+"""
+
+Module for the key agent.
+
+The agent combines the key shares once and keeps the Private Key Encryption Key in locked memory.
+Decryptions then ask the agent to decrypt their DEKs over a Unix socket instead of asking for the key shares again.
+
+
+Protocol:
+---------
+    One JSON object per line in each direction, one request per connection.
+    { "op": "unwrap", "dek": base64 encrypted DEK }  ->  { "dek": base64 decrypted DEK }
+    { "op": "status" }                               ->  { "expires_in": seconds until idle eviction }
+    { "op": "evict" }                                ->  { }  ( the key is wiped and the agent exits )
+    Failures are answered with { "error": message }.
+
+"""
+
+
+
+import os
+
+import sys
+
+import json
+
+import time
+
+import base64
+
+import ctypes
+
+import socket
+
+import struct
+
+
+from pathlib import Path
+
+
+
+
+import sharelock.errors as errors
+
+import sharelock.kek as kek
+
+
+
+
+DEFAULT_TTL = 15 * 60
+
+
+AGENT_SOCKET_ENVIRONMENT_VARIABLE = 'SHARELOCK_AGENT_SOCKET'
+
+
+CONNECTION_TIMEOUT = 10
+
+
+MAX_REQUEST_LENGTH = 64 * 1024
+
+
+PR_SET_DUMPABLE = 4
+
+
+
+
+def default_socket_path( ) -> str:
+
+    """
+    The socket path used when none is given: $SHARELOCK_AGENT_SOCKET, else a per-user path in $XDG_RUNTIME_DIR or /tmp.
+    """
+
+
+    if os.environ.get( AGENT_SOCKET_ENVIRONMENT_VARIABLE ):
+
+        return os.environ[ AGENT_SOCKET_ENVIRONMENT_VARIABLE ]
+
+
+    runtime_directory = os.environ.get( 'XDG_RUNTIME_DIR' ) or '/tmp'
+
+
+    return str( Path( runtime_directory ) / f'sharelock-agent-{ os.getuid( ) }.sock' )
+
+
+
+
+
+class LockedKey:
+
+    """
+    Holds a key in a buffer that is locked into memory ( never swapped ) when the platform allows it,
+    and that is overwritten with zeros when the key is wiped.
+
+    The buffer is locked before the key is copied into it, and a bytearray passed in is zeroed once it is copied.
+    key( ) hands out a read-only view of the buffer rather than a copy.
+    """
+
+
+
+    def __init__( self, key ):
+
+        self.buffer = bytearray( len( key ) )
+
+        self.locked = False
+
+
+        self.address = ctypes.addressof( ( ctypes.c_char * len( self.buffer ) ).from_buffer( self.buffer ) )
+
+
+        try:
+
+            self.libc = ctypes.CDLL( None, use_errno = True )
+
+            self.locked = self.libc.mlock( ctypes.c_void_p( self.address ), ctypes.c_size_t( len( self.buffer ) ) ) == 0
+
+        except Exception:
+
+            self.libc = None
+
+
+
+        self.buffer[ : ] = key
+
+
+        if isinstance( key, bytearray ):
+
+            key[ : ] = bytes( len( key ) )
+
+
+
+
+    def key( self ) -> memoryview:
+
+        """
+        A read-only view of the locked buffer. Release it ( or use it in a 'with' block ) once the key has been used.
+        """
+
+
+        return memoryview( self.buffer ).toreadonly( )
+
+
+
+
+    def wipe( self ):
+
+        ctypes.memset( self.address, 0, len( self.buffer ) )
+
+
+        if self.locked:
+
+            self.libc.munlock( ctypes.c_void_p( self.address ), ctypes.c_size_t( len( self.buffer ) ) )
+
+            self.locked = False
+
+
+        self.buffer = bytearray( )
+
+
+
+
+
+class Agent:
+
+
+
+    def __init__( self ):
+
+        pass
+
+
+
+
+    def serve( self, private_kek: bytearray, socket_path: str, ttl: float = DEFAULT_TTL ):
+
+        """
+
+        Hold 'private_kek' and answer requests on 'socket_path' until evicted or idle for 'ttl' seconds.
+
+        The key is copied into a LockedKey, and 'private_kek' is zeroed if it is a bytearray.
+        Immutable bytes can not be wiped, so pass the key as a bytearray and drop any other copies of it.
+        ECIES ( see kek.KEK.unwrap( ) ) still makes a short-lived bytes copy of the key for each unwrap, which is freed but not wiped.
+
+
+        Params:
+        -------
+        private_kek : bytearray
+            The combined Private Key Encryption Key
+        socket_path : str
+            The path at which to create the Unix socket. Only the current user can connect to it.
+        ttl : float - default DEFAULT_TTL
+            The number of idle seconds after which the key is wiped and the agent exits
+
+
+        Raises:
+        -------
+        sharelock.errors.AgentError
+            If an agent is already listening on 'socket_path' or the socket can not be created. The key is wiped first.
+
+        """
+
+
+        self.disable_core_dumps( )
+
+
+
+        locked_key = LockedKey( private_kek )
+
+
+        if not locked_key.locked:
+
+            print( 'Warning: could not lock the key into memory. It may be written to swap.', file = sys.stderr )
+
+
+
+        try:
+
+            server = self.listen( socket_path )
+
+        except errors.AgentError:
+
+            locked_key.wipe( )
+
+            raise
+
+
+
+        expires = time.monotonic( ) + ttl
+
+
+
+        try:
+
+
+            while True:
+
+
+                remaining = expires - time.monotonic( )
+
+
+                if remaining <= 0:
+
+                    print( 'Agent idle timeout reached. Evicting key.', file = sys.stderr )
+
+                    return
+
+
+
+                server.settimeout( remaining )
+
+
+                try:
+
+                    connection, _ = server.accept( )
+
+                except socket.timeout:
+
+                    continue
+
+
+
+                try:
+
+
+                    with connection:
+
+
+                        if not self.is_same_user( connection ):
+
+                            continue
+
+
+                        op = self.handle( connection, locked_key, expires )
+
+
+                except OSError:
+
+                    continue
+
+
+
+                if op == 'evict':
+
+                    print( 'Key evicted.', file = sys.stderr )
+
+                    return
+
+
+                if op == 'unwrap':
+
+                    expires = time.monotonic( ) + ttl
+
+
+
+        finally:
+
+            locked_key.wipe( )
+
+            server.close( )
+
+
+            try:
+
+                os.unlink( socket_path )
+
+            except OSError:
+
+                pass
+
+
+
+
+    def handle( self, connection, locked_key: LockedKey, expires: float ):
+
+        """
+        Answer a single request on 'connection'. Returns the requested operation.
+        """
+
+
+        connection.settimeout( CONNECTION_TIMEOUT )
+
+
+
+        try:
+
+            request = json.loads( read_line( connection ) )
+
+            op = request[ 'op' ]
+
+        except Exception:
+
+            self.send( connection, { 'error': 'Malformed request.' } )
+
+            return None
+
+
+
+        if op == 'status':
+
+            self.send( connection, { 'expires_in': max( 0, expires - time.monotonic( ) ) } )
+
+
+        elif op == 'evict':
+
+            self.send( connection, { } )
+
+
+        elif op == 'unwrap':
+
+
+            try:
+
+                with locked_key.key( ) as private_kek:
+
+                    decrypted_dek = kek.KEK( ).unwrap( base64.b64decode( request[ 'dek' ] ), private_kek )
+
+            except Exception:
+
+                self.send( connection, { 'error': 'Could not decrypt DEK. It was not encrypted for the key held by this agent, or it has been modified.' } )
+
+                return None
+
+
+            self.send( connection, { 'dek': base64.b64encode( decrypted_dek ).decode( ) } )
+
+
+        else:
+
+            self.send( connection, { 'error': f'Unknown operation "{ op }".' } )
+
+            return None
+
+
+
+        return op
+
+
+
+
+    def listen( self, socket_path: str ):
+
+        """
+
+        Create the Unix socket at 'socket_path', readable and writable only by the current user.
+        A socket left behind by an agent that is no longer running is replaced.
+
+
+        Raises:
+        -------
+        sharelock.errors.AgentError
+            If an agent is already listening on 'socket_path' or the socket can not be created.
+
+        """
+
+
+        if os.path.exists( socket_path ):
+
+
+            try:
+
+                AgentClient( socket_path ).request( { 'op': 'status' } )
+
+            except errors.AgentError:
+
+                os.unlink( socket_path )
+
+            else:
+
+                raise errors.AgentError( f'An agent is already listening on "{ socket_path }".' )
+
+
+
+        server = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+
+
+        old_umask = os.umask( 0o177 )
+
+
+        try:
+
+            server.bind( socket_path )
+
+        except OSError:
+
+            server.close( )
+
+            raise errors.AgentError( f'Could not create agent socket at "{ socket_path }".' )
+
+        finally:
+
+            os.umask( old_umask )
+
+
+
+        server.listen( )
+
+
+        return server
+
+
+
+
+    def is_same_user( self, connection ) -> bool:
+
+        """
+        Whether the peer of 'connection' runs as the current user ( checked where the platform reports peer credentials ).
+        """
+
+
+        if not hasattr( socket, 'SO_PEERCRED' ):
+
+            return True
+
+
+        credentials = connection.getsockopt( socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize( '3i' ) )
+
+
+        _, uid, _ = struct.unpack( '3i', credentials )
+
+
+        return uid == os.getuid( )
+
+
+
+
+    def disable_core_dumps( self ):
+
+        """
+        Keep the key out of core dumps and away from other processes of the same user ( Linux only ).
+        """
+
+
+        try:
+
+            ctypes.CDLL( None ).prctl( PR_SET_DUMPABLE, 0, 0, 0, 0 )
+
+        except Exception:
+
+            pass
+
+
+
+
+    def send( self, connection, message: dict ):
+
+        connection.sendall( json.dumps( message ).encode( ) + b'\n' )
+
+
+
+
+
+class AgentClient:
+
+    """
+    Client for a running agent.
+    """
+
+
+
+    def __init__( self, socket_path: str ):
+
+        self.socket_path = socket_path
+
+
+
+
+    def request( self, message: dict ) -> dict:
+
+        """
+        Send one request to the agent and return its response.
+
+
+        Raises:
+        -------
+        sharelock.errors.AgentError
+            If no agent is listening on the socket, or it does not answer within CONNECTION_TIMEOUT seconds.
+        ValueError
+            If the agent answers with an error.
+
+        """
+
+
+        try:
+
+            connection = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+
+            connection.settimeout( CONNECTION_TIMEOUT )
+
+            connection.connect( self.socket_path )
+
+        except OSError:
+
+            raise errors.AgentError( f'No agent is listening on "{ self.socket_path }".' )
+
+
+
+        try:
+
+            with connection:
+
+                connection.sendall( json.dumps( message ).encode( ) + b'\n' )
+
+                response = json.loads( read_line( connection ) )
+
+        except socket.timeout:
+
+            raise errors.AgentError( f'The agent on "{ self.socket_path }" did not answer within { CONNECTION_TIMEOUT } seconds.' )
+
+        except ( OSError, ValueError ):
+
+            raise errors.AgentError( f'The agent on "{ self.socket_path }" closed the connection without answering.' )
+
+
+
+        if 'error' in response:
+
+            raise ValueError( response[ 'error' ] )
+
+
+        return response
+
+
+
+
+    def unwrap( self, encrypted_dek: bytes ) -> bytes:
+
+        """
+        Ask the agent to decrypt 'encrypted_dek' with the key it holds.
+        """
+
+
+        response = self.request( { 'op': 'unwrap', 'dek': base64.b64encode( encrypted_dek ).decode( ) } )
+
+
+        return base64.b64decode( response[ 'dek' ] )
+
+
+
+
+    def evict( self ):
+
+        """
+        Ask the agent to wipe its key and exit.
+        """
+
+
+        self.request( { 'op': 'evict' } )
+
+
+
+
+
+def read_line( connection ) -> bytes:
+
+    """
+    Read from 'connection' up to and including the first newline.
+    """
+
+
+    data = b''
+
+
+    while not data.endswith( b'\n' ):
+
+
+        chunk = connection.recv( 4096 )
+
+
+        if len( chunk ) == 0 or len( data ) > MAX_REQUEST_LENGTH:
+
+            break
+
+
+        data += chunk
+
+
+
+    return data
+
+
+
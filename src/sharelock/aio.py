@@ -0,0 +1,493 @@
+"""
+
+This module encrypts and decrypts streams from asyncio code.
+
+The containers are the same as the ones written and read by the command line.
+Wrapping the DEK and encrypting, compressing, and decrypting segments runs in an executor,
+so a single event loop can encrypt and decrypt many streams at once without blocking.
+
+
+Sources are an asyncio.StreamReader or an async iterable of bytes. Destinations are an asyncio.StreamWriter.
+encrypt_iter( ) and decrypt_iter( ) yield the output instead of writing it, for destinations that are not StreamWriters.
+
+"""
+
+
+
+import asyncio
+
+import tempfile
+
+import collections
+
+from pathlib import Path
+
+
+
+import sharelock.errors as errors
+
+import sharelock.dek as dek
+
+import sharelock.encrypter as encrypter
+
+import sharelock.decrypter as decrypter
+
+import sharelock.mapping as mapping
+
+import sharelock.parallel as parallel
+
+import sharelock.container as container
+
+import sharelock.compression as compression
+
+import sharelock.cipher_benchmark as cipher_benchmark
+
+import sharelock.stream_format as stream_format
+
+
+
+
+# bytes read from a StreamReader at a time when spooling encrypted data
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+
+
+async def read_chunks( source ):
+
+    """
+    Yield the bytes of 'source' ( an asyncio.StreamReader or an async iterable of bytes ) as they arrive.
+    """
+
+
+    if isinstance( source, asyncio.StreamReader ):
+
+
+        chunk = await source.read( SPOOL_CHUNK_SIZE )
+
+
+        while chunk:
+
+            yield chunk
+
+            chunk = await source.read( SPOOL_CHUNK_SIZE )
+
+
+        return
+
+
+
+    async for chunk in source:
+
+        yield chunk
+
+
+
+
+
+async def read_segments( source, segment_size: int ):
+
+    """
+    Yield the contents of 'source' in segments of 'segment_size' bytes.
+    The last segment may be shorter. An empty source still yields one empty segment.
+
+
+    Params:
+    -------
+    source : asyncio.StreamReader | async iterable of bytes
+        The data to split into segments
+    segment_size : int
+        The maximum number of bytes per segment
+
+    """
+
+
+    buffer = bytearray( )
+
+    count = 0
+
+
+
+    async for chunk in read_chunks( source ):
+
+
+        buffer += chunk
+
+
+        while len( buffer ) >= segment_size:
+
+            yield bytes( buffer[ : segment_size ] )
+
+            del buffer[ : segment_size ]
+
+            count += 1
+
+
+
+    if buffer or count == 0:
+
+        yield bytes( buffer )
+
+
+
+
+
+async def in_order( loop, executor, function, items, jobs: int ):
+
+    """
+    Call 'function' on each of 'items' ( an async iterable ) in 'executor' and yield the results in order.
+    At most parallel.IN_FLIGHT_PER_JOB * 'jobs' calls are pending at a time, so slow consumers hold back the source.
+    """
+
+
+    pending = collections.deque( )
+
+    limit = parallel.IN_FLIGHT_PER_JOB * max( jobs, 1 )
+
+
+
+    try:
+
+
+        async for item in items:
+
+
+            pending.append( loop.run_in_executor( executor, function, item ) )
+
+
+            if len( pending ) >= limit:
+
+                yield await pending.popleft( )
+
+
+
+        while pending:
+
+            yield await pending.popleft( )
+
+
+    finally:
+
+        for future in pending:
+
+            future.cancel( )
+
+
+
+
+
+async def enumerate_async( items ):
+
+    index = 0
+
+
+    async for item in items:
+
+        yield index, item
+
+        index += 1
+
+
+
+
+
+async def encrypt_iter( source, public_kek: bytes, *, segment_size: int = stream_format.DEFAULT_SEGMENT_SIZE, compression_codec: str = compression.NONE, compression_level: int = None, cipher: str = stream_format.DEFAULT_CIPHER, jobs: int = 1, executor = None ):
+
+    """
+
+    Encrypt a stream into a container, yielding the container as it is built.
+
+
+    Params:
+    -------
+    source : asyncio.StreamReader | async iterable of bytes
+        The data to encrypt
+    public_kek : bytes | list[ bytes ]
+        The Public Key Encryption Key ( see kek.KEK.load( ) ), or a list of them to encrypt the DEK for each key
+    segment_size : int
+        The number of plaintext bytes in each separately authenticated segment
+    compression_codec : str - default compression.NONE
+        The codec with which to compress each segment before it is encrypted ( one of compression.CODECS )
+    compression_level : int | None - default None
+        The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+    cipher : str - default stream_format.DEFAULT_CIPHER
+        The cipher to encrypt the segments with ( one of dek.CIPHERS ), or cipher_benchmark.AUTO to use the fastest one on this host
+    jobs : int - default 1
+        The number of segments to encrypt at once
+    executor : concurrent.futures.Executor | None - default None
+        The executor to run the encryption in. If set to None, the event loop's default executor is used.
+
+
+    Yields:
+    -------
+    bytes
+        The header, the encrypted segments, and the index and footer, in order
+
+
+    Raises:
+    -------
+    ValueError
+        If the parameters are invalid or the source has too many segments.
+
+    """
+
+
+    loop = asyncio.get_running_loop( )
+
+
+    compression.check( compression_codec, compression_level )
+
+
+    # the first 'auto' on a host runs the cipher benchmark, so keep it off the event loop
+
+    cipher = await loop.run_in_executor( executor, cipher_benchmark.resolve, cipher )
+
+
+
+    dek_context = dek.DEK( )
+
+
+    dek_key = dek_context.generate( )
+
+
+    params = container.new_params( segment_size, compression_codec, cipher )
+
+    params[ 'recipients' ] = await loop.run_in_executor( executor, encrypter.Encrypter( ).wrap_dek, dek_key, public_kek )
+
+
+    header = container.build_header( params )
+
+
+    yield header
+
+
+
+    def encrypt_segment( indexed_segment ):
+
+
+        index, segment = indexed_segment
+
+
+        data = compression.compress( compression_codec, segment, compression_level )
+
+
+        ciphertext, tag = dek_context.encrypt_segment( data, dek_key, params[ 'nonce_prefix' ], index, params[ 'cipher' ] )
+
+
+        return ciphertext, tag, len( segment )
+
+
+
+    index = container.IndexBuilder( len( header ) )
+
+
+    encrypted_segments = in_order( loop, executor, encrypt_segment, enumerate_async( read_segments( source, segment_size ) ), jobs )
+
+
+
+    async for ciphertext, tag, plaintext_length in encrypted_segments:
+
+        index.add( len( ciphertext ), plaintext_length, tag )
+
+        yield ciphertext
+
+
+
+    yield index.finish( dek_key, params )
+
+
+
+
+
+async def encrypt( source, destination: asyncio.StreamWriter, public_kek: bytes, **options ):
+
+    """
+    Encrypt a stream into a container written to 'destination'. The options are those of encrypt_iter( ).
+    'destination' is drained after each segment but not closed.
+    """
+
+
+    async for data in encrypt_iter( source, public_kek, **options ):
+
+        destination.write( data )
+
+        await destination.drain( )
+
+
+
+
+
+async def spool( source, executor = None ):
+
+    """
+    Copy a stream into a temporary file, so it can be mapped and its index read from the end.
+    """
+
+
+    loop = asyncio.get_running_loop( )
+
+
+    spooled = tempfile.TemporaryFile( )
+
+
+
+    try:
+
+        async for chunk in read_chunks( source ):
+
+            await loop.run_in_executor( executor, spooled.write, chunk )
+
+
+        await loop.run_in_executor( executor, spooled.flush )
+
+    except BaseException:
+
+        spooled.close( )
+
+        raise
+
+
+
+    return spooled
+
+
+
+
+
+async def decrypt_iter( source, private_kek: bytes, *, offset: int = 0, length: int = None, jobs: int = 1, executor = None ):
+
+    """
+
+    Decrypt and authenticate a container, yielding the decrypted data one segment at a time.
+
+    The index of a container is at its end, so a streamed source is spooled to a temporary file before the first
+    segment is decrypted. Pass a path to decrypt a file in place.
+
+
+    Params:
+    -------
+    source : str | Path | asyncio.StreamReader | async iterable of bytes
+        The container to decrypt
+    private_kek : bytes
+        The reconstructed Private Key Encryption Key
+    offset : int - default 0
+        The offset in the decrypted data of the first byte to yield
+    length : int | None - default None
+        The number of bytes to yield. If set to None, yield everything after 'offset'.
+    jobs : int - default 1
+        The number of segments to decrypt at once
+    executor : concurrent.futures.Executor | None - default None
+        The executor to run the decryption in. If set to None, the event loop's default executor is used.
+
+
+    Yields:
+    -------
+    bytes
+        The decrypted segments ( or the parts of them inside the requested range ), in order
+
+
+    Raises:
+    -------
+    ValueError
+        If the source is not a container, the keys are wrong, or any part of it fails authentication.
+    sharelock.errors.UsageError
+        If the source is the manifest of a deduplicated backup. Reassemble it with sharelock.api.decrypt( ) and the chunk store.
+
+    """
+
+
+    loop = asyncio.get_running_loop( )
+
+
+    if isinstance( source, ( str, Path ) ):
+
+        spooled = None
+
+    else:
+
+        spooled = await spool( source, executor )
+
+
+
+    try:
+
+
+        with mapping.MappedFile( source if spooled is None else spooled ) as mapped:
+
+
+            view = mapped.view
+
+
+            header_length, params = container.read_header( mapping.BufferReader( view ) )
+
+
+            # the decrypted manifest holds the keys of the chunks, so it is never yielded as data
+
+            if params.get( 'content' ) == container.CHUNK_MANIFEST:
+
+                raise errors.UsageError( 'The encrypted data is the manifest of a deduplicated backup. Decrypt it with sharelock.api.decrypt( ) and the chunk store to reassemble it.' )
+
+
+            ( _, dek_key ), = await loop.run_in_executor( executor, decrypter.Decrypter( ).open_recipients, [ params[ 'recipients' ] ], 1, None, private_kek )
+
+
+            entries, sessions = await loop.run_in_executor( executor, container.read_index, view, dek_key, params, header_length )
+
+
+
+            selected, starts, range_end = container.segment_range( entries, offset, length )
+
+
+            segment_decrypter = decrypter.Decrypter( )
+
+
+
+            def decrypt_segment( index ):
+
+                return index, segment_decrypter.decrypt_container_segment( view, dek_key, params, entries, sessions, index )
+
+
+
+            async def selected_indices( ):
+
+                for index in selected:
+
+                    yield index
+
+
+
+            async for index, decrypted_segment in in_order( loop, executor, decrypt_segment, selected_indices( ), jobs ):
+
+
+                if starts[ index ] < offset or starts[ index + 1 ] > range_end:
+
+                    decrypted_segment = decrypted_segment[ max( offset - starts[ index ], 0 ) : range_end - starts[ index ] ]
+
+
+                yield decrypted_segment
+
+
+    finally:
+
+        if spooled is not None:
+
+            spooled.close( )
+
+
+
+
+
+async def decrypt( source, destination: asyncio.StreamWriter, private_kek: bytes, **options ):
+
+    """
+    Decrypt a container into 'destination'. The options are those of decrypt_iter( ).
+    'destination' is drained after each segment but not closed.
+    """
+
+
+    async for data in decrypt_iter( source, private_kek, **options ):
+
+        destination.write( data )
+
+        await destination.drain( )
@@ -0,0 +1,269 @@
+"""
+
+This module is the in-process interface for generating keys, encrypting, and decrypting.
+
+Nothing here reads stdin, writes stdout, or exits the process, so it can be called repeatedly and from many threads
+of one long-lived process. Failures are raised as sharelock.errors.SharelockError.
+
+
+Sources are bytes, filenames, or binary file objects. Destinations are filenames or binary file objects.
+Without a destination, the output is returned as bytes.
+
+"""
+
+
+
+import io
+
+import base64
+
+from pathlib import Path
+
+
+
+import sharelock.errors as errors
+
+import sharelock.kek as kek
+
+import sharelock.parallel as parallel
+
+import sharelock.encrypter as encrypter
+
+import sharelock.decrypter as decrypter
+
+import sharelock.compression as compression
+
+import sharelock.stream_format as stream_format
+
+
+
+
+def generate_kek( shares: int, threshold: int, padding_byte: bytes = None ):
+
+    """
+
+    Generate a new Key Encryption Key and split its private key.
+
+
+    Params:
+    -------
+    shares : int
+        The number of key shares the private key will be broken into
+    threshold : int
+        The number of key shares needed to reconstruct the private key
+    padding_byte : bytes | None - default None
+        The bytes used to pad chunks of the key before it is split if needed
+
+
+    Returns:
+    -------
+    public_kek : bytes
+        The Public Key Encryption Key
+    shares : list[ str ]
+        The encoded key shares, in the form printed by 'sharelock generate' and accepted by combine_shares( )
+
+    """
+
+
+    public_kek, split_key = kek.KEK( ).create( shares, threshold, padding_byte )
+
+
+    return public_kek, [ f'{ index } - { base64.b64encode( share ).decode( ) }' for index, share in split_key ]
+
+
+
+
+
+def combine_shares( shares ) -> bytes:
+
+    """
+
+    Combine encoded key shares into the Private Key Encryption Key.
+
+
+    Params:
+    -------
+    shares : str | list[ str ]
+        The encoded shares, one per line or one per list item
+
+
+    Raises:
+    -------
+    sharelock.errors.KeyShareError
+        If the shares can not be decoded or combined.
+
+    """
+
+
+    return decrypter.Decrypter( ).combine_shares( shares )
+
+
+
+
+
+def load_public_kek( public_kek ):
+
+    """
+    Return 'public_kek' if it is bytes, or read the Public Key Encryption Key from the file it names.
+    A list of keys and filenames is loaded into a list of keys.
+    """
+
+
+    if isinstance( public_kek, ( str, Path ) ):
+
+        return kek.KEK( ).load( public_kek )
+
+
+    if isinstance( public_kek, ( bytes, bytearray, memoryview ) ):
+
+        return bytes( public_kek )
+
+
+    return [ load_public_kek( key ) for key in public_kek ]
+
+
+
+
+
+def encrypt( source, public_kek, destination = None, *, segment_size: int = stream_format.DEFAULT_SEGMENT_SIZE, compression_codec: str = compression.NONE, compression_level: int = None, cipher: str = stream_format.DEFAULT_CIPHER, jobs: int = 1 ):
+
+    """
+
+    Encrypt data into a container.
+
+
+    Params:
+    -------
+    source : bytes | str | Path | binary file object
+        The data to encrypt, or the file that holds it
+    public_kek : bytes | str | Path | list
+        The Public Key Encryption Key, or the file that holds it. A list of them encrypts the DEK for each key.
+    destination : str | Path | binary file object | None - default None
+        Where to write the container. If set to None, the container is returned.
+    segment_size : int
+        The number of plaintext bytes in each separately authenticated segment
+    compression_codec : str - default compression.NONE
+        The codec with which to compress each segment before it is encrypted ( one of compression.CODECS )
+    compression_level : int | None - default None
+        The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+    cipher : str - default stream_format.DEFAULT_CIPHER
+        The cipher to encrypt the segments with ( "aes-256-gcm" or "chacha20-poly1305" ), or "auto" to use the fastest one on this host
+    jobs : int - default 1
+        The number of segments to encrypt in parallel. Values <= 0 mean one per available CPU.
+
+
+    Returns:
+    -------
+    bytes | None
+        The container, if no destination was given
+
+
+    Raises:
+    -------
+    sharelock.errors.SharelockError
+        If the source or key can not be read, the destination can not be written, or the parameters are invalid.
+
+    """
+
+
+    if source is None:
+
+        raise errors.UsageError( 'No data to encrypt.' )
+
+
+
+    output = io.BytesIO( ) if destination is None else destination
+
+
+    encrypter.Encrypter( ).encrypt_with_kek(
+        load_public_kek( public_kek ),
+        output,
+        segment_size = segment_size,
+        jobs = parallel.resolve_jobs( jobs ),
+        source = source,
+        compression_codec = compression_codec,
+        compression_level = compression_level,
+        cipher = cipher,
+    )
+
+
+
+    return output.getvalue( ) if destination is None else None
+
+
+
+
+
+def decrypt( source, private_kek: bytes, destination = None, *, dek_filename: str = None, offset: int = 0, length: int = None, jobs: int = 1, chunk_store: str = None ):
+
+    """
+
+    Decrypt and authenticate encrypted data.
+
+
+    Params:
+    -------
+    source : bytes | str | Path | binary file object
+        The encrypted data, or the file that holds it
+    private_kek : bytes
+        The Private Key Encryption Key ( see combine_shares( ) )
+    destination : str | Path | binary file object | None - default None
+        Where to write the decrypted data. If set to None, the decrypted data is returned.
+    dek_filename : str | None - default None
+        The file that holds the encrypted DEK of data that is not a container. Required for such data: no default DEK file is read.
+    offset : int - default 0
+        The offset in the decrypted data of the first byte to decrypt ( containers only )
+    length : int | None - default None
+        The number of bytes to decrypt. If set to None, decrypt everything after 'offset' ( containers only ).
+    jobs : int - default 1
+        The number of segments to decrypt in parallel. Values <= 0 mean one per available CPU.
+    chunk_store : str | Path | None - default None
+        The chunk store to reassemble a deduplicated backup from, if 'source' holds its manifest
+
+
+    Returns:
+    -------
+    bytes | None
+        The decrypted data, if no destination was given
+
+
+    Raises:
+    -------
+    sharelock.errors.SharelockError
+        If the data can not be read, the destination can not be written, or the data fails authentication.
+        Data written to 'destination' before an authentication failure must be discarded.
+        A manifest without 'chunk_store' raises sharelock.errors.UsageError.
+
+    """
+
+
+    if private_kek is None:
+
+        raise errors.UsageError( 'A Private Key Encryption Key is required.' )
+
+
+    if offset < 0 or ( length is not None and length < 0 ):
+
+        raise errors.UsageError( 'Offset and length must be >= 0.' )
+
+
+
+    output = io.BytesIO( ) if destination is None else destination
+
+
+    # no default DEK file: data that is not a container is only decrypted with the DEK file given for it
+
+    decrypter.Decrypter( default_dek_filename = None ).decrypt(
+        source,
+        dek_filename,
+        jobs = parallel.resolve_jobs( jobs ),
+        offset = offset,
+        length = length,
+        output = output,
+        private_kek = private_kek,
+        chunk_store = chunk_store,
+    )
+
+
+
+    return output.getvalue( ) if destination is None else None
@@ -0,0 +1,279 @@
+"""
+
+Module for choosing the fastest segment cipher on this host.
+
+AES-256-GCM is fastest where the CPU has ( and exposes ) AES instructions. Where it does not, such as on virtual machines
+with AES-NI masked, ChaCha20-Poly1305 is several times faster. The 'auto' cipher benchmarks both once per host and
+caches the choice, so later runs only read the cache.
+
+
+Cache:
+-------
+    $XDG_CACHE_HOME/sharelock/cipher.json ( or ~/.cache/sharelock/cipher.json )
+    { "version": 1, "hosts": { hostname: { "cipher": name, "bytes_per_second": { name: rate }, "machine": ..., "pycryptodome": ... } } }
+
+A cached choice is benchmarked again if the machine type or the pycryptodome version changes.
+The cache is keyed by hostname, so a home directory shared between hosts keeps a choice for each of them.
+
+"""
+
+
+
+import os
+
+import json
+
+import time
+
+import socket
+
+import platform
+
+import tempfile
+
+from pathlib import Path
+
+
+
+import Crypto
+
+
+
+import sharelock.errors as errors
+
+import sharelock.dek as dek
+
+import sharelock.stats as stats
+
+
+
+
+AUTO = 'auto'
+
+
+CACHE_VERSION = 1
+
+
+CACHE_FILENAME = 'cipher.json'
+
+
+
+# each cipher encrypts a segment of this many bytes BENCHMARK_ROUNDS times, and its fastest round counts
+
+BENCHMARK_BYTES = 1024 * 1024
+
+
+BENCHMARK_ROUNDS = 3
+
+
+
+
+def resolve( cipher: str, phase_stats = stats.NULL_STATS ) -> str:
+
+    """
+
+    Return 'cipher', or the cipher chosen for this host if it is AUTO.
+
+
+    Params:
+    -------
+    cipher : str
+        One of dek.CIPHERS, or AUTO
+    phase_stats : sharelock.stats.Stats - default stats.NULL_STATS
+        Where to time the benchmark, if one is run
+
+
+    Raises:
+    -------
+    ValueError
+        If the cipher is neither AUTO nor one of dek.CIPHERS.
+
+    """
+
+
+    if cipher != AUTO:
+
+
+        if cipher not in dek.CIPHERS:
+
+            raise errors.UsageError( f'Unsupported cipher "{ cipher }". Use one of: { AUTO }, { ", ".join( dek.CIPHERS ) }.' )
+
+
+        return cipher
+
+
+
+    host = host_info( )
+
+    cache = read_cache( )
+
+
+    cached = cache[ 'hosts' ].get( socket.gethostname( ) )
+
+
+    if cached is not None and cached.get( 'cipher' ) in dek.CIPHERS and all( cached.get( key ) == value for key, value in host.items( ) ):
+
+        return cached[ 'cipher' ]
+
+
+
+    with phase_stats.phase( 'select_cipher' ):
+
+        rates = benchmark( )
+
+
+    # prefer the first of dek.CIPHERS if they are equally fast
+
+    selected = max( dek.CIPHERS, key = lambda name: ( rates[ name ], -dek.CIPHERS.index( name ) ) )
+
+
+    cache[ 'hosts' ][ socket.gethostname( ) ] = { 'cipher': selected, 'bytes_per_second': rates, **host }
+
+    write_cache( cache )
+
+
+
+    return selected
+
+
+
+
+
+def benchmark( ) -> dict:
+
+    """
+
+    Measure how fast each of dek.CIPHERS encrypts a segment on this host.
+
+
+    Returns:
+    -------
+    dict[ str, float ]
+        The bytes per second of each cipher
+
+    """
+
+
+    dek_context = dek.DEK( )
+
+
+    key = dek_context.generate( )
+
+    data = bytes( BENCHMARK_BYTES )
+
+    fastest = { name: float( 'inf' ) for name in dek.CIPHERS }
+
+
+
+    # alternate the ciphers so a change of CPU clock during the benchmark affects both
+
+    for index in range( BENCHMARK_ROUNDS ):
+
+
+        for name in dek.CIPHERS:
+
+
+            start = time.perf_counter( )
+
+
+            dek_context.encrypt_segment( data, key, bytes( dek.SEGMENT_NONCE_PREFIX_LENGTH ), index, name )
+
+
+            fastest[ name ] = min( fastest[ name ], time.perf_counter( ) - start )
+
+
+
+    return { name: BENCHMARK_BYTES / max( seconds, 1e-9 ) for name, seconds in fastest.items( ) }
+
+
+
+
+
+def host_info( ) -> dict:
+
+    """
+    What a cached choice was benchmarked on. The benchmark is run again if any of it changes.
+    """
+
+
+    return { 'machine': platform.machine( ), 'pycryptodome': Crypto.__version__ }
+
+
+
+
+
+def cache_path( ) -> Path:
+
+    """
+    The path of the cache file, in "$XDG_CACHE_HOME/sharelock" ( or "~/.cache/sharelock" ).
+    """
+
+
+    cache_home = os.environ.get( 'XDG_CACHE_HOME' ) or Path.home( ) / '.cache'
+
+
+    return Path( cache_home ) / 'sharelock' / CACHE_FILENAME
+
+
+
+
+
+def read_cache( ) -> dict:
+
+    """
+    Read the cache file. A missing, unreadable, or malformed cache reads as an empty one.
+    """
+
+
+    try:
+
+        cache = json.loads( cache_path( ).read_text( ) )
+
+    except ( OSError, ValueError, RuntimeError ):
+
+        cache = None
+
+
+    if not isinstance( cache, dict ) or cache.get( 'version' ) != CACHE_VERSION or not isinstance( cache.get( 'hosts' ), dict ):
+
+        return { 'version': CACHE_VERSION, 'hosts': { } }
+
+
+    return cache
+
+
+
+
+
+def write_cache( cache: dict ):
+
+    """
+    Replace the cache file through a temporary file. The cache is only an optimization, so failing to write it is ignored
+    and the benchmark is run again next time.
+    """
+
+
+    temporary_name = None
+
+
+    try:
+
+        path = cache_path( )
+
+        path.parent.mkdir( parents = True, exist_ok = True )
+
+
+        with tempfile.NamedTemporaryFile( 'w', dir = path.parent, prefix = f'.{ path.name }.', delete = False ) as temporary:
+
+            temporary_name = temporary.name
+
+            temporary.write( json.dumps( cache, indent = 4 ) )
+
+
+        os.replace( temporary_name, path )
+
+    except ( OSError, RuntimeError ):
+
+        if temporary_name is not None and os.path.exists( temporary_name ):
+
+            os.unlink( temporary_name )
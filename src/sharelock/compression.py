@@ -0,0 +1,156 @@
+"""
+
+Module for the compression of segments before they are encrypted.
+
+Every segment is compressed on its own, so compressed containers can still be decrypted in parallel and by byte range.
+The codec is recorded in the container header. The codecs release the GIL, so segments are compressed on multiple cores with '--jobs'.
+
+"""
+
+
+
+import lzma
+
+import zlib
+
+
+
+import sharelock.errors as errors
+
+
+
+
+NONE = 'none'
+
+
+CODECS = [ 'zlib', 'lzma' ]
+
+
+MAX_LEVEL = 9
+
+
+
+
+def check( codec: str, level: int = None ):
+
+    """
+    Check that 'codec' and 'level' can be used to compress segments.
+
+
+    Raises:
+    -------
+    ValueError
+        If the codec is unknown or the level is out of range.
+
+    """
+
+
+    if codec != NONE and codec not in CODECS:
+
+        raise errors.UsageError( f'Unsupported compression "{ codec }". Use one of: { ", ".join( CODECS ) }.' )
+
+
+    if level is not None and ( level < 0 or level > MAX_LEVEL ):
+
+        raise errors.UsageError( f'Compression level ({ level }) must be >= 0 and <= { MAX_LEVEL }.' )
+
+
+
+
+
+def compress( codec: str, data: bytes, level: int = None ) -> bytes:
+
+    """
+    Compress one segment.
+
+
+    Params:
+    -------
+    codec : str
+        One of CODECS, or NONE to return 'data' as it is
+    data : bytes
+        The segment to compress
+    level : int | None - default None
+        The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+
+    """
+
+
+    if codec == 'zlib':
+
+        return zlib.compress( data, zlib.Z_DEFAULT_COMPRESSION if level is None else level )
+
+
+    if codec == 'lzma':
+
+        return lzma.compress( data, preset = level )
+
+
+    return data
+
+
+
+
+
+def decompress( codec: str, data: bytes, length: int ) -> bytes:
+
+    """
+    Decompress one segment.
+
+
+    Params:
+    -------
+    codec : str
+        The codec the segment was compressed with
+    data : bytes
+        The compressed segment
+    length : int
+        The length of the segment before it was compressed. Decompression stops after this many bytes.
+
+
+    Raises:
+    -------
+    ValueError
+        If the segment can not be decompressed or does not decompress to 'length' bytes.
+
+    """
+
+
+    if codec == NONE:
+
+        return data
+
+
+
+    if codec == 'zlib':
+
+        decompressor = zlib.decompressobj( )
+
+    else:
+
+        decompressor = lzma.LZMADecompressor( )
+
+
+
+    try:
+
+        # one byte more than expected, so longer output is detected without decompressing all of it
+
+        decompressed = decompressor.decompress( data, length + 1 )
+
+    except ( zlib.error, lzma.LZMAError ):
+
+        raise errors.IntegrityError( f'Could not decompress segment with { codec }.' )
+
+
+
+    if len( decompressed ) != length or not decompressor.eof:
+
+        raise errors.IntegrityError( 'Segment does not decompress to the length recorded in the index.' )
+
+
+
+    return decompressed
+
+
+
@@ -0,0 +1,737 @@
+"""
+
+This module describes the container layout of encrypted data files ( format version 2 ).
+
+A container holds everything needed to decrypt it except the Private Key Encryption Key:
+the wrapped DEK, the cipher parameters, the segments, and an index of the segments at the end of the file.
+
+
+Layout:
+-------
+    MAGIC | VERSION | header length ( 4 bytes ) | header ( JSON, padded with spaces to a multiple of HEADER_BLOCK_SIZE )
+    segments: ciphertext of each segment, back to back
+    index: one INDEX_ENTRY per segment
+    sessions: one SESSION_ENTRY per append session ( only in containers that have been appended to )
+    footer: index offset ( 8 bytes ) | segment count ( 8 bytes ) | HMAC | FOOTER_MAGIC ( APPENDED_FOOTER_MAGIC with sessions )
+
+The HMAC is keyed by a key derived from the DEK and covers the header parameters ( except the recipients ), the index,
+and the sessions. The index holds the tag of every segment, so the HMAC also authenticates the order and number of segments.
+The recipients are left out so wrapped DEKs can be replaced in place without decrypting the data.
+
+Segment nonces are built from the 'nonce_prefix' header parameter and the segment index. Each append session draws a
+fresh nonce prefix for the segments it adds and records it with the index of its first segment, so an append that
+is retried after a failure never encrypts different data under a nonce that was already used.
+
+"""
+
+
+
+import json
+
+import hmac
+
+import base64
+
+import bisect
+
+import struct
+
+import hashlib
+
+import itertools
+
+
+
+from Crypto.Random import get_random_bytes
+
+
+
+import sharelock.errors as errors
+
+import sharelock.dek as dek
+
+import sharelock.compression as compression
+
+import sharelock.stream_format as stream_format
+
+
+
+
+MAGIC = stream_format.MAGIC
+
+
+VERSION = 2
+
+
+PREAMBLE_LENGTH = len( MAGIC ) + 5
+
+
+HEADER_BLOCK_SIZE = 4096
+
+
+
+# offset of the segment, length of its ciphertext, length of its plaintext ( before compression ), tag
+
+INDEX_ENTRY = struct.Struct( '>QII16s' )
+
+
+
+# first segment of an append session, nonce prefix of its segments
+
+SESSION_ENTRY = struct.Struct( f'>Q{ dek.SEGMENT_NONCE_PREFIX_LENGTH }s' )
+
+
+
+FOOTER_MAGIC = b'SLCKEND2'
+
+
+APPENDED_FOOTER_MAGIC = b'SLCKEND3'
+
+
+# index offset, segment count, HMAC, FOOTER_MAGIC
+
+FOOTER = struct.Struct( f'>QQ{ stream_format.MAC_LENGTH }s{ len( FOOTER_MAGIC ) }s' )
+
+
+
+MAC_KEY_INFO = b'sharelock container mac'
+
+
+# the 'content' header parameter of a container that holds the manifest of a deduplicated backup ( see dedup )
+
+CHUNK_MANIFEST = 'chunk-manifest'
+
+
+# header parameters that are not covered by the HMAC
+
+UNAUTHENTICATED_PARAMS = [ 'recipients' ]
+
+
+
+
+def new_params( segment_size: int, compression_codec: str = compression.NONE, cipher: str = stream_format.DEFAULT_CIPHER ) -> dict:
+
+    """
+    Header parameters for a new container, with a random nonce prefix and no recipients yet.
+    """
+
+
+    return {
+        'cipher': cipher,
+        'segment_size': segment_size,
+        'nonce_prefix': get_random_bytes( dek.SEGMENT_NONCE_PREFIX_LENGTH ),
+        'compression': compression_codec,
+        'recipients': [ ],
+    }
+
+
+
+
+
+def new_recipient( public_kek: bytes, encrypted_dek: bytes ) -> dict:
+
+    """
+    A recipients entry for a DEK encrypted with 'public_kek'.
+    """
+
+
+    return { 'kek': fingerprint( public_kek ), 'dek': encrypted_dek }
+
+
+
+
+
+def order_recipients( recipients: list[ dict ], kek_fingerprint: str = None ) -> list[ int ]:
+
+    """
+    The indices of the recipients whose DEK to try to decrypt, in order.
+
+    If 'kek_fingerprint' is known, only the recipients encrypted for that key are tried.
+    Otherwise, or if none of the recipients match it, every recipient is tried.
+    """
+
+
+    matching = [ index for index, recipient in enumerate( recipients ) if kek_fingerprint is not None and recipient[ 'kek' ] == kek_fingerprint ]
+
+
+    return matching or list( range( len( recipients ) ) )
+
+
+
+
+
+def build_header( params: dict ) -> bytes:
+
+    """
+    Build the header written before the first segment.
+
+
+    Params:
+    -------
+    params : dict
+        The header parameters. 'nonce_prefix' is given as bytes and 'recipients' as a list of
+        { "kek": fingerprint of the Public Key Encryption Key, "dek": encrypted DEK } with the DEKs as bytes,
+        one for each Key Encryption Key that can decrypt the container.
+        'cipher' names the cipher every segment was encrypted with ( one of dek.CIPHERS ).
+        'compression' names the codec every segment was compressed with before it was encrypted.
+        'content' is set to CHUNK_MANIFEST if the decrypted data is the manifest of a deduplicated backup.
+
+
+    Returns:
+    -------
+    bytes
+        The encoded header, padded to a multiple of HEADER_BLOCK_SIZE
+
+    """
+
+
+    check_segment_size( params[ 'segment_size' ] )
+
+
+    if params[ 'cipher' ] not in dek.CIPHERS:
+
+        raise errors.UsageError( f'Unsupported cipher "{ params[ "cipher" ] }". Use one of: { ", ".join( dek.CIPHERS ) }.' )
+
+
+
+    encoded_params = encode_params( params )
+
+
+    length = -( PREAMBLE_LENGTH + len( encoded_params ) ) % HEADER_BLOCK_SIZE + len( encoded_params )
+
+
+
+    return MAGIC + bytes( [ VERSION ] ) + length.to_bytes( 4, 'big' ) + encoded_params.ljust( length, b' ' )
+
+
+
+
+
+def check_segment_size( segment_size: int ):
+
+    """
+    Check that segments of 'segment_size' bytes can be recorded in the index.
+    """
+
+
+    if segment_size <= 0 or segment_size > stream_format.MAX_SEGMENT_SIZE:
+
+        raise errors.UsageError( f'Segment size ({ segment_size }) must be > 0 and <= { stream_format.MAX_SEGMENT_SIZE }.' )
+
+
+
+
+
+def rewrite_header( header_length: int, params: dict ) -> bytes:
+
+    """
+    Build a header for 'params' that replaces an existing header of 'header_length' bytes without moving the segments.
+
+
+    Raises:
+    -------
+    ValueError
+        If the new parameters do not fit in the space of the existing header.
+
+    """
+
+
+    encoded_params = encode_params( params )
+
+
+    if PREAMBLE_LENGTH + len( encoded_params ) > header_length:
+
+        raise errors.UsageError( 'The new header does not fit in the space of the existing header.' )
+
+
+
+    length = header_length - PREAMBLE_LENGTH
+
+
+    return MAGIC + bytes( [ VERSION ] ) + length.to_bytes( 4, 'big' ) + encoded_params.ljust( length, b' ' )
+
+
+
+
+
+def encode_params( params: dict ) -> bytes:
+
+    encoded = dict( params )
+
+
+    encoded[ 'nonce_prefix' ] = base64.b64encode( params[ 'nonce_prefix' ] ).decode( )
+
+    encoded[ 'recipients' ] = [
+        { 'kek': recipient[ 'kek' ], 'dek': base64.b64encode( recipient[ 'dek' ] ).decode( ) }
+        for recipient in params[ 'recipients' ]
+    ]
+
+
+    return json.dumps( encoded, sort_keys = True ).encode( )
+
+
+
+
+
+def is_container( prefix: bytes ) -> bool:
+
+    """
+    Whether 'prefix' ( the first bytes of a file ) starts a container.
+    """
+
+
+    return stream_format.is_segmented( prefix ) and len( prefix ) > len( MAGIC ) and prefix[ len( MAGIC ) ] == VERSION
+
+
+
+
+
+def read_header( reader ):
+
+    """
+    Read and parse the header at the current position of 'reader'.
+
+
+    Params:
+    -------
+    reader
+        A binary file object positioned at the start of the container
+
+
+    Returns:
+    -------
+    header_length : int
+        The number of bytes before the first segment
+    params : dict
+        The parsed header parameters, with the nonce prefix and the encrypted DEKs decoded to bytes
+
+
+    Raises:
+    -------
+    ValueError
+        If the header is malformed or of an unsupported version.
+
+    """
+
+
+    preamble = stream_format.read_exact( reader, PREAMBLE_LENGTH )
+
+
+    if not is_container( preamble ):
+
+        raise errors.IntegrityError( 'Data is not a sharelock container.' )
+
+
+
+    encoded_params = stream_format.read_exact( reader, int.from_bytes( preamble[ len( MAGIC ) + 1 : ], 'big' ) )
+
+
+    try:
+
+        params = json.loads( bytes( encoded_params ) )
+
+        params[ 'nonce_prefix' ] = base64.b64decode( params[ 'nonce_prefix' ] )
+
+
+        for recipient in params[ 'recipients' ]:
+
+            recipient[ 'dek' ] = base64.b64decode( recipient[ 'dek' ] )
+
+    except Exception:
+
+        raise errors.IntegrityError( 'Could not parse the container header.' )
+
+
+
+    if params.get( 'cipher' ) not in dek.CIPHERS:
+
+        raise errors.IntegrityError( f'Unsupported cipher "{ params.get( "cipher" ) }".' )
+
+
+    if len( params[ 'nonce_prefix' ] ) != dek.SEGMENT_NONCE_PREFIX_LENGTH:
+
+        raise errors.IntegrityError( 'Invalid nonce prefix in the container header.' )
+
+
+    compression.check( params.get( 'compression', compression.NONE ) )
+
+
+
+    return PREAMBLE_LENGTH + len( encoded_params ), params
+
+
+
+
+
+def fingerprint( public_key: bytes ) -> str:
+
+    """
+    Identify a Public Key Encryption Key in the recipients of a container.
+    """
+
+
+    return hashlib.sha256( public_key ).hexdigest( )[ : 32 ]
+
+
+
+
+
+def mac_key( key: bytes ) -> bytes:
+
+    return hmac.new( key, MAC_KEY_INFO, hashlib.sha256 ).digest( )
+
+
+
+
+
+def compute_mac( key: bytes, params: dict, index: bytes, count: int, sessions: bytes = b'' ) -> bytes:
+
+    """
+    HMAC of the authenticated header parameters, the encoded index, the segment count, and the encoded sessions.
+    """
+
+
+    authenticated_params = { name: value for name, value in params.items( ) if name not in UNAUTHENTICATED_PARAMS }
+
+    authenticated_params[ 'nonce_prefix' ] = base64.b64encode( params[ 'nonce_prefix' ] ).decode( )
+
+
+
+    mac = hmac.new( mac_key( key ), MAGIC + bytes( [ VERSION ] ), hashlib.sha256 )
+
+
+    mac.update( json.dumps( authenticated_params, sort_keys = True ).encode( ) )
+
+    mac.update( index )
+
+    mac.update( count.to_bytes( stream_format.COUNT_BYTES, 'big' ) )
+
+    mac.update( sessions )
+
+
+
+    return mac.digest( )
+
+
+
+
+
+def build_index( entries: list[ tuple ] ) -> bytes:
+
+    """
+    Encode the index from a list of ( offset, ciphertext length, plaintext length, tag ) tuples.
+    """
+
+
+    return b''.join( INDEX_ENTRY.pack( *entry ) for entry in entries )
+
+
+
+
+
+def build_sessions( sessions: list[ tuple ] ) -> bytes:
+
+    """
+    Encode the append sessions from a list of ( first segment, nonce prefix ) tuples.
+    """
+
+
+    return b''.join( SESSION_ENTRY.pack( *session ) for session in sessions )
+
+
+
+
+
+def build_footer( key: bytes, params: dict, index_offset: int, index: bytes, sessions: bytes = b'' ) -> bytes:
+
+    """
+    Build the footer written after the index and sessions.
+
+
+    Params:
+    -------
+    key : bytes
+        The DEK
+    params : dict
+        The header parameters
+    index_offset : int
+        The offset of the index in the container
+    index : bytes
+        The encoded index
+    sessions : bytes - default b''
+        The encoded append sessions
+
+    """
+
+
+    count = len( index ) // INDEX_ENTRY.size
+
+    footer_magic = APPENDED_FOOTER_MAGIC if sessions else FOOTER_MAGIC
+
+
+    return FOOTER.pack( index_offset, count, compute_mac( key, params, index, count, sessions ), footer_magic )
+
+
+
+
+
+def read_index( view, key: bytes, params: dict, header_length: int ):
+
+    """
+    Read and authenticate the index at the end of a container.
+
+
+    Params:
+    -------
+    view : memoryview
+        The whole container
+    key : bytes
+        The DEK
+    params : dict
+        The header parameters returned by read_header( )
+    header_length : int
+        The header length returned by read_header( )
+
+
+    Returns:
+    -------
+    entries : list[ tuple[ int, int, int, bytes ] ]
+        The ( offset, ciphertext length, plaintext length, tag ) of each segment, in order
+    sessions : list[ tuple[ int, bytes ] ]
+        The ( first segment, nonce prefix ) of each append session, in order. Pass them to segment_nonce_prefix( ).
+
+
+    Raises:
+    -------
+    ValueError
+        If the index is missing, truncated, or fails authentication.
+
+    """
+
+
+    if len( view ) < header_length + FOOTER.size:
+
+        raise errors.IntegrityError( 'Unexpected end of encrypted data. The encrypted file may have been truncated.' )
+
+
+
+    index_offset, count, expected_mac, footer_magic = FOOTER.unpack( view[ len( view ) - FOOTER.size : ] )
+
+
+    index_end = index_offset + count * INDEX_ENTRY.size
+
+    sessions_length = len( view ) - FOOTER.size - index_end
+
+
+
+    if footer_magic == FOOTER_MAGIC:
+
+        valid_sessions = sessions_length == 0
+
+    else:
+
+        valid_sessions = footer_magic == APPENDED_FOOTER_MAGIC and sessions_length > 0 and sessions_length % SESSION_ENTRY.size == 0
+
+
+    if not valid_sessions or index_offset < header_length:
+
+        raise errors.IntegrityError( 'The container index is missing. The encrypted file may have been truncated.' )
+
+
+
+    index = view[ index_offset : index_end ]
+
+    encoded_sessions = view[ index_end : len( view ) - FOOTER.size ]
+
+
+    if not hmac.compare_digest( expected_mac, compute_mac( key, params, index, count, encoded_sessions ) ):
+
+        raise errors.IntegrityError( 'The container index failed authentication. The encrypted file may have been modified.' )
+
+
+
+    entries = list( INDEX_ENTRY.iter_unpack( index ) )
+
+
+    for offset, ciphertext_length, _, _ in entries:
+
+        if offset < header_length or offset + ciphertext_length > index_offset:
+
+            raise errors.IntegrityError( 'The container index points outside of the segments.' )
+
+
+
+    sessions = list( SESSION_ENTRY.iter_unpack( encoded_sessions ) )
+
+
+    first_segments = [ first for first, _ in sessions ]
+
+
+    if first_segments != sorted( set( first_segments ) ) or any( first >= count for first in first_segments ):
+
+        raise errors.IntegrityError( 'The container sessions do not match the index.' )
+
+
+
+    return entries, sessions
+
+
+
+
+
+def segment_nonce_prefix( params: dict, sessions: list[ tuple ], index: int ) -> bytes:
+
+    """
+    The nonce prefix of segment 'index': that of the last append session starting at or before it,
+    or the 'nonce_prefix' header parameter for the segments written before the first append.
+    """
+
+
+    position = bisect.bisect_right( sessions, ( index, b'\xff' * dek.SEGMENT_NONCE_PREFIX_LENGTH ) )
+
+
+    return sessions[ position - 1 ][ 1 ] if position else params[ 'nonce_prefix' ]
+
+
+
+
+
+def segment_range( entries: list[ tuple ], offset: int = 0, length: int = None ):
+
+    """
+    Find the segments that hold a range of the decrypted data.
+
+
+    Params:
+    -------
+    entries : list[ tuple ]
+        The index entries returned by read_index( )
+    offset : int - default 0
+        The offset in the decrypted data of the start of the range
+    length : int | None - default None
+        The length of the range. If set to None, the range ends at the end of the data.
+
+
+    Returns:
+    -------
+    selected : range
+        The indices of the segments that hold the range ( every segment for the whole data )
+    starts : list[ int ]
+        The offset in the decrypted data of each segment, followed by the length of the decrypted data
+    range_end : int
+        The end of the range, limited to the length of the decrypted data
+
+    """
+
+
+    starts = list( itertools.accumulate( ( entry[ 2 ] for entry in entries ), initial = 0 ) )
+
+
+    range_end = starts[ -1 ] if length is None else min( offset + length, starts[ -1 ] )
+
+
+
+    if offset == 0 and length is None:
+
+        selected = range( len( entries ) )
+
+    elif offset >= range_end:
+
+        selected = range( 0 )
+
+    else:
+
+        selected = range( bisect.bisect_right( starts, offset, 0, len( entries ) ) - 1, bisect.bisect_left( starts, range_end, 0, len( entries ) ) )
+
+
+
+    return selected, starts, range_end
+
+
+
+
+
+class IndexBuilder:
+
+    """
+    Keeps track of the segments written to a container and builds the index and footer written after them.
+    """
+
+
+
+    def __init__( self, offset: int, entries: list[ tuple ] = ( ), sessions: list[ tuple ] = ( ) ):
+
+        """
+        Start recording segments written from 'offset' ( the header length of a new container ).
+        When appending to a container, 'entries' and 'sessions' are the segments and append sessions it already holds
+        and 'offset' is the end of the segments.
+        """
+
+
+        self.entries = list( entries )
+
+        self.sessions = list( sessions )
+
+        self.offset = offset
+
+
+
+
+    def start_session( self ):
+
+        """
+        Start an append session: the segments added from now on use a fresh random nonce prefix.
+        """
+
+
+        self.sessions.append( ( len( self.entries ), get_random_bytes( dek.SEGMENT_NONCE_PREFIX_LENGTH ) ) )
+
+
+
+
+    def nonce_prefix( self, params: dict ) -> bytes:
+
+        """
+        The nonce prefix of the segments added from now on.
+        """
+
+
+        return self.sessions[ -1 ][ 1 ] if self.sessions else params[ 'nonce_prefix' ]
+
+
+
+
+    def add( self, ciphertext_length: int, plaintext_length: int, tag: bytes ):
+
+        """
+        Record the segment written at the current offset.
+        """
+
+
+        self.entries.append( ( self.offset, ciphertext_length, plaintext_length, tag ) )
+
+        self.offset += ciphertext_length
+
+
+
+
+    def finish( self, key: bytes, params: dict ) -> bytes:
+
+        """
+        Build the index, sessions, and footer of the recorded segments.
+        """
+
+
+        # an append session that added no segments used no nonces, so it is left out
+
+        if self.sessions and self.sessions[ -1 ][ 0 ] == len( self.entries ):
+
+            self.sessions.pop( )
+
+
+        index = build_index( self.entries )
+
+        sessions = build_sessions( self.sessions )
+
+
+        return index + sessions + build_footer( key, params, self.offset, index, sessions )
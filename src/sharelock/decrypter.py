@@ -10,8 +10,12 @@ Module for performing decryption.
 import sys
 
 
+import json
+
 import base64
 
+import contextlib
+
 
 from pathlib import Path
 
@@ -24,10 +28,37 @@ import sharelock.shamir_secret_sharing as sss
 import sharelock.kek as kek
 
 
+import sharelock.errors as errors
+
+
+import sharelock.agent as agent
+
+
 import sharelock.dek as dek
 
+import sharelock.mapping as mapping
+
+import sharelock.parallel as parallel
+
+import sharelock.stream_format as stream_format
+
+import sharelock.container as container
+
+import sharelock.dedup as dedup
+
+import sharelock.compression as compression
+
+import sharelock.stats as stats
+
+
+
+
 
 
+# DEK file read for data that is not a container when no DEK file is given
+
+DEFAULT_DEK_FILE = 'DEK.bin'
+
 
 
 
@@ -35,205 +66,1049 @@ class Decrypter:
 
 
 
-    def __init__( self ):
+    def __init__( self, phase_stats = stats.NULL_STATS, default_dek_filename: str = DEFAULT_DEK_FILE ):
+
+        """
+        'default_dek_filename' is the DEK file of data that is not a container when none is given.
+        If set to None, such data can only be decrypted with a DEK file given for it.
+        """
+
 
-        pass
+        self.stats = phase_stats
 
+        self.default_dek_filename = default_dek_filename
 
 
 
-    def decrypt( self, encrypted_data_filename: str, encrypted_dek_filename: str ):
+
+    def decrypt( self, encrypted_data, encrypted_dek_filename: str = None, jobs: int = 1, agent_socket: str = None, offset: int = 0, length: int = None, queue_depth: int = None, output = None, private_kek: bytes = None, chunk_store: str = None ):
 
         """
 
-        Perform decryption on an encrypted file. Writes the decrypted data to stdout.
+        Perform decryption on encrypted data. Writes the decrypted data to stdout ( or 'output' ).
 
 
         Params:
         -------
-        encrypted_data_filename : str
-            The filename at which resides the encrypted ( with the DEK ) data.
-        encrypted_dek_filename : str
+        encrypted_data : str | Path | bytes | binary file object
+            The encrypted ( with the DEK ) data: its filename, the data itself, or an open file.
+        encrypted_dek_filename : str | None - default None
             The filename at which resides the encrypted ( with the KEK ) DEK.
+            If set to None, the DEK embedded in a container is used ( or the default DEK file for other data ).
+        jobs : int - default 1
+            The number of segments to decrypt in parallel.
+        agent_socket : str | None - default None
+            The socket of a running agent to decrypt the DEK with.
+        offset : int - default 0
+            The offset in the decrypted data of the first byte to write. Only containers can be decrypted from an offset.
+        length : int | None - default None
+            The number of bytes to write. If set to None, write everything after 'offset'.
+            Only the segments that hold the requested bytes are read and decrypted.
+        queue_depth : int | None - default None
+            The number of segments that may be decrypted ahead of the writer. See parallel.pipeline( ).
+        output : str | Path | binary file object | None - default None
+            The filename at which to write the decrypted data, or an open file to write it to. If set to None, write to stdout.
+        private_kek : bytes | None - default None
+            The Private Key Encryption Key to decrypt the DEK with.
+            If neither this nor 'agent_socket' is set, key shares are read from stdin.
+        chunk_store : str | None - default None
+            The directory of the chunk store to reassemble the data from, if 'encrypted_data' is the manifest of a deduplicated backup.
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the data or keys can not be read, the output can not be written, or the data fails authentication.
+
+        """
+
+
+
+        # map encrypted data and read dek from file
+
+        try:
+
+            encrypted_file = mapping.open_source( encrypted_data )
+
+        except OSError:
+
+            raise errors.InputError( f'Could not read encrypted data from { mapping.describe( encrypted_data ) }.' )
+
+
+
+        with encrypted_file:
+
+
+            if ( offset != 0 or length is not None ) and not container.is_container( encrypted_file.view ):
+
+                raise errors.UsageError( f'Could not decrypt a byte range of { mapping.describe( encrypted_data ) }. Only containers have the segment index needed to decrypt a range.' )
+
+
+            if chunk_store is None and self.is_chunk_manifest( encrypted_file.view ):
+
+                raise errors.UsageError( f'The encrypted data in { mapping.describe( encrypted_data ) } is the manifest of a deduplicated backup. Give the chunk store to reassemble it from.' )
+
+
+            recipients = self.read_recipients( encrypted_data, encrypted_dek_filename, encrypted_file.view )
+
+
+
+
+
+            # decrypt dek with the given key, the agent, or the key shares on stdin
+
+            decrypted_dek, = self.decrypt_deks( [ recipients ], agent_socket = agent_socket, private_kek = private_kek )
+
+
+
+
+            # decrypt data and write it to the output as it is decrypted
+
+            if output is None:
+
+                output_file, output_name = contextlib.nullcontext( sys.stdout.buffer ), 'stdout'
+
+            elif hasattr( output, 'write' ):
+
+                output_file, output_name = contextlib.nullcontext( output ), mapping.describe( output )
+
+            else:
+
+                try:
+
+                    output_file, output_name = Path( output ).resolve( ).open( 'wb' ), mapping.describe( output )
+
+                except OSError:
+
+                    raise errors.OutputError( f'Could not write decrypted data to { mapping.describe( output ) }.' )
+
+
+
+            with output_file as opened_output_file:
+
+                self.write_decrypted( encrypted_file, decrypted_dek, opened_output_file, output_name, jobs, offset, length, queue_depth, chunk_store )
+
+
+
+
+    def decrypt_many( self, encrypted_files: list[ tuple[ str, str, str ] ], output_directory: str, jobs: int = 1, agent_socket: str = None, queue_depth: int = None ):
+
+        """
+
+        Decrypt many files after reading and combining the key shares only once.
+
+        All DEKs are unwrapped in parallel first, then 'jobs' files at a time are decrypted into 'output_directory'.
+
+
+        Params:
+        -------
+        encrypted_files : list[ tuple[ str, str, str ] ]
+            A list of ( encrypted data filename, encrypted DEK filename, output path relative to 'output_directory' ) tuples.
+            The DEK filename is None for containers.
+        output_directory : str
+            The directory in which to write the decrypted files.
+        jobs : int - default 1
+            The number of DEKs to unwrap and files to decrypt in parallel.
+        agent_socket : str | None - default None
+            The socket of a running agent to decrypt the DEKs with. If set to None, read key shares from stdin.
+        queue_depth : int | None - default None
+            The number of segments of each file that may be decrypted ahead of the writer. See parallel.pipeline( ).
+
+        """
+
+
+        output_directory = Path( output_directory ).resolve( )
+
+
+
+        # read every dek before asking for shares
+
+        recipient_lists = [ ]
+
+
+        for encrypted_data_filename, encrypted_dek_filename, output_path in encrypted_files:
+
+
+            if not ( output_directory / output_path ).resolve( ).is_relative_to( output_directory ):
+
+                raise errors.UsageError( f'Refusing to write "{ output_path }" outside of "{ output_directory }".' )
+
+
+            recipient_lists.append( self.read_recipients( encrypted_data_filename, encrypted_dek_filename ) )
+
+
+
+
+        # decrypt deks after reading the key shares once ( or with the agent )
+
+        decrypted_deks = self.decrypt_deks( recipient_lists, jobs, agent_socket )
+
+
+
+
+        # decrypt data into the output directory
+
+        def decrypt_file( entry ):
+
+
+            ( encrypted_data_filename, _, output_path ), decrypted_dek = entry
+
+
+            output_filename = output_directory / output_path
+
+
+
+            try:
+
+                encrypted_file = mapping.MappedFile( Path( encrypted_data_filename ).resolve( ) )
+
+            except OSError:
+
+                raise errors.InputError( f'Could not read encrypted data from file at "{ encrypted_data_filename }".' )
+
+
+
+            try:
+
+                output_filename.parent.mkdir( parents = True, exist_ok = True )
+
+
+                output_file = output_filename.open( 'wb' )
+
+            except OSError:
+
+                encrypted_file.close( )
+
+                raise errors.OutputError( f'Could not write decrypted data to file at "{ output_filename }".' )
+
+
+
+            with output_file:
+
+                self.write_decrypted( encrypted_file, decrypted_dek, output_file, f'file at "{ output_filename }"', queue_depth = queue_depth )
+
+
+
+        for _ in parallel.ordered_map( decrypt_file, zip( encrypted_files, decrypted_deks ), jobs ):
+
+            pass
+
+
+
+
+    def decrypt_deks( self, recipient_lists: list[ list[ dict ] ], jobs: int = 1, agent_socket: str = None, private_kek: bytes = None ):
+
+        """
+
+        Decrypt DEKs with the Private Key Encryption Key. See open_recipients( ).
+
+
+        Returns:
+        -------
+        list[ bytes ]
+            The decrypted DEKs, in order
 
         """
 
 
+        return [ decrypted_dek for _, decrypted_dek in self.open_recipients( recipient_lists, jobs, agent_socket, private_kek ) ]
+
+
+
+
+    def open_recipients( self, recipient_lists: list[ list[ dict ] ], jobs: int = 1, agent_socket: str = None, private_kek: bytes = None, skip_failures: bool = False ):
+
+        """
+
+        Decrypt one DEK of each list of recipients with the Private Key Encryption Key.
+        Unless 'private_kek' is given, the key shares are read from stdin and combined once.
+        If 'agent_socket' is set, the agent holding the combined key decrypts them instead.
+
+        The recipient encrypted for the combined key is found by its fingerprint. The agent tries each recipient in turn.
+
+
+        Params:
+        -------
+        recipient_lists : list[ list[ dict ] ]
+            The recipients of each file, as returned by read_recipients( )
+        jobs : int - default 1
+            The number of files whose DEK to decrypt in parallel
+        agent_socket : str | None - default None
+            The socket of a running agent
+        private_kek : bytes | None - default None
+            The Private Key Encryption Key
+        skip_failures : bool - default False
+            If set to True, files none of whose DEKs can be decrypted with the key get None instead of failing every file
+
+
+        Returns:
+        -------
+        list[ tuple[ int, bytes ] | None ]
+            The index of the recipient that was decrypted and the decrypted DEK of each file, in order
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the key shares are invalid, the agent fails, or no DEK of a file can be decrypted with the key.
+
+        """
+
+
+        if agent_socket is not None:
+
+
+            unwrap = agent.AgentClient( agent_socket ).unwrap
+
+
+            kek_fingerprint = None
+
+
+        else:
+
+
+            # get private key from the shares on stdin
+
+            if private_kek is None:
+
+                private_kek = self.read_private_kek( )
+
+
+            kek_context = kek.KEK( )
+
+
+            unwrap = lambda encrypted_dek: kek_context.unwrap( encrypted_dek, private_kek )
+
+
+            public_kek = kek_context.public_key( private_kek )
+
+
+            kek_fingerprint = container.fingerprint( public_kek ) if public_kek is not None else None
+
+
+
+
+        def open_recipient( recipients ):
+
+
+            failure = errors.IntegrityError( 'The encrypted data has no DEK.' )
+
+
+            for index in container.order_recipients( recipients, kek_fingerprint ):
+
+
+                try:
+
+                    return index, unwrap( recipients[ index ][ 'dek' ] )
+
+                except ValueError as e:
+
+                    failure = e
+
+
+            if skip_failures:
+
+                return None
+
+
+            raise failure
+
 
-        # read dek and encrypted data from file
 
         try:
 
-            encrypted_data = Path( encrypted_data_filename ).resolve( ).read_bytes( )
+            return list( parallel.ordered_map( self.stats.timed( 'unwrap_dek', open_recipient ), recipient_lists, jobs ) )
+
+
+        except ValueError as e:
+
+
+            if agent_socket is not None:
+
+                raise errors.AgentError( f'Could not decrypt DEK with the agent: { e.args[ 0 ] }' )
+
 
-        except:
+            raise errors.IntegrityError( 'Could not perform decryption. Either the keys are wrong or the encrypted data has been modified.' )
+
+
+
+
+    def read_manifest( self, manifest_filename: str ):
+
+        """
+
+        Read the manifest written by Encrypter.encrypt_many( ).
+        Manifests of containers have no DEK filenames.
+
+
+        Params:
+        -------
+        manifest_filename : str
+            The filename of the manifest. Paths in it are relative to its directory.
+
+
+        Returns:
+        -------
+        list[ tuple[ str, str, str ] ]
+            A list of ( encrypted data filename, encrypted DEK filename, output path ) tuples for decrypt_many( ).
+
+        """
 
-            print( f'Could not read encrypted data from file at "{ encrypted_data_filename }".', file = sys.stderr )
 
-            exit( 1 )
+        manifest_path = Path( manifest_filename ).resolve( )
 
 
         try:
 
-            encrypted_dek = Path( encrypted_dek_filename ).resolve( ).read_bytes( )
+            manifest = json.loads( manifest_path.read_text( ) )
+
+
+            return [
+                ( str( manifest_path.parent / entry[ 'data' ] ), str( manifest_path.parent / entry[ 'dek' ] ) if 'dek' in entry else None, entry[ 'source' ] )
+                for entry in manifest[ 'files' ]
+            ]
+
+        except ( OSError, ValueError, KeyError, TypeError ):
+
+            raise errors.InputError( f'Could not read manifest from file at "{ manifest_filename }".' )
+
+
+
+
+    def write_decrypted( self, encrypted_file, key: bytes, output_file, output_name: str, jobs: int = 1, offset: int = 0, length: int = None, queue_depth: int = None, chunk_store: str = None ):
+
+        """
+
+        Decrypt a mapped encrypted file and write the data to 'output_file' as it is decrypted.
+
+
+        Params:
+        -------
+        encrypted_file : mapping.MappedFile
+            The mapped encrypted data. It is closed once decrypted.
+        key : bytes
+            The decrypted DEK
+        output_file
+            The binary file object to write the decrypted data to
+        output_name : str
+            A description of 'output_file' for error messages
+        jobs : int - default 1
+            The number of segments to decrypt in parallel
+        offset : int - default 0
+            The offset in the decrypted data of the first byte to write ( containers only )
+        length : int | None - default None
+            The number of bytes to write. If set to None, write everything after 'offset' ( containers only ).
+        queue_depth : int | None - default None
+            The number of segments that may be decrypted ahead of the writer. See parallel.pipeline( ).
+        chunk_store : str | None - default None
+            The directory of the chunk store to reassemble the data from, if the container holds the manifest of a deduplicated backup
+
+        """
+
+
+        with encrypted_file:
+
+
+            reader = mapping.BufferReader( encrypted_file.view )
+
+
+
+            if self.is_chunk_manifest( encrypted_file.view ):
+
+
+                if chunk_store is None:
+
+                    raise errors.UsageError( f'Could not write decrypted data to { output_name }: the encrypted data is the manifest of a deduplicated backup and no chunk store was given.' )
+
+
+                decrypted_chunks = self.reassemble_chunks( encrypted_file.view, key, chunk_store, jobs, offset, length, queue_depth )
+
+            elif container.is_container( encrypted_file.view ):
+
+                decrypted_chunks = self.decrypt_container( encrypted_file.view, key, jobs, encrypted_file.release_before, offset, length, queue_depth )
 
-        except:
+            elif stream_format.is_segmented( encrypted_file.view ):
 
-            print( f'Could not read encrypted DEK from file at "{ encrypted_dek_filename }".', file = sys.stderr )
+                raise errors.IntegrityError( 'Could not decrypt data: unsupported format version.' )
 
-            exit( 1 )
+            else:
 
+                decrypted_chunks = self.decrypt_unsegmented( reader, key, encrypted_file.release_before )
 
 
 
+            try:
 
-        # read shares from stdin
+                for decrypted_chunk in decrypted_chunks:
 
-        input_shares = self.read_shares( )
+                    with self.stats.phase( 'write_output', len( decrypted_chunk ) ):
 
+                        output_file.write( decrypted_chunk )
 
 
-        # get private key from shares
+                with self.stats.phase( 'write_output' ):
 
-        private_kek = sss.combine( input_shares )
+                    output_file.flush( )
 
 
+            except ValueError as e:
 
-        # decrypt dek
+                raise errors.IntegrityError( f'Could not decrypt data using DEK: { e.args[ 0 ] }' )
 
-        kek_context = kek.KEK( )
 
+            except OSError:
 
-        decrypted_dek_file = kek_context.decrypt( encrypted_dek, private_kek )
+                raise errors.OutputError( f'Could not write decrypted data to { output_name }.' )
 
 
-        decrypted_dek = decrypted_dek_file
 
 
+    def decrypt_container( self, view, key: bytes, jobs: int = 1, release = None, offset: int = 0, length: int = None, queue_depth: int = None, decompress: bool = True ):
 
+        """
+
+        Decrypt and authenticate a container one segment at a time.
+        The index is authenticated before the first segment is decrypted.
+
+        With 'offset' or 'length', only the segments holding the requested range of the decrypted data are decrypted.
+
+
+        Params:
+        -------
+        view : memoryview
+            The whole container
+        key : bytes
+            The decrypted DEK
+        jobs : int - default 1
+            The number of segments to decrypt in parallel
+        release : callable | None - default None
+            Called with the offset up to which the data has been decrypted and yielded
+        offset : int - default 0
+            The offset in the decrypted data of the first byte to yield
+        length : int | None - default None
+            The number of bytes to yield. If set to None, yield everything after 'offset'.
+        queue_depth : int | None - default None
+            The number of segments that may be decrypted ahead of the caller. See parallel.pipeline( ).
+        decompress : bool - default True
+            If set to False, compressed segments are yielded as they were decrypted, without decompressing them
+            ( for verifying: the tag and the index already authenticate them ). Only use it for the whole data.
+
+
+        Yields:
+        -------
+        bytes
+            The decrypted segments ( or the parts of them inside the requested range ), in order
+
+
+        Raises:
+        -------
+        ValueError
+            If the container is malformed or any part of it fails authentication.
+
+        """
+
+
+        header_length, params = container.read_header( mapping.BufferReader( view ) )
+
+
+        entries, sessions = container.read_index( view, key, params, header_length )
+
+
+
+        selected, starts, range_end = container.segment_range( entries, offset, length )
+
+
+
+        def decrypt_segment( index ):
+
+
+            segment_offset, ciphertext_length, _, _ = entries[ index ]
+
+
+            decrypted_segment = self.decrypt_container_segment( view, key, params, entries, sessions, index, decompress )
+
+
+            return index, decrypted_segment, segment_offset + ciphertext_length
+
+
+
+        decrypted_segments = parallel.pipeline( decrypt_segment, selected, jobs, queue_depth )
+
+
+
+        for index, decrypted_segment, end in decrypted_segments:
+
+
+            if starts[ index ] < offset or starts[ index + 1 ] > range_end:
+
+                decrypted_segment = memoryview( decrypted_segment )[ max( offset - starts[ index ], 0 ) : range_end - starts[ index ] ]
+
+
+            yield decrypted_segment
+
+
+            if release is not None:
+
+                release( end )
+
+
+
+
+    def decrypt_container_segment( self, view, key: bytes, params: dict, entries: list[ tuple ], sessions: list[ tuple ], index: int, decompress: bool = True ):
+
+        """
+
+        Decrypt, authenticate, and decompress one segment of a container.
+
+
+        Params:
+        -------
+        view : memoryview
+            The whole container
+        key : bytes
+            The decrypted DEK
+        params : dict
+            The header parameters returned by container.read_header( )
+        entries, sessions
+            The index entries and append sessions returned by container.read_index( )
+        index : int
+            The index of the segment
+        decompress : bool - default True
+            If set to False, a compressed segment is returned as it was decrypted. See decrypt_container( ).
+
+
+        Returns:
+        -------
+        bytes
+            The decrypted segment
+
+
+        Raises:
+        -------
+        ValueError
+            If the segment fails authentication or does not have the length recorded in the index.
+
+        """
+
+
+        segment_offset, ciphertext_length, plaintext_length, tag = entries[ index ]
+
+
+        codec = params.get( 'compression', compression.NONE )
+
+
+
+        with self.stats.phase( 'decrypt', ciphertext_length ):
+
+            nonce_prefix = container.segment_nonce_prefix( params, sessions, index )
+
+            decrypted_segment = dek.DEK( ).decrypt_segment( view[ segment_offset : segment_offset + ciphertext_length ], tag, key, nonce_prefix, index, params[ 'cipher' ] )
+
+
+
+        if codec == compression.NONE:
+
+            if len( decrypted_segment ) != plaintext_length:
+
+                raise errors.IntegrityError( f'Segment { index } does not have the length recorded in the index.' )
+
+
+        elif decompress:
+
+            with self.stats.phase( 'decompress', plaintext_length ):
+
+                decrypted_segment = compression.decompress( codec, decrypted_segment, plaintext_length )
+
+
+
+        return decrypted_segment
+
+
+
+
+    def is_chunk_manifest( self, view ) -> bool:
+
+        """
+        Whether 'view' is a container holding the manifest of a deduplicated backup.
+        """
+
+
+        if not container.is_container( view ):
+
+            return False
+
+
+        _, params = container.read_header( mapping.BufferReader( view ) )
+
+
+        return params.get( 'content' ) == container.CHUNK_MANIFEST
+
+
+
+
+    def reassemble_chunks( self, view, key: bytes, chunk_store: str, jobs: int = 1, offset: int = 0, length: int = None, queue_depth: int = None ):
+
+        """
+
+        Decrypt the manifest of a deduplicated backup and reassemble the data from the chunk store one chunk at a time.
+
+        With 'offset' or 'length', only the chunks holding the requested range of the data are read and decrypted.
+
+
+        Params:
+        -------
+        view : memoryview
+            The container holding the manifest
+        key : bytes
+            The decrypted DEK of the manifest
+        chunk_store : str
+            The directory of the chunk store
+        jobs : int - default 1
+            The number of chunks to read and decrypt in parallel
+        offset : int - default 0
+            The offset in the data of the first byte to yield
+        length : int | None - default None
+            The number of bytes to yield. If set to None, yield everything after 'offset'.
+        queue_depth : int | None - default None
+            The number of chunks that may be decrypted ahead of the caller. See parallel.pipeline( ).
+
+
+        Yields:
+        -------
+        bytes
+            The decrypted chunks ( or the parts of them inside the requested range ), in order
+
+        """
+
+
+        chunks = dedup.read_manifest( b''.join( self.decrypt_container( view, key, jobs ) ) )
+
+
+        store = dedup.ChunkStore( chunk_store, self.stats )
+
+
+
+        # a manifest entry has the chunk length at the same position as the plaintext length of an index entry
+
+        selected, starts, range_end = container.segment_range( chunks, offset, length )
+
+
+
+        def read_chunk( index ):
+
+            chunk_id, chunk_key, chunk_length = chunks[ index ]
+
+            return index, store.get( chunk_id, chunk_key, chunk_length )
+
+
+
+        for index, decrypted_chunk in parallel.pipeline( read_chunk, selected, jobs, queue_depth ):
 
-        # decrypt data and write to stdout
 
+            if starts[ index ] < offset or starts[ index + 1 ] > range_end:
 
-        dek_context = dek.DEK( )
+                decrypted_chunk = memoryview( decrypted_chunk )[ max( offset - starts[ index ], 0 ) : range_end - starts[ index ] ]
 
 
-        encrypted_data, nonce = self.parse_encrypted_data( encrypted_data )
+            yield decrypted_chunk
 
 
-        decrypted_data = dek_context.decrypt( encrypted_data, decrypted_dek, nonce )
 
 
-        sys.stdout.buffer.write( decrypted_data )
+    def decrypt_unsegmented( self, reader, key: bytes, release = None ):
 
+        """
+
+        Decrypt data in the original layout ( nonce followed by the ciphertext ) one chunk at a time.
+
+
+        Params:
+        -------
+        reader
+            A binary file object positioned at the start of the encrypted data
+        key : bytes
+            The decrypted DEK
+        release : callable | None - default None
+            Called with the reader position up to which the data has been decrypted and yielded
+
+
+        Yields:
+        -------
+        bytes
+            The decrypted chunks, in order
+
+        """
+
+
+        nonce = stream_format.read_exact( reader, dek.NONCE_LENGTH )
+
+
+
+        for decrypted_chunk in self.stats.timed_iter( 'decrypt', dek.DEK( ).decrypt_stream( reader, key, nonce, stream_format.DEFAULT_SEGMENT_SIZE ) ):
 
 
+            yield decrypted_chunk
 
-    def read_shares( self ):
+
+            if release is not None:
+
+                release( reader.tell( ) )
+
+
+
+
+    def read_recipients( self, encrypted_data, encrypted_dek_filename: str = None, view: memoryview = None ):
 
         """
 
-        Read key shares from stdin and decode them.
+        Read the encrypted DEKs of encrypted data.
+
+
+        Params:
+        -------
+        encrypted_data : str | Path | bytes | binary file object
+            The encrypted data, or its filename
+        encrypted_dek_filename : str | None - default None
+            The filename of the encrypted DEK. If set to None, the DEKs are read from the header of a container,
+            or from the default DEK file if the data is not a container.
+        view : memoryview | None - default None
+            The contents of 'encrypted_data' if they have already been read. If set to None, the file at 'encrypted_data' is read.
+
+
+        Returns:
+        -------
+        list[ dict ]
+            The recipients: { "kek": fingerprint of the Public Key Encryption Key, "dek": encrypted DEK } for each key the DEK was encrypted for.
+            The fingerprint of a DEK read from a file is None.
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the data or the DEK file can not be read, or the container header is malformed.
 
         """
 
 
+        if encrypted_dek_filename is None:
+
+
+            try:
+
+                with self.stats.phase( 'read_dek' ):
+
+
+                    if view is not None:
+
+                        recipients = self.embedded_recipients( mapping.BufferReader( view ) )
+
+                    else:
+
+                        with Path( encrypted_data ).resolve( ).open( 'rb' ) as encrypted_file:
+
+                            recipients = self.embedded_recipients( encrypted_file )
+
+            except ValueError as e:
+
+                raise errors.IntegrityError( f'Could not read encrypted DEK from { mapping.describe( encrypted_data ) }: { e.args[ 0 ] }' )
+
+            except OSError:
+
+                raise errors.InputError( f'Could not read encrypted data from { mapping.describe( encrypted_data ) }.' )
+
+
+
+            if recipients is not None:
+
+                return recipients
+
+
+            if self.default_dek_filename is None:
+
+                raise errors.UsageError( f'The encrypted data in { mapping.describe( encrypted_data ) } is not a container. Give the file holding its encrypted DEK.' )
+
+
+            encrypted_dek_filename = self.default_dek_filename
+
+
+
         try:
 
-            shares_text = sys.stdin.read( )
+            with self.stats.phase( 'read_dek' ):
 
+                return [ { 'kek': None, 'dek': Path( encrypted_dek_filename ).resolve( ).read_bytes( ) } ]
 
-            base64_encoded_shares = shares_text.split( '\n' )
+        except OSError:
 
-        except:
+            raise errors.InputError( f'Could not read encrypted DEK from file at "{ encrypted_dek_filename }".' )
 
-            print( 'Could not decode stdin as valid key shares. Key shares should be in the form:', file = sys.stderr )
 
-            print( '{ index } - { base64 encoded share value }', file = sys.stderr )
 
-            print( 'With one entry on each line.', file = sys.stderr )
 
+    def embedded_recipients( self, reader ):
 
-            exit( 1 )
+        """
 
+        Read the recipients from the header of a container.
 
 
-        shares = [ ]
+        Params:
+        -------
+        reader
+            A binary file object positioned at the start of the encrypted data
 
 
+        Returns:
+        -------
+        list[ dict ] | None
+            The recipients, or None if the data is not a container
 
+        """
 
-        for encoded_share in base64_encoded_shares:
 
+        if not container.is_container( reader.read( container.PREAMBLE_LENGTH ) ):
 
-            if len( encoded_share.strip( ) ) == 0:
+            return None
 
-                continue
 
 
-            shares.append( self.decode_share( encoded_share ) )
+        reader.seek( 0 )
 
 
+        _, params = container.read_header( reader )
 
-        return shares
 
+        return params[ 'recipients' ]
 
 
 
-    def decode_share( self, encoded_share: str ):
+
+    def read_private_kek( self ):
+
         """
-        Decode a single encoded share.
+
+        Read key shares from stdin and combine them into the Private Key Encryption Key.
+
+        """
+
+
+        try:
+
+            with self.stats.phase( 'read_shares' ):
+
+                shares_text = sys.stdin.read( )
+
+        except ( OSError, ValueError ):
+
+            raise errors.KeyShareError(
+                'Could not decode stdin as valid key shares. Key shares should be in the form:\n'
+                '{ index } - { base64 encoded share value }\n'
+                'With one entry on each line.'
+            )
+
+
+
+        return self.combine_shares( shares_text )
+
+
+
+
+    def combine_shares( self, encoded_shares ):
+
+        """
+
+        Decode key shares and combine them into the Private Key Encryption Key.
 
 
         Params:
         -------
-        encoded_share : str
-            An encoded share value.
+        encoded_shares : str | list[ str ]
+            The encoded shares, one per line or one per list item.
             In the form: { share number } - { base64 encoded share }
+
+
+        Returns:
+        -------
+        bytes
+            The Private Key Encryption Key
+
+
+        Raises:
+        -------
+        sharelock.errors.KeyShareError
+            If the shares can not be decoded or combined.
+
         """
 
 
+        if isinstance( encoded_shares, str ):
 
-        splitted = encoded_share.split( '-' )
+            encoded_shares = encoded_shares.split( '\n' )
 
 
 
-        index = int( splitted[ 0 ].strip( ) )
+        try:
 
+            shares = [ self.decode_share( encoded_share ) for encoded_share in encoded_shares if len( encoded_share.strip( ) ) != 0 ]
 
-        share_value = '-'.join( splitted[ 1: ] ).strip( )
 
+            if not shares:
 
-        share = base64.b64decode( share_value ) 
+                raise ValueError( 'No key shares were given.' )
 
 
-        return ( index, share )
+            with self.stats.phase( 'combine_shares' ):
 
+                return sss.combine( shares )
 
+        except ValueError as e:
 
+            raise errors.KeyShareError( f'Could not combine key shares: { e.args[ 0 ] }' )
 
 
-    def parse_encrypted_data( self, encrypted_data: bytes ):
 
-        """
 
-        Separate the encrypted data from its nonce.
+    def decode_share( self, encoded_share: str ):
+        """
+        Decode a single encoded share.
 
 
         Params:
-        ------
-        encrypted_data : bytes
-            The input data to separate
+        -------
+        encoded_share : str
+            An encoded share value.
+            In the form: { share number } - { base64 encoded share }
+
 
+        Raises:
+        -------
+        ValueError
+            If the share is not in that form, or its value is empty or not a whole number of blocks.
         """
 
 
-        nonce = encrypted_data[ : dek.NONCE_LENGTH ]
 
+        splitted = encoded_share.split( '-' )
 
-        encrypted_data = encrypted_data[ dek.NONCE_LENGTH : ]
 
 
-        return ( encrypted_data, nonce )
+        index = int( splitted[ 0 ].strip( ) )
+
+
+        share_value = '-'.join( splitted[ 1: ] ).strip( )
+
+
+        share = base64.b64decode( share_value, validate = True )
+
+
+
+        if len( share ) == 0 or len( share ) % sss.SHAMIR_SPLIT_LENGTH != 0:
+
+            raise ValueError( f'Share { index } must be a non-empty multiple of { sss.SHAMIR_SPLIT_LENGTH } bytes.' )
+
+
+
+        return ( index, share )
+
 
 
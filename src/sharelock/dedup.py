@@ -0,0 +1,762 @@
+"""
+
+This module stores data as deduplicated, encrypted chunks.
+
+Data is split into chunks at boundaries chosen by the content itself, so inserting or removing data only changes the
+chunks around the change. Chunks already in the store are not encrypted or written again, so a backup that is mostly
+the same as the one before it only stores the chunks that changed.
+
+
+Layout:
+-------
+    STORE/store.json                the chunker parameters
+    STORE/store.key                 the chunk key ( CHUNK_KEY_LENGTH random bytes )
+    STORE/chunks/ab/abcd...         the encrypted chunks, named by their chunk ID
+
+    chunk: CHUNK_MAGIC | codec ( 1 byte ) | nonce prefix | tag | ciphertext of the ( compressed ) chunk
+
+
+Each chunk is encrypted with a key derived from its contents by BLAKE2b keyed with the chunk key,
+and named by a hash of that key. Only the manifest of a backup holds the keys of its chunks, and the manifest is a container
+encrypted for the Key Encryption Key, so the store and the chunk key can not decrypt a chunk without already knowing its contents.
+
+The chunk key is only needed to add backups. It lets whoever holds it check whether known data is in the store.
+
+"""
+
+
+
+import os
+
+import json
+
+import base64
+
+import hashlib
+
+import tempfile
+
+from pathlib import Path
+
+
+
+from Crypto.Random import get_random_bytes
+
+
+
+import sharelock.errors as errors
+
+import sharelock.dek as dek
+
+import sharelock.compression as compression
+
+import sharelock.stats as stats
+
+
+
+
+STORE_FILENAME = 'store.json'
+
+
+KEY_FILENAME = 'store.key'
+
+
+CHUNKS_DIRECTORY = 'chunks'
+
+
+STORE_VERSION = 1
+
+
+CHUNK_KEY_LENGTH = 32
+
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+MIN_CHUNK_SIZE = 4096
+
+
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+
+# bytes before a boundary that decide whether it is one
+
+WINDOW_SIZE = 16
+
+
+# bytes of input hashed at a time when looking for boundaries
+
+BLOCK_SIZE = 64 * 1024
+
+
+
+CHUNK_MAGIC = b'SLCH'
+
+
+# the codec byte of a chunk is the index of its codec in this list
+
+CHUNK_CODECS = [ compression.NONE ] + compression.CODECS
+
+
+CHUNK_HEADER_LENGTH = len( CHUNK_MAGIC ) + 1 + dek.SEGMENT_NONCE_PREFIX_LENGTH + dek.TAG_LENGTH
+
+
+MANIFEST_VERSION = 1
+
+
+
+
+class Chunker:
+
+    """
+    Splits data into chunks at content-defined boundaries.
+
+    A boundary is placed where a hash of the WINDOW_SIZE bytes before it has its low bits set to zero, so boundaries move
+    with the data around them. The first 8 bits of the hash are the sum, in GF( 2^8 ), of T[ byte ] * 3^k for the byte k positions
+    before the boundary. Adding each window to itself shifted by 1, 2, 4, and 8 positions computes them for a whole block at a time
+    with big integer operations, so the work per byte runs in C. The remaining bits are only computed where the first 8 are zero.
+
+    The table T is derived from the chunk key, so the chunk sizes do not reveal whether the data matches known data.
+    T has no zero entries and 3 has an order greater than WINDOW_SIZE, so runs of a single byte value never hold a boundary.
+    Chunks are at least a quarter and at most four times 'chunk_size' bytes.
+    """
+
+
+
+    def __init__( self, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE ):
+
+        """
+        Params:
+        -------
+        key : bytes
+            The chunk key of the store
+        chunk_size : int - default DEFAULT_CHUNK_SIZE
+            The expected number of bytes after the minimum chunk size before a boundary ( a power of 2 )
+        """
+
+
+        check_chunk_size( chunk_size )
+
+
+        self.min_size = chunk_size // 4
+
+        self.max_size = chunk_size * 4
+
+        self.mask = ( chunk_size >> 8 ) - 1
+
+
+
+        table_bytes = hashlib.shake_256( key + b'sharelock chunker' ).digest( 256 + WINDOW_SIZE * 256 * 4 )
+
+
+        self.table = bytes( value or 1 for value in table_bytes[ : 256 ] )
+
+
+        # multiplication by 3^span for each doubling of the window
+
+        self.span_tables = [ bytes( gf_multiply( value, gf_power( 3, 1 << step ) ) for value in range( 256 ) ) for step in range( WINDOW_SIZE.bit_length( ) - 1 ) ]
+
+
+
+        # 32 bit tables for the remaining bits, one per window position
+
+        word_bytes = table_bytes[ 256 : ]
+
+        self.word_tables = [
+            [ int.from_bytes( word_bytes[ ( position * 256 + value ) * 4 : ( position * 256 + value + 1 ) * 4 ], 'big' ) for value in range( 256 ) ]
+            for position in range( WINDOW_SIZE )
+        ]
+
+
+
+
+    def find_boundary( self, data ) -> int:
+
+        """
+        Find the end of the chunk that starts at the beginning of 'data'.
+
+
+        Params:
+        -------
+        data : bytes | memoryview
+            The data from the start of the chunk on, at least the maximum chunk size unless it is the end of the input
+
+
+        Returns:
+        -------
+        int
+            The length of the chunk
+
+        """
+
+
+        end = min( len( data ), self.max_size )
+
+
+        for block_start in range( self.min_size, end, BLOCK_SIZE ):
+
+
+            block_end = min( block_start + BLOCK_SIZE, end )
+
+
+            window = bytes( data[ block_start - WINDOW_SIZE : block_end ] )
+
+            length = len( window ) + WINDOW_SIZE
+
+
+
+            # byte j of 'hashed' becomes the hash of the WINDOW_SIZE bytes up to and including byte j of 'window'
+
+            hashed = int.from_bytes( window.translate( self.table ), 'little' )
+
+
+            for step, table in enumerate( self.span_tables ):
+
+                hashed ^= int.from_bytes( hashed.to_bytes( length, 'little' ).translate( table ), 'little' ) << ( 8 << step )
+
+
+            hashed_bytes = hashed.to_bytes( length, 'little' )
+
+
+
+            # the boundary at block_start + i follows byte i + WINDOW_SIZE - 1 of 'window'
+
+            first, last = WINDOW_SIZE - 1, WINDOW_SIZE - 1 + block_end - block_start
+
+
+            candidate = hashed_bytes.find( 0, first, last )
+
+
+            while candidate >= 0:
+
+
+                if self.is_boundary( window, candidate + 1 ):
+
+                    return block_start + candidate + 1 - WINDOW_SIZE
+
+
+                candidate = hashed_bytes.find( 0, candidate + 1, last )
+
+
+
+        return end
+
+
+
+
+    def is_boundary( self, window: bytes, position: int ) -> bool:
+
+        """
+        Whether the remaining bits of the hash of the WINDOW_SIZE bytes before 'position' in 'window' are zero.
+        """
+
+
+        hashed = 0
+
+
+        for offset, table in enumerate( self.word_tables ):
+
+            hashed ^= table[ window[ position - 1 - offset ] ]
+
+
+        return hashed & self.mask == 0
+
+
+
+
+    def split( self, view: memoryview ):
+
+        """
+        Yield the chunks of 'view' as slices of it.
+        """
+
+
+        start = 0
+
+
+        while start < len( view ):
+
+            length = self.find_boundary( view[ start : start + self.max_size ] )
+
+            yield view[ start : start + length ]
+
+            start += length
+
+
+
+
+    def split_stream( self, reader ):
+
+        """
+        Yield the chunks of the data read from the binary file object 'reader'.
+        """
+
+
+        buffer = bytearray( )
+
+
+        while True:
+
+
+            while len( buffer ) < self.max_size:
+
+                data = reader.read( self.max_size - len( buffer ) )
+
+                if not data:
+
+                    break
+
+                buffer += data
+
+
+
+            if not buffer:
+
+                return
+
+
+
+            length = self.find_boundary( buffer )
+
+            yield bytes( buffer[ : length ] )
+
+            del buffer[ : length ]
+
+
+
+
+
+def gf_multiply( a: int, b: int ) -> int:
+
+    """
+    Multiply in GF( 2^8 ) with the AES polynomial.
+    """
+
+
+    product = 0
+
+
+    while b:
+
+        if b & 1:
+
+            product ^= a
+
+
+        a = ( a << 1 ) ^ ( 0x11b if a & 0x80 else 0 )
+
+        b >>= 1
+
+
+    return product
+
+
+
+
+
+def gf_power( a: int, exponent: int ) -> int:
+
+    result = 1
+
+
+    for _ in range( exponent ):
+
+        result = gf_multiply( result, a )
+
+
+    return result
+
+
+
+
+
+def check_chunk_size( chunk_size: int ):
+
+    if chunk_size < MIN_CHUNK_SIZE or chunk_size > MAX_CHUNK_SIZE or chunk_size & ( chunk_size - 1 ):
+
+        raise errors.UsageError( f'Chunk size ({ chunk_size }) must be a power of 2 >= { MIN_CHUNK_SIZE } and <= { MAX_CHUNK_SIZE }.' )
+
+
+
+
+
+class ChunkStore:
+
+    """
+    A directory of encrypted chunks shared by every backup written to it.
+    """
+
+
+
+    def __init__( self, path, phase_stats = stats.NULL_STATS ):
+
+        self.path = Path( path ).resolve( )
+
+        self.stats = phase_stats
+
+        self.key = None
+
+        self.chunker = None
+
+
+
+
+    def open( self, chunk_size: int = None, create: bool = False ):
+
+        """
+
+        Load the chunk key and chunker parameters to add chunks to the store.
+
+
+        Params:
+        -------
+        chunk_size : int | None - default None
+            The chunk size of a new store ( DEFAULT_CHUNK_SIZE if set to None ). An existing store keeps its chunk size.
+        create : bool - default False
+            Whether to create the store if it does not exist
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the store can not be read or created, or 'chunk_size' differs from the chunk size of the store.
+
+        """
+
+
+        if create and not ( self.path / STORE_FILENAME ).exists( ):
+
+            self.create( DEFAULT_CHUNK_SIZE if chunk_size is None else chunk_size )
+
+
+
+        try:
+
+            settings = json.loads( ( self.path / STORE_FILENAME ).read_bytes( ) )
+
+            self.key = ( self.path / KEY_FILENAME ).read_bytes( )
+
+        except OSError:
+
+            raise errors.InputError( f'Could not read the chunk store at "{ self.path }".' )
+
+        except ValueError:
+
+            raise errors.IntegrityError( f'Could not parse "{ self.path / STORE_FILENAME }".' )
+
+
+
+        if settings.get( 'version' ) != STORE_VERSION or len( self.key ) != CHUNK_KEY_LENGTH:
+
+            raise errors.IntegrityError( f'Unsupported chunk store at "{ self.path }".' )
+
+
+        if chunk_size is not None and chunk_size != settings[ 'chunk_size' ]:
+
+            raise errors.UsageError( f'The chunk store at "{ self.path }" uses a chunk size of { settings[ "chunk_size" ] }.' )
+
+
+
+        self.chunker = Chunker( self.key, settings[ 'chunk_size' ] )
+
+
+        return self
+
+
+
+
+    def create( self, chunk_size: int ):
+
+        """
+        Create an empty store with a new chunk key, readable only by its owner.
+        """
+
+
+        check_chunk_size( chunk_size )
+
+
+
+        try:
+
+            ( self.path / CHUNKS_DIRECTORY ).mkdir( parents = True, exist_ok = True )
+
+
+            key_file = os.open( self.path / KEY_FILENAME, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600 )
+
+
+            with os.fdopen( key_file, 'wb' ) as file:
+
+                file.write( get_random_bytes( CHUNK_KEY_LENGTH ) )
+
+
+            ( self.path / STORE_FILENAME ).write_text( json.dumps( { 'version': STORE_VERSION, 'chunk_size': chunk_size } ) )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not create a chunk store at "{ self.path }".' )
+
+
+
+
+    def chunk_path( self, chunk_id: str ) -> Path:
+
+        return self.path / CHUNKS_DIRECTORY / chunk_id[ : 2 ] / chunk_id
+
+
+
+
+    def put( self, data, compression_codec: str = compression.NONE, compression_level: int = None ):
+
+        """
+
+        Add a chunk to the store unless it is already there.
+
+
+        Params:
+        -------
+        data : bytes | memoryview
+            The chunk
+        compression_codec : str - default compression.NONE
+            The codec with which to compress the chunk before it is encrypted
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+
+
+        Returns:
+        -------
+        chunk_id : str
+            The name of the chunk in the store
+        chunk_key : bytes
+            The key the chunk is encrypted with
+        stored : bool
+            Whether the chunk was written, or was already in the store
+
+        """
+
+
+        with self.stats.phase( 'hash_chunk', len( data ) ):
+
+            chunk_key = hashlib.blake2b( data, key = self.key, digest_size = 32, person = b'sharelock chunk' ).digest( )
+
+            chunk_id = hashlib.blake2b( chunk_key, digest_size = 32, person = b'sharelock id' ).hexdigest( )
+
+
+
+        path = self.chunk_path( chunk_id )
+
+
+        if path.exists( ):
+
+            return chunk_id, chunk_key, False
+
+
+
+        if compression_codec != compression.NONE:
+
+            with self.stats.phase( 'compress', len( data ) ):
+
+                data = compression.compress( compression_codec, data, compression_level )
+
+
+
+        # the codec byte is the segment index of the nonce, so it is authenticated
+
+        codec_index = CHUNK_CODECS.index( compression_codec )
+
+        nonce_prefix = get_random_bytes( dek.SEGMENT_NONCE_PREFIX_LENGTH )
+
+
+        with self.stats.phase( 'encrypt', len( data ) ):
+
+            ciphertext, tag = dek.DEK( ).encrypt_segment( data, chunk_key, nonce_prefix, codec_index )
+
+
+
+        self.write_chunk( path, CHUNK_MAGIC + bytes( [ codec_index ] ) + nonce_prefix + tag, ciphertext )
+
+
+        return chunk_id, chunk_key, True
+
+
+
+
+    def write_chunk( self, path: Path, header: bytes, ciphertext: bytes ):
+
+        """
+        Write a chunk through a temporary file, so the store never holds part of a chunk.
+        """
+
+
+        temporary_name = None
+
+
+        try:
+
+            with self.stats.phase( 'write_chunk', len( header ) + len( ciphertext ) ):
+
+
+                path.parent.mkdir( exist_ok = True )
+
+
+                with tempfile.NamedTemporaryFile( dir = path.parent, prefix = '.', delete = False ) as temporary:
+
+                    temporary_name = temporary.name
+
+                    temporary.write( header )
+
+                    temporary.write( ciphertext )
+
+                    temporary.flush( )
+
+                    os.fsync( temporary.fileno( ) )
+
+
+                os.replace( temporary_name, path )
+
+        except OSError:
+
+            if temporary_name is not None and os.path.exists( temporary_name ):
+
+                os.unlink( temporary_name )
+
+
+            raise errors.OutputError( f'Could not write chunk to the chunk store at "{ self.path }".' )
+
+
+
+
+    def get( self, chunk_id: str, chunk_key: bytes, length: int ) -> bytes:
+
+        """
+
+        Read, decrypt, and authenticate a chunk.
+
+
+        Params:
+        -------
+        chunk_id : str
+            The name of the chunk in the store
+        chunk_key : bytes
+            The key the chunk is encrypted with, from the manifest
+        length : int
+            The length of the decrypted chunk recorded in the manifest
+
+
+        Raises:
+        -------
+        sharelock.errors.InputError
+            If the chunk is missing.
+        sharelock.errors.IntegrityError
+            If the chunk fails authentication.
+
+        """
+
+
+        try:
+
+            with self.stats.phase( 'read_chunk' ):
+
+                chunk = self.chunk_path( chunk_id ).read_bytes( )
+
+        except OSError:
+
+            raise errors.InputError( f'Chunk { chunk_id } is missing from the chunk store at "{ self.path }".' )
+
+
+
+        if len( chunk ) < CHUNK_HEADER_LENGTH or not chunk.startswith( CHUNK_MAGIC ) or chunk[ len( CHUNK_MAGIC ) ] >= len( CHUNK_CODECS ):
+
+            raise errors.IntegrityError( f'Chunk { chunk_id } is malformed.' )
+
+
+
+        codec_index = chunk[ len( CHUNK_MAGIC ) ]
+
+        nonce_start = len( CHUNK_MAGIC ) + 1
+
+        tag_start = nonce_start + dek.SEGMENT_NONCE_PREFIX_LENGTH
+
+
+
+        with self.stats.phase( 'decrypt', len( chunk ) - CHUNK_HEADER_LENGTH ):
+
+            try:
+
+                data = dek.DEK( ).decrypt_segment( memoryview( chunk )[ CHUNK_HEADER_LENGTH : ], chunk[ tag_start : CHUNK_HEADER_LENGTH ], chunk_key, chunk[ nonce_start : tag_start ], codec_index )
+
+            except ValueError:
+
+                raise errors.IntegrityError( f'Chunk { chunk_id } failed authentication. The chunk store may have been modified.' )
+
+
+
+        if CHUNK_CODECS[ codec_index ] != compression.NONE:
+
+            with self.stats.phase( 'decompress', length ):
+
+                data = compression.decompress( CHUNK_CODECS[ codec_index ], data, length )
+
+
+        if len( data ) != length:
+
+            raise errors.IntegrityError( f'Chunk { chunk_id } does not have the length recorded in the manifest.' )
+
+
+
+        return data
+
+
+
+
+
+def build_manifest( chunks: list[ tuple[ str, bytes, int ] ] ) -> bytes:
+
+    """
+    Encode the manifest of a backup from the ( chunk ID, chunk key, length ) of each of its chunks, in order.
+    """
+
+
+    return json.dumps( {
+        'version': MANIFEST_VERSION,
+        'length': sum( length for _, _, length in chunks ),
+        'chunks': [ [ chunk_id, base64.b64encode( chunk_key ).decode( ), length ] for chunk_id, chunk_key, length in chunks ],
+    } ).encode( )
+
+
+
+
+
+def read_manifest( data: bytes ) -> list[ tuple[ str, bytes, int ] ]:
+
+    """
+    Decode the manifest of a backup into the ( chunk ID, chunk key, length ) of each of its chunks, in order.
+    """
+
+
+    try:
+
+        manifest = json.loads( data )
+
+
+        if manifest[ 'version' ] != MANIFEST_VERSION:
+
+            raise ValueError( )
+
+
+        chunks = [ ( str( chunk_id ), base64.b64decode( chunk_key ), int( length ) ) for chunk_id, chunk_key, length in manifest[ 'chunks' ] ]
+
+    except Exception:
+
+        raise errors.IntegrityError( 'Could not parse the chunk manifest.' )
+
+
+
+    if any( len( chunk_id ) != 64 or not all( character in '0123456789abcdef' for character in chunk_id ) for chunk_id, _, _ in chunks ):
+
+        raise errors.IntegrityError( 'The chunk manifest holds an invalid chunk ID.' )
+
+
+
+    return chunks
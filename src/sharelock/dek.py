@@ -9,20 +9,43 @@ This includes generating, loading, and using Data Encryption Keys
 
 
 
-import sys
+from Crypto.Random import get_random_bytes
 
 
+from Crypto.Cipher import AES, ChaCha20_Poly1305
 
-from Crypto.Random import get_random_bytes
 
 
-from Crypto.Cipher import AES
+import sharelock.errors as errors
 
 
 
 NONCE_LENGTH = 16
 
 
+TAG_LENGTH = 16
+
+
+# segment nonces are this prefix followed by a 4 byte big-endian segment counter
+
+SEGMENT_NONCE_PREFIX_LENGTH = 8
+
+
+MAX_SEGMENTS = 2 ** 32
+
+
+
+AES_256_GCM = 'aes-256-gcm'
+
+
+CHACHA20_POLY1305 = 'chacha20-poly1305'
+
+
+# the ciphers segments can be encrypted with ( both take a 32 byte key and the 12 byte segment nonce )
+
+CIPHERS = [ AES_256_GCM, CHACHA20_POLY1305 ]
+
+
 
 class DEK:
 
@@ -50,11 +73,9 @@ class DEK:
             return get_random_bytes( key_bytes )
 
 
-        except:
-
-            print( 'Could not generate Data Encryption Key of size "{ key_bytes }".', file = sys.stderr )
+        except Exception:
 
-            exit( 1 )
+            raise errors.UsageError( f'Could not generate Data Encryption Key of size "{ key_bytes }".' )
 
 
 
@@ -126,19 +147,203 @@ class DEK:
 
             result = cipher.decrypt( data )
 
-        except:
+        except Exception:
 
 
-            print( f'Could not decrypt data using DEK. The encrypted file may have been modified.', file = sys.stderr )
+            raise errors.IntegrityError( 'Could not decrypt data using DEK. The encrypted file may have been modified.' )
 
 
-            exit( 1 )
+        return result
 
 
-        return result
 
 
 
+    def decrypt_stream( self, reader, key: bytes, nonce: bytes, chunk_size: int ):
+
+        """
+        Decrypt data created by encrypt( ) one chunk at a time.
+
+
+        Params:
+        -------
+        reader
+            A binary file object positioned at the start of the ciphertext ( after the nonce )
+        key : bytes
+            The decryption key
+        nonce : bytes
+            The nonce ( created at encryption )
+        chunk_size : int
+            The number of bytes to read and decrypt at a time
+
+
+        Yields:
+        -------
+        bytes
+            The decrypted chunks, in order
+
+        """
+
+
+        cipher = AES.new( key, AES.MODE_GCM, nonce = nonce )
+
+
+
+        while True:
+
+
+            chunk = reader.read( chunk_size )
+
+
+            if len( chunk ) == 0:
+
+                return
+
+
+            yield cipher.decrypt( chunk )
+
+
+
+
+
+    def encrypt_segment( self, data: bytes, key: bytes, nonce_prefix: bytes, index: int, cipher: str = AES_256_GCM ):
+        """
+        Encrypt and authenticate a single segment of a stream using the DEK.
+
+        Each segment gets its own nonce built from 'nonce_prefix' and the segment 'index',
+        so segments can not be reordered or swapped between streams without failing authentication.
+
+
+        Params:
+        -------
+        data : bytes
+            The segment data to encrypt
+        key : bytes
+            The key to encrypt with
+        nonce_prefix : bytes
+            The random per-stream nonce prefix ( SEGMENT_NONCE_PREFIX_LENGTH bytes )
+        index : int
+            The position of the segment in the stream
+        cipher : str - default AES_256_GCM
+            The cipher to encrypt with ( one of CIPHERS )
+
+
+        Returns:
+        -------
+        ciphertext: bytes
+            The encrypted segment
+        tag: bytes
+            The authentication tag of the segment ( required for decryption )
+
+        """
+
+
+        return self.segment_cipher( cipher, key, self.segment_nonce( nonce_prefix, index ) ).encrypt_and_digest( data )
+
+
+
+
+
+    def decrypt_segment( self, data: bytes, tag: bytes, key: bytes, nonce_prefix: bytes, index: int, cipher: str = AES_256_GCM ):
+        """
+        Decrypt and verify a single segment of a stream using the DEK.
+
+
+        Params:
+        -------
+        data : bytes
+            The encrypted segment
+        tag : bytes
+            The authentication tag written alongside the segment
+        key : bytes
+            The decryption key
+        nonce_prefix : bytes
+            The nonce prefix of the stream
+        index : int
+            The position of the segment in the stream
+        cipher : str - default AES_256_GCM
+            The cipher the segment was encrypted with ( one of CIPHERS )
+
+
+        Returns:
+        -------
+        bytes
+            The decrypted segment
+
+
+        Raises:
+        -------
+        ValueError
+            If the segment fails authentication.
+
+        """
+
+
+        segment_cipher = self.segment_cipher( cipher, key, self.segment_nonce( nonce_prefix, index ) )
+
+
+        try:
+
+            return segment_cipher.decrypt_and_verify( data, tag )
+
+        except ValueError:
+
+            raise errors.IntegrityError( f'Segment { index } failed authentication. The encrypted file may have been modified.' )
+
+
+
+
+
+    def segment_cipher( self, cipher: str, key: bytes, nonce: bytes ):
+        """
+        Create the 'cipher' ( one of CIPHERS ) for a single segment.
+
+
+        Raises:
+        -------
+        ValueError
+            If the cipher is not one of CIPHERS.
+
+        """
+
+
+        if cipher == AES_256_GCM:
+
+            return AES.new( key, AES.MODE_GCM, nonce = nonce )
+
+
+        if cipher == CHACHA20_POLY1305:
+
+            return ChaCha20_Poly1305.new( key = key, nonce = nonce )
+
+
+        raise errors.UsageError( f'Unsupported cipher "{ cipher }". Use one of: { ", ".join( CIPHERS ) }.' )
+
+
+
+
+
+    def segment_nonce( self, nonce_prefix: bytes, index: int ):
+        """
+        Build the nonce for the segment at 'index'.
+
+
+        Params:
+        -------
+        nonce_prefix : bytes
+            The nonce prefix of the stream
+        index : int
+            The position of the segment in the stream
+
+        """
+
+
+        if index < 0 or index >= MAX_SEGMENTS:
+
+            raise errors.UsageError( f'Segment index ({ index }) must be >= 0 and < { MAX_SEGMENTS }.' )
+
+
+        return bytes( nonce_prefix ) + index.to_bytes( 4, 'big' )
 
 
 
@@ -7,138 +7,1207 @@ Module for performing encryption.
 
 
 
+import os
+
 import sys
 
 
+import json
+
+import contextlib
+
+
 from pathlib import Path
 
 
 
+import sharelock.errors as errors
+
 import sharelock.dek as dek
 
 import sharelock.kek as kek
 
+import sharelock.decrypter as decrypter
+
+import sharelock.dedup as dedup
+
+import sharelock.mapping as mapping
+
+import sharelock.parallel as parallel
+
+import sharelock.stream_format as stream_format
+
+import sharelock.container as container
+
+import sharelock.compression as compression
+
+import sharelock.cipher_benchmark as cipher_benchmark
+
+import sharelock.stats as stats
+
+
+
+
+ENCRYPTED_SUFFIX = '.sharelock'
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
 
 
 
 class Encrypter:
 
 
-    def __init__( self ):
+    def __init__( self, phase_stats = stats.NULL_STATS ):
 
-        pass
+        self.stats = phase_stats
 
 
 
-    def encrypt( self, public_key_filename: str, output_filename: str, dek_filename: str ):
+    def encrypt( self, public_key_filename, output_filename: str, dek_filename: str = None, segment_size: int = stream_format.DEFAULT_SEGMENT_SIZE, jobs: int = 1, input_filename: str = None, compression_codec: str = compression.NONE, compression_level: int = None, queue_depth: int = None, cipher: str = stream_format.DEFAULT_CIPHER ):
 
         """
 
-        Perform Encryption on the data passed through stdin.
+        Perform Encryption on the data passed through stdin ( or the file at 'input_filename' ).
+
+        The output is a container ( see sharelock.container ) that holds the encrypted DEK along with the data.
+
+        The input is read, encrypted, and written in a pipeline of threads ( see parallel.pipeline( ) ), with a bounded number
+        of segments in flight, so memory use does not depend on the size of the input.
+        Input files are memory mapped and their segments are passed to the cipher without being copied.
 
 
         Params:
         -------
-        public_key_filename : str
-            The filename that holds the Public Key Encryption Key
+        public_key_filename : str | list[ str ]
+            The filename that holds the Public Key Encryption Key, or a list of them to encrypt the DEK for each key
         output_filename : str
             The filename at which to write the encrypted data at ( set to '-' to write to stdout )
-        dek_filename : str
-            The filename that holds the encrypted Data Encryption Key
+        dek_filename : str | None - default None
+            A filename at which to also write the encrypted Data Encryption Key, which is always embedded in the output
+        segment_size : int
+            The number of plaintext bytes in each separately authenticated segment
+        jobs : int - default 1
+            The number of segments to encrypt in parallel
+        input_filename : str | None - default None
+            The file to encrypt. If set to None, read stdin.
+        compression_codec : str - default compression.NONE
+            The codec with which to compress each segment before it is encrypted ( one of compression.CODECS )
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+        queue_depth : int | None - default None
+            The number of segments that may be read ahead of the writer. See parallel.pipeline( ).
+        cipher : str - default stream_format.DEFAULT_CIPHER
+            The cipher to encrypt the segments with ( one of dek.CIPHERS ), or cipher_benchmark.AUTO to use the fastest one on this host
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the key or input can not be read, the output can not be written, or the parameters are invalid.
 
         """
 
 
-        # read data to encrypt from stdin
+        # load kek
+
+        with self.stats.phase( 'load_kek' ):
 
-        input_data = sys.stdin.buffer.read( )
+            public_kek = self.load_keks( public_key_filename )
 
 
 
-        # load kek
+        self.encrypt_with_kek( public_kek, output_filename, dek_filename, segment_size, jobs, input_filename, compression_codec, compression_level, queue_depth, cipher = cipher )
 
-        kek_context = kek.KEK( )
 
-        public_kek = kek_context.load( public_key_filename )
 
 
 
-        # generate DEK
+    def encrypt_deduplicated( self, public_key_filename, output_filename: str, store_path: str, chunk_size: int = None, jobs: int = 1, input_filename: str = None, compression_codec: str = compression.NONE, compression_level: int = None, queue_depth: int = None ):
+
+        """
+
+        Encrypt the data passed through stdin ( or the file at 'input_filename' ) into a chunk store ( see sharelock.dedup ).
+
+        The input is split into content-defined chunks and only the chunks that are not already in the store are encrypted and written.
+        The output is a container holding the manifest of the chunks, which Decrypter reassembles the data from.
+
+
+        Params:
+        -------
+        public_key_filename : str | list[ str ]
+            The filename that holds the Public Key Encryption Key, or a list of them to encrypt the manifest for each key
+        output_filename : str
+            The filename at which to write the encrypted manifest ( set to '-' to write to stdout )
+        store_path : str
+            The directory of the chunk store. It is created if it does not exist.
+        chunk_size : int | None - default None
+            The average chunk size of a new store ( a power of 2 ). If set to None, an existing store keeps its chunk size and a new one uses dedup.DEFAULT_CHUNK_SIZE.
+        jobs : int - default 1
+            The number of chunks to hash, encrypt, and write in parallel
+        input_filename : str | None - default None
+            The file to encrypt. If set to None, read stdin.
+        compression_codec : str - default compression.NONE
+            The codec with which to compress each new chunk before it is encrypted ( one of compression.CODECS )
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+        queue_depth : int | None - default None
+            The number of chunks that may be read ahead of the writer. See parallel.pipeline( ).
+
+
+        Returns:
+        -------
+        tuple[ int, int, int, int ]
+            The number of chunks written and in total, and the number of bytes of input in the written chunks and in total
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the key, input, or store can not be read, the store or output can not be written, or the parameters are invalid.
+
+        """
+
+
+        with self.stats.phase( 'load_kek' ):
+
+            public_kek = self.load_keks( public_key_filename )
+
+
+        try:
+
+            compression.check( compression_codec, compression_level )
+
+        except ValueError as e:
+
+            raise errors.UsageError( f'Could not encrypt data: { e.args[ 0 ] }' )
+
+
+
+        store = dedup.ChunkStore( store_path, self.stats ).open( chunk_size, create = True )
+
+
+        input_file, reader = self.open_input( input_filename )
+
+
+
+        # store the chunks that are not in the store yet, keeping the key of every chunk for the manifest
+
+        with input_file:
+
+
+            if reader is not None:
+
+                chunks = store.chunker.split_stream( reader )
+
+            else:
+
+                chunks = store.chunker.split( input_file.view )
+
+
+
+            stored_chunks = parallel.pipeline(
+                lambda chunk: ( store.put( chunk, compression_codec, compression_level ), len( chunk ) ),
+                self.stats.timed_iter( 'chunk', chunks ),
+                jobs,
+                queue_depth,
+            )
+
+
+
+            manifest_chunks = [ ]
+
+            written_chunks = written_bytes = total_bytes = 0
+
+
+
+            for ( chunk_id, chunk_key, written ), length in stored_chunks:
+
+
+                manifest_chunks.append( ( chunk_id, chunk_key, length ) )
+
+
+                written_chunks += written
+
+                written_bytes += length if written else 0
+
+                total_bytes += length
+
+
+                if reader is None:
+
+                    input_file.release_before( total_bytes )
+
+
+
+
+        # encrypt the manifest once every chunk it names is written
+
+        self.encrypt_with_kek(
+            public_kek,
+            output_filename,
+            source = dedup.build_manifest( manifest_chunks ),
+            compression_codec = compression_codec,
+            compression_level = compression_level,
+            content = container.CHUNK_MANIFEST,
+        )
+
+
+
+        return written_chunks, len( manifest_chunks ), written_bytes, total_bytes
+
+
+
+
+
+    def encrypt_many( self, public_key_filename, input_paths: list[ str ], output_directory: str, segment_size: int = stream_format.DEFAULT_SEGMENT_SIZE, jobs: int = 1, compression_codec: str = compression.NONE, compression_level: int = None, queue_depth: int = None, cipher: str = stream_format.DEFAULT_CIPHER ):
+
+        """
+
+        Encrypt many files with a single loaded Public Key Encryption Key.
+
+        Every file gets its own DEK. The container of each file is written to 'output_directory'
+        at the file's path relative to its input, with ENCRYPTED_SUFFIX appended.
+        A manifest listing every container is written to MANIFEST_FILENAME in 'output_directory'.
+
+
+        Params:
+        -------
+        public_key_filename : str | list[ str ]
+            The filename that holds the Public Key Encryption Key, or a list of them to encrypt each DEK for each key
+        input_paths : list[ str ]
+            Files to encrypt, or directories whose files ( recursively ) to encrypt
+        output_directory : str
+            The directory in which to write the encrypted files
+        segment_size : int
+            The number of plaintext bytes in each separately authenticated segment
+        jobs : int - default 1
+            The number of files to encrypt in parallel
+        compression_codec : str - default compression.NONE
+            The codec with which to compress each segment before it is encrypted ( one of compression.CODECS )
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+        queue_depth : int | None - default None
+            The number of segments that may be read ahead of the writer. See parallel.pipeline( ).
+        cipher : str - default stream_format.DEFAULT_CIPHER
+            The cipher to encrypt the segments with ( one of dek.CIPHERS ), or cipher_benchmark.AUTO to use the fastest one on this host
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If a key or input can not be read, an output can not be written, or the parameters are invalid.
+
+        """
+
+
+        # check every argument, and choose the cipher once for every file, before any input is read or output created
+
+        try:
+
+            compression.check( compression_codec, compression_level )
+
+            container.check_segment_size( segment_size )
+
+            cipher = cipher_benchmark.resolve( cipher, self.stats )
+
+        except ValueError as e:
+
+            raise errors.UsageError( f'Could not encrypt data: { e.args[ 0 ] }' )
+
+
+
+        output_directory = Path( output_directory ).resolve( )
+
+
+        inputs = self.collect_inputs( input_paths )
+
+
+
+        # load kek once for every file
+
+        with self.stats.phase( 'load_kek' ):
+
+            public_kek = self.load_keks( public_key_filename )
 
-        dek_context = dek.DEK( )
 
-        dek_key = dek_context.generate( )
 
+        def encrypt_input( entry ):
 
 
-        # encrypt data
+            source, relative = entry
 
-        encrypted_data, nonce = dek_context.encrypt( input_data, dek_key )
 
+            data_path = output_directory / relative.with_name( relative.name + ENCRYPTED_SUFFIX )
 
 
-        # encrypt DEK using KEK
+            try:
 
-        encrypted_dek = kek_context.encrypt( dek_key, public_kek )
+                data_path.parent.mkdir( parents = True, exist_ok = True )
 
+            except OSError:
 
+                raise errors.OutputError( f'Could not create output directory "{ data_path.parent }".' )
 
-        # write encrypted data and DEK to files
 
-        output_data = bytes( nonce ) + encrypted_data
 
-        self.write_output_data( output_filename, output_data )
+            self.encrypt_with_kek( public_kek, str( data_path ), None, segment_size, 1, str( source ), compression_codec, compression_level, queue_depth, cipher = cipher )
+
+
+            return {
+                'source': relative.as_posix( ),
+                'data': data_path.relative_to( output_directory ).as_posix( ),
+            }
+
+
+
+        manifest = { 'files': list( parallel.ordered_map( encrypt_input, inputs, jobs ) ) }
+
 
 
         try:
 
-            Path( dek_filename ).resolve( ).write_bytes( encrypted_dek )
+            ( output_directory / MANIFEST_FILENAME ).write_text( json.dumps( manifest, indent = 4 ) )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not write manifest to "{ output_directory / MANIFEST_FILENAME }".' )
+
+
+
+
+
+    def collect_inputs( self, input_paths: list[ str ] ):
+
+        """
+        Expand 'input_paths' into the files to encrypt.
+
+
+        Params:
+        -------
+        input_paths : list[ str ]
+            Files, or directories whose files ( recursively ) to include
+
+
+        Returns:
+        -------
+        list[ tuple[ Path, Path ] ]
+            A list of ( file, path relative to its input ) tuples
+
+        """
+
+
+        inputs = [ ]
+
+        seen = set( )
+
+
+
+        for input_path in input_paths:
+
+
+            path = Path( input_path ).resolve( )
 
 
-        except:
 
-            print( f'Could not write encrypted DEK to file at "{ dek_filename }".', file = sys.stderr )
+            if path.is_dir( ):
 
-            exit( 1 )
+                files = [ ( file, file.relative_to( path ) ) for file in sorted( path.rglob( '*' ) ) if file.is_file( ) ]
 
+            elif path.is_file( ):
 
+                files = [ ( path, Path( path.name ) ) ]
 
+            else:
 
+                raise errors.InputError( f'Could not read input data from "{ input_path }".' )
 
-    def write_output_data( self, output_filename: str, output_data: bytes ):
+
+
+            for file, relative in files:
+
+
+                if relative in seen:
+
+                    raise errors.UsageError( f'More than one input would be written to "{ relative }".' )
+
+
+                seen.add( relative )
+
+                inputs.append( ( file, relative ) )
+
+
+
+        return inputs
+
+
+
+
+
+    def encrypt_with_kek( self, public_kek, output, dek_filename: str = None, segment_size: int = stream_format.DEFAULT_SEGMENT_SIZE, jobs: int = 1, source = None, compression_codec: str = compression.NONE, compression_level: int = None, queue_depth: int = None, content: str = None, cipher: str = stream_format.DEFAULT_CIPHER ):
 
         """
-        Write 'output_data' to the file at 'output_filename'.
+
+        Perform Encryption with an already loaded Public Key Encryption Key. See encrypt( ).
 
 
         Params:
         -------
-        output_filename : str
-            The filename at which to write the data
-        output_data : bytes
-            The data to write to the file
+        public_kek : bytes | list[ bytes ]
+            The Public Key Encryption Key, or a list of them to encrypt the DEK for each key
+        output : str | Path | binary file object
+            The filename at which to write the encrypted data at ( set to '-' to write to stdout ), or an open file to write it to
+        dek_filename : str | None - default None
+            A filename at which to also write the encrypted Data Encryption Key, which is always embedded in the output.
+            Only for a single Key Encryption Key.
+        segment_size : int
+            The number of plaintext bytes in each separately authenticated segment
+        jobs : int - default 1
+            The number of segments to encrypt in parallel
+        source : str | Path | bytes | binary file object | None - default None
+            The data to encrypt: a filename, the data itself, or an open file. If set to None, read stdin.
+            Files are memory mapped. Other file objects are read one segment at a time.
+        compression_codec : str - default compression.NONE
+            The codec with which to compress each segment before it is encrypted ( one of compression.CODECS )
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+        queue_depth : int | None - default None
+            The number of segments that may be read ahead of the writer. See parallel.pipeline( ).
+        content : str | None - default None
+            What the encrypted data holds, recorded in the header ( container.CHUNK_MANIFEST for the manifest of a deduplicated backup )
+        cipher : str - default stream_format.DEFAULT_CIPHER
+            The cipher to encrypt the segments with ( one of dek.CIPHERS ), or cipher_benchmark.AUTO to use the fastest one on this host
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the input can not be read, the output can not be written, or the parameters are invalid.
 
         """
 
 
-        if output_filename == '-':
+        # check every argument before the input is opened
+
+        try:
+
+            compression.check( compression_codec, compression_level )
+
+            cipher = cipher_benchmark.resolve( cipher, self.stats )
+
+        except ValueError as e:
+
+            raise errors.UsageError( f'Could not encrypt data: { e.args[ 0 ] }' )
+
+
+        if dek_filename is not None and not isinstance( public_kek, ( bytes, bytearray ) ) and len( public_kek ) > 1:
+
+            raise errors.UsageError( 'A DEK file can only be written for a single Key Encryption Key.' )
+
+
+
+        # generate DEK
+
+        dek_context = dek.DEK( )
+
+
+        with self.stats.phase( 'generate_dek' ):
+
+            dek_key = dek_context.generate( )
+
 
-            sys.stdout.buffer.write( output_data )
 
-            return
+        # encrypt DEK using each KEK and embed them in the header describing the segments
+
+        params = container.new_params( segment_size, compression_codec, cipher )
+
+        params[ 'recipients' ] = self.wrap_dek( dek_key, public_kek )
+
+
+        if content is not None:
+
+            params[ 'content' ] = content
 
 
         try:
 
-            Path( output_filename ).resolve( ).write_bytes( output_data )
+            header = container.build_header( params )
+
+        except ValueError as e:
+
+            raise errors.UsageError( f'Could not encrypt data: { e.args[ 0 ] }' )
+
+
+
+        input_file, reader = self.open_input( source )
+
+
+
+        with input_file:
+
+
+            # also write the DEK to its own file if asked to
+
+            if dek_filename is not None:
+
+
+                encrypted_dek = params[ 'recipients' ][ 0 ][ 'dek' ]
+
+
+                try:
+
+                    with self.stats.phase( 'write_dek', len( encrypted_dek ) ):
+
+                        Path( dek_filename ).resolve( ).write_bytes( encrypted_dek )
+
+
+                except OSError:
+
+                    raise errors.OutputError( f'Could not write encrypted DEK to file at "{ dek_filename }".' )
+
+
+
+
+            # encrypt the input segment by segment and write the segments to the output, then the index of the segments
+
+            with self.open_output( output ) as output_file:
+
+
+                self.write_output_data( output, output_file, header )
+
+
+                index = container.IndexBuilder( len( header ) )
+
+
+                self.encrypt_segments( input_file, reader, output, output_file, index, dek_key, params, jobs, compression_level, queue_depth )
+
+
+                self.write_output_data( output, output_file, index.finish( dek_key, params ) )
+
+
+                self.flush_output( output, output_file )
+
+
+
+
+
+    def append( self, output_filename: str, input_filename: str = None, jobs: int = 1, agent_socket: str = None, private_kek: bytes = None, compression_level: int = None, queue_depth: int = None ):
+
+        """
+
+        Append data to an existing container under its existing DEK.
+
+        The new segments overwrite the index at the end of the container and are followed by a new index and footer.
+        Earlier segments are neither read nor rewritten, so the cost depends only on the size of the appended data.
+        The segment size and compression codec of the container are kept, and the appended data starts a new segment
+        with a fresh nonce prefix recorded in the index. The container is locked ( flock ) while appending, so
+        concurrent appends run one after the other. If appending fails, the old index and footer are restored.
+
+
+        Params:
+        -------
+        output_filename : str
+            The filename of the container to append to
+        input_filename : str | None - default None
+            The filename from which to read the data to append. If set to None, read stdin.
+        jobs : int - default 1
+            The number of segments to encrypt in parallel
+        agent_socket : str | None - default None
+            The socket of a running agent holding the Private Key Encryption Key
+        private_kek : bytes | None - default None
+            The Private Key Encryption Key. If neither this nor 'agent_socket' is set, key shares are read from stdin.
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ) used if the container is compressed. If set to None, the codec's default level is used.
+        queue_depth : int | None - default None
+            The number of segments that may be read ahead of the writer. See parallel.pipeline( ).
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the container can not be read, written, or authenticated, the DEK can not be decrypted, or the parameters are invalid.
+
+        """
+
+
+        # only appending needs file locks, so the rest of the module still imports where fcntl is missing
+
+        try:
+
+            import fcntl
+
+        except ImportError:
+
+            raise errors.UsageError( 'Appending needs file locks ( fcntl ), which this platform does not have.' )
+
+
+
+        try:
+
+            output_file = Path( output_filename ).resolve( ).open( 'r+b' )
+
+        except OSError:
+
+            raise errors.InputError( f'Could not open encrypted data at "{ output_filename }" for appending.' )
+
+
+
+        with output_file:
+
+
+            # keep other appends out until the new index is written, so neither writes over the segments of the other
+
+            fcntl.flock( output_file, fcntl.LOCK_EX )
+
+
+
+            # read and authenticate the header and index of the container
+
+            try:
+
+                with mapping.MappedFile( output_file ) as mapped:
+
+
+                    view = mapped.view
+
+
+                    if not container.is_container( view[ : container.PREAMBLE_LENGTH ] ):
+
+                        raise errors.UsageError( f'"{ output_filename }" is not a container. Only data encrypted by this version can be appended to.' )
+
+
+                    header_length, params = container.read_header( mapping.BufferReader( view ) )
+
+
+                    # segments appended to a manifest would be read as part of it, so the backup could not be restored
+
+                    if params.get( 'content' ) == container.CHUNK_MANIFEST:
+
+                        raise errors.UsageError( f'"{ output_filename }" is the manifest of a deduplicated backup. Only containers of encrypted data can be appended to.' )
+
+
+                    ( _, dek_key ), = decrypter.Decrypter( self.stats ).open_recipients( [ params[ 'recipients' ] ], 1, agent_socket, private_kek )
+
+
+                    with self.stats.phase( 'read_index' ):
+
+                        entries, sessions = container.read_index( view, dek_key, params, header_length )
+
+
+                    index_offset = len( view ) - container.FOOTER.size - len( entries ) * container.INDEX_ENTRY.size - len( sessions ) * container.SESSION_ENTRY.size
+
+                    old_tail = bytes( view[ index_offset : ] )
+
+            except OSError:
+
+                raise errors.InputError( f'Could not read encrypted data from file at "{ output_filename }".' )
+
+
+            try:
+
+                compression.check( params.get( 'compression', compression.NONE ), compression_level )
+
+            except ValueError as e:
+
+                raise errors.UsageError( f'Could not append data: { e.args[ 0 ] }' )
+
+
+
+            # encrypt the new segments in place of the old index, then write the new index
+
+            input_file, reader = self.open_input( input_filename )
+
+
+            index = container.IndexBuilder( index_offset, entries, sessions )
+
+
+            # the new segments get a nonce prefix of their own, so a retry after a failed append never reuses a nonce
+
+            index.start_session( )
+
+
+
+            try:
+
+                with input_file:
+
+
+                    output_file.seek( index_offset )
+
+
+                    self.encrypt_segments( input_file, reader, output_filename, output_file, index, dek_key, params, jobs, compression_level, queue_depth, skip_empty = True )
+
+
+                    self.write_output_data( output_filename, output_file, index.finish( dek_key, params ) )
+
+
+                    self.sync_output( output_filename, output_file )
+
+            except BaseException:
+
+                self.restore_tail( output_filename, output_file, index_offset, old_tail )
+
+                raise
+
+
+
+
+
+    def open_input( self, source ):
+
+        """
+        Open the input to encrypt.
+
+
+        Params:
+        -------
+        source : str | Path | bytes | binary file object | None
+            A filename, the data itself, or an open file. If set to None, read stdin.
+
+
+        Returns:
+        -------
+        input_file
+            A context manager that is a mapping.MappedFile or mapping.InMemory for mapped and in memory inputs
+        reader
+            The binary file object to read the input from one segment at a time, or None if the input is mapped or in memory
+
+        """
+
+
+        if source is None:
+
+            return contextlib.nullcontext( ), sys.stdin.buffer
+
+
+        if hasattr( source, 'read' ) and not mapping.is_regular_file( source ):
+
+            return contextlib.nullcontext( ), source
+
+
+
+        try:
+
+            return mapping.open_source( source ), None
+
+        except OSError:
+
+            raise errors.InputError( f'Could not read input data from { mapping.describe( source ) }.' )
+
+
+
+
+
+    def encrypt_segments( self, input_file, reader, output, output_file, index, dek_key: bytes, params: dict, jobs: int = 1, compression_level: int = None, queue_depth: int = None, skip_empty: bool = False ):
+
+        """
+
+        Encrypt the input segment by segment and write the segments to the output, recording each of them in 'index'.
+
+        Segments are numbered from the number of segments already in 'index' and use its current nonce prefix,
+        so each of them is encrypted with its own nonce.
+
+
+        Params:
+        -------
+        input_file, reader
+            The input returned by open_input( )
+        output : str | Path | binary file object
+            What 'output_file' was opened from ( used for error messages )
+        output_file
+            The open binary file object to write to
+        index : container.IndexBuilder
+            The segments already written
+        dek_key : bytes
+            The DEK
+        params : dict
+            The header parameters, with the segment size, compression codec, and nonce prefix
+        jobs : int - default 1
+            The number of segments to encrypt in parallel
+        compression_level : int | None - default None
+            The compression level ( 0 - 9 ). If set to None, the codec's default level is used.
+        queue_depth : int | None - default None
+            The number of segments that may be read ahead of the writer. See parallel.pipeline( ).
+        skip_empty : bool - default False
+            Whether to leave out the empty segment read from an empty input
+
+        """
+
+
+        dek_context = dek.DEK( )
+
+        segment_size = params[ 'segment_size' ]
+
+        compression_codec = params.get( 'compression', compression.NONE )
+
+        nonce_prefix = index.nonce_prefix( params )
+
+
+
+        if reader is not None:
+
+            segments = self.stats.timed_iter( 'read_input', self.read_segments( reader, segment_size ) )
+
+        else:
+
+            segments = self.slice_segments( input_file.view, segment_size )
+
+
+        if skip_empty:
+
+            segments = ( segment for segment in segments if len( segment ) )
+
+
+
+        def encrypt_segment( indexed_segment ):
+
+
+            index, segment = indexed_segment
+
+
+            if compression_codec != compression.NONE:
+
+                with self.stats.phase( 'compress', len( segment ) ):
+
+                    data = compression.compress( compression_codec, segment, compression_level )
+
+            else:
+
+                data = segment
+
+
+
+            with self.stats.phase( 'encrypt', len( data ) ):
+
+                ciphertext, tag = dek_context.encrypt_segment( data, dek_key, nonce_prefix, index, params[ 'cipher' ] )
+
+
+            return ciphertext, tag, len( segment )
+
+
+        first_segment = len( index.entries )
+
+
+        encrypted_segments = parallel.pipeline(
+            encrypt_segment,
+            enumerate( segments, first_segment ),
+            jobs,
+            queue_depth,
+        )
+
+
+
+        for ciphertext, tag, plaintext_length in encrypted_segments:
+
+
+            index.add( len( ciphertext ), plaintext_length, tag )
+
+
+            self.write_output_data( output, output_file, ciphertext )
+
+
+            if reader is None:
+
+                input_file.release_before( ( len( index.entries ) - first_segment ) * segment_size )
+
+
+
+
+
+    def load_keks( self, public_key_filename ):
+
+        """
+        Load the Public Key Encryption Key at 'public_key_filename', or each of a list of them.
+        """
+
+
+        if isinstance( public_key_filename, ( str, Path ) ):
+
+            return kek.KEK( ).load( public_key_filename )
+
+
+        return [ kek.KEK( ).load( filename ) for filename in public_key_filename ]
+
+
+
+
+
+    def wrap_dek( self, dek_key: bytes, public_kek ):
+
+        """
+
+        Encrypt a DEK for each Public Key Encryption Key.
+
+
+        Params:
+        -------
+        dek_key : bytes
+            The DEK
+        public_kek : bytes | list[ bytes ]
+            The Public Key Encryption Key, or a list of them. Repeated keys are only used once.
+
+
+        Returns:
+        -------
+        list[ dict ]
+            The recipients to write in the container header, in the order of the keys
+
+
+        Raises:
+        -------
+        sharelock.errors.UsageError
+            If no key is given.
+
+        """
+
+
+        public_keks = [ public_kek ] if isinstance( public_kek, ( bytes, bytearray ) ) else public_kek
+
+
+        recipients = { }
+
+
+
+        for key in public_keks:
+
+
+            fingerprint = container.fingerprint( key )
+
+
+            if fingerprint not in recipients:
+
+                with self.stats.phase( 'wrap_dek' ):
+
+                    recipients[ fingerprint ] = container.new_recipient( key, kek.KEK( ).encrypt( dek_key, key ) )
+
+
+
+        if not recipients:
+
+            raise errors.UsageError( 'At least one Key Encryption Key is required.' )
+
+
+
+        return list( recipients.values( ) )
+
+
+
+
+
+    def read_segments( self, input_file, segment_size: int ):
+
+        """
+        Yield the contents of 'input_file' in segments of 'segment_size' bytes.
+        The last segment may be shorter. An empty input still yields one empty segment.
+
+
+        Params:
+        -------
+        input_file
+            The binary file object to read from
+        segment_size : int
+            The maximum number of bytes per segment
+
+        """
+
+
+        segment = input_file.read( segment_size )
+
+
+        yield segment
+
+
+
+        while len( segment ) == segment_size:
+
+
+            segment = input_file.read( segment_size )
+
+
+            if len( segment ) == 0:
+
+                return
+
+
+            yield segment
+
+
+
+
+
+    def slice_segments( self, view: memoryview, segment_size: int ):
+
+        """
+        Yield slices of 'view' of 'segment_size' bytes without copying them.
+        The last slice may be shorter. An empty view still yields one empty slice.
+
+
+        Params:
+        -------
+        view : memoryview
+            The data to slice
+        segment_size : int
+            The maximum number of bytes per slice
+
+        """
+
+
+        yield view[ : segment_size ]
+
+
+
+        for start in range( segment_size, len( view ), segment_size ):
+
+            yield view[ start : start + segment_size ]
+
+
+
+
+
+    def open_output( self, output ):
+
+        """
+        Open the file at 'output' for writing ( or stdout if it is '-' ). Open files are written to as they are and left open.
+
+
+        Params:
+        -------
+        output : str | Path | binary file object
+            The filename at which to write the data, or an open file
+
+        """
+
+
+        if output == '-':
+
+            return contextlib.nullcontext( sys.stdout.buffer )
+
+
+        if hasattr( output, 'write' ):
+
+            return contextlib.nullcontext( output )
+
+
+        try:
+
+            return Path( output ).resolve( ).open( 'wb' )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not write encrypted data to { mapping.describe( output ) }.' )
+
+
+
+
+
+    def write_output_data( self, output, output_file, *output_data: bytes ):
+
+        """
+        Write each of 'output_data' to 'output_file'.
+
+
+        Params:
+        -------
+        output : str | Path | binary file object
+            What 'output_file' was opened from ( used for error messages )
+        output_file
+            The open binary file object to write to
+        output_data : bytes
+            The data to write to the file
+
+        """
+
+
+        try:
+
+            with self.stats.phase( 'write_output', sum( len( data ) for data in output_data ) ):
+
+                for data in output_data:
+
+                    output_file.write( data )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not write encrypted data to { self.describe_output( output ) }.' )
+
+
+
+
+
+    def flush_output( self, output, output_file ):
+
+        """
+        Flush 'output_file' so the encrypted data is written before returning, for outputs that are left open.
+        """
+
+
+        try:
+
+            with self.stats.phase( 'write_output' ):
+
+                output_file.flush( )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not write encrypted data to { self.describe_output( output ) }.' )
+
+
+
+
+
+    def sync_output( self, output, output_file ):
+
+        """
+        Truncate 'output_file' at the current position and write it to disk.
+        """
+
+
+        try:
+
+            with self.stats.phase( 'write_output' ):
+
+                output_file.truncate( )
+
+                output_file.flush( )
+
+                os.fsync( output_file.fileno( ) )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not write encrypted data to { self.describe_output( output ) }.' )
+
+
+
+
+
+    def restore_tail( self, output, output_file, offset: int, tail: bytes ):
+
+        """
+        Write back the index, sessions, and footer that were at 'offset' before a failed append, so the container holds its earlier data again.
+        """
+
+
+        try:
+
+            output_file.seek( offset )
+
+            output_file.write( tail )
+
+            output_file.truncate( )
+
+            output_file.flush( )
+
+            os.fsync( output_file.fileno( ) )
 
-        except:
+        except OSError:
 
-            print( f'Could not write encrypted data to file at "{ output_filename }".', file = sys.stderr )
+            raise errors.OutputError( f'Could not restore the index of { self.describe_output( output ) } after a failed append. The container must be restored from a backup.' )
 
-            exit( 1 )
 
 
 
 
+    def describe_output( self, output ) -> str:
 
+        return 'stdout' if output == '-' else mapping.describe( output )
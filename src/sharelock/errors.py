@@ -0,0 +1,78 @@
+"""
+
+This module defines the errors raised by sharelock.
+
+Every error is a SharelockError whose message can be shown to the user as it is.
+The command line prints the message and exits with 1. Library callers can catch the specific error types below.
+
+"""
+
+
+
+
+class SharelockError( Exception ):
+
+    """
+    Base class of every error raised by sharelock.
+    """
+
+
+
+
+
+class InputError( SharelockError ):
+
+    """
+    An input ( data, key, DEK, or manifest ) could not be read.
+    """
+
+
+
+
+
+class OutputError( SharelockError ):
+
+    """
+    An output could not be written.
+    """
+
+
+
+
+
+class UsageError( SharelockError, ValueError ):
+
+    """
+    The parameters can not be used together, or are out of range.
+    """
+
+
+
+
+
+class KeyShareError( SharelockError, ValueError ):
+
+    """
+    Key shares could not be decoded, combined, or split.
+    """
+
+
+
+
+
+class IntegrityError( SharelockError, ValueError ):
+
+    """
+    Encrypted data or an encrypted DEK failed authentication or is malformed.
+    Either the keys are wrong or the data has been modified.
+    """
+
+
+
+
+
+class AgentError( SharelockError ):
+
+    """
+    The agent could not be reached or refused a request.
+    """
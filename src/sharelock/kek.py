@@ -1,21 +1,20 @@
 
 
-import sys
-
 from pathlib import Path
 
 
 
-import ecies
+# ecies, coincurve, and eth_keys take most of the startup time of the command line,
+# so they are imported by the methods that use them rather than when this module is loaded
 
-import coincurve
 
-import eth_keys
 
 
+import sharelock.shamir_secret_sharing as sss
 
+import sharelock.errors as errors
 
-import sharelock.shamir_secret_sharing as sss
+import sharelock.stats as stats
 
 
 
@@ -24,9 +23,9 @@ class KEK:
 
 
 
-    def __init__( self ):
+    def __init__( self, phase_stats = stats.NULL_STATS ):
 
-        pass
+        self.stats = phase_stats
 
     
 
@@ -48,54 +47,107 @@ class KEK:
             The number of key shares needed to reconstruct the private key
         padding_byte : bytes
             The bytes used to pad chunks of the key before it is split if needed
+        quiet : bool - default False
+            If set to True, print only the shares
 
         """
 
 
-        # create private/public key pair
+        public_key, split_key = self.create( shares, threshold, padding_byte )
 
-        key_encryption_key = eth_keys.keys.PrivateKey( coincurve.utils.get_valid_secret( ) )
 
+        
+        # write public key to file
 
+        try:
 
-        private_key = key_encryption_key.to_bytes( )
+            with self.stats.phase( 'write_kek', len( public_key ) ):
 
+                Path( public_key_filename ).resolve( ).write_bytes( public_key )
 
-        public_key = key_encryption_key.public_key.to_bytes( )
+        except OSError:
 
+            raise errors.OutputError( f'Could not write public key to file "{ public_key_filename }".' )
 
-        
-        # write public key to file
 
-        try:
 
-            Path( public_key_filename ).resolve( ).write_bytes( public_key )
+        with self.stats.phase( 'print_shares' ):
+
+            sss.print_secrets( split_key, threshold = threshold, quiet = quiet )
+
 
-        except:
 
-            print( f'Could not write public key to file "{ public_key_filename }".', file = sys.stderr )
 
-            exit( 1 )
 
+    def create( self, shares: int, threshold: int, padding_byte: bytes = None ):
+
+        """
 
+        Create a new asymetric Key Encryption Key and split its private key, without writing or printing anything.
 
 
-        # split private key and print shares
+        Params:
+        ------
+        shares : int
+            The number of key shares the private key will be broken into
+        threshold : int
+            The number of key shares needed to reconstruct the private key
+        padding_byte : bytes
+            The bytes used to pad chunks of the key before it is split if needed
+
+
+        Returns:
+        -------
+        public_key : bytes
+            The Public Key Encryption Key
+        split_key : list[ tuple[ int, bytes ] ]
+            The key shares of the Private Key Encryption Key
+
+
+        Raises:
+        -------
+        sharelock.errors.KeyShareError
+            If the private key can not be split into 'shares' shares with 'threshold'.
+
+        """
+
+
+        # create private/public key pair
 
+        import coincurve
+
+        import eth_keys
+
+
+
+        with self.stats.phase( 'generate_kek' ):
+
+            key_encryption_key = eth_keys.keys.PrivateKey( coincurve.utils.get_valid_secret( ) )
+
+
+
+            private_key = key_encryption_key.to_bytes( )
+
+
+            public_key = key_encryption_key.public_key.to_bytes( )
+
+
+
+        # split private key
 
         try:
 
-            split_key = sss.split( private_key, shares, threshold, padding_byte )
+            with self.stats.phase( 'split_kek', len( private_key ) ):
 
-        except Exception as e:
+                split_key = sss.split( private_key, shares, threshold, padding_byte )
 
-            print( f'Could not split private key: { e.args[ 0 ] }', file = sys.stderr )
+        except Exception as e:
 
-            exit( 1 )
+            raise errors.KeyShareError( f'Could not split private key: { e.args[ 0 ] }' )
 
 
 
-        sss.print_secrets( split_key, threshold = threshold, quiet = quiet )
+        return public_key, split_key
 
 
 
@@ -119,10 +171,25 @@ class KEK:
         bytes
             The encrypted ciphertext
 
+
+        Raises:
+        -------
+        sharelock.errors.UsageError
+            If 'public_key' is not a valid public key.
+
         """
 
 
-        encrypted = ecies.encrypt( public_key, data )
+        import ecies
+
+
+        try:
+
+            encrypted = ecies.encrypt( public_key, data )
+
+        except ( TypeError, ValueError ):
+
+            raise errors.UsageError( 'The Public Key Encryption Key is not a valid public key.' )
 
 
         return encrypted
@@ -150,6 +217,12 @@ class KEK:
         bytes
             The original text
 
+
+        Raises:
+        -------
+        sharelock.errors.IntegrityError
+            If the keys are wrong or the encrypted data has been modified.
+
         """
 
 
@@ -157,14 +230,12 @@ class KEK:
 
         try:
 
-            decrypted = ecies.decrypt( private_key, data )
-
+            decrypted = self.unwrap( data, private_key )
 
-        except:
 
-            print( 'Could not perform decryption. Either the keys are wrong or the encrypted data has been modified.', file = sys.stderr )
+        except ValueError:
 
-            exit( 1 )
+            raise errors.IntegrityError( 'Could not perform decryption. Either the keys are wrong or the encrypted data has been modified.' )
 
 
 
@@ -174,6 +245,82 @@ class KEK:
 
 
 
+    def unwrap( self, data: bytes, private_key: bytes ):
+
+        """
+        Decrypt data using the private key. Unlike decrypt( ), failures are raised to the caller.
+
+        ECIES only takes the private key as bytes, so a key passed as a bytearray or memoryview ( such as the locked key of the agent )
+        is copied into bytes for the duration of the call. That copy is freed afterwards, but can not be wiped.
+
+
+        Params:
+        -------
+        data : bytes
+            The data to decrypt
+        private_key : bytes | bytearray | memoryview
+            The private key to decrypt with
+
+
+        Returns:
+        -------
+        bytes
+            The original text
+
+
+        Raises:
+        -------
+        sharelock.errors.IntegrityError
+            If the keys are wrong or the encrypted data has been modified ( a ValueError ).
+
+        """
+
+
+        import ecies
+
+
+        try:
+
+            return ecies.decrypt( private_key if isinstance( private_key, bytes ) else bytes( private_key ), data )
+
+        except Exception:
+
+            raise errors.IntegrityError( 'Either the keys are wrong or the encrypted data has been modified.' )
+
+
+
+
+
+    def public_key( self, private_key: bytes ):
+
+        """
+
+        Derive the public key of a Private Key Encryption Key.
+
+
+        Returns:
+        -------
+        bytes | None
+            The public key, or None if 'private_key' is not a valid private key
+
+        """
+
+
+        import eth_keys
+
+
+        try:
+
+            return eth_keys.keys.PrivateKey( private_key ).public_key.to_bytes( )
+
+        except Exception:
+
+            return None
+
+
+
+
+
     def load( self, public_key_filename: str ):
 
         """
@@ -192,6 +339,12 @@ class KEK:
         bytes
             The public key
 
+
+        Raises:
+        -------
+        sharelock.errors.InputError
+            If the file can not be read or does not hold a valid public key.
+
         """
 
 
@@ -201,13 +354,16 @@ class KEK:
             key_bytes = Path( public_key_filename ).resolve( ).read_bytes( )
 
 
-        except:
+        except OSError:
 
 
-            print( f'Could not read public key at "{ public_key_filename }".', file = sys.stderr )
+            raise errors.InputError( f'Could not read public key at "{ public_key_filename }".' )
 
 
-            exit( 1 )
+
+        if not self.is_public_key( key_bytes ):
+
+            raise errors.InputError( f'"{ public_key_filename }" does not hold a valid Public Key Encryption Key.' )
 
 
 
@@ -215,3 +371,25 @@ class KEK:
 
 
 
+
+
+    def is_public_key( self, public_key: bytes ) -> bool:
+
+        """
+        Whether 'public_key' is a secp256k1 public key ( the raw 64 bytes written by generate( ), or SEC1 encoded ).
+        """
+
+
+        import coincurve
+
+
+        try:
+
+            coincurve.PublicKey( b'\x04' + public_key if len( public_key ) == 64 else public_key )
+
+        except Exception:
+
+            return False
+
+
+        return True
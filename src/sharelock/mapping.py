@@ -0,0 +1,337 @@
+
+
+"""
+
+Module for reading input files through memory maps, so their contents can be handed to the ciphers without copies.
+
+"""
+
+
+
+import os
+
+import mmap
+
+import stat
+
+import contextlib
+
+from pathlib import Path
+
+
+
+
+class MappedFile:
+
+    """
+    A read-only memory map of a whole file.
+
+    'view' is a memoryview of the file contents. Slices of it can be passed straight to the ciphers,
+    which read them from the page cache without copying them into Python bytes objects.
+    """
+
+
+
+    def __init__( self, filename ):
+
+        """
+        Map the file at 'filename'.
+
+
+        Params:
+        -------
+        filename : str | Path | file object
+            The file to map. An open binary file is mapped as it is and left open.
+
+
+        Raises:
+        -------
+        OSError
+            If the file can not be opened or mapped.
+
+        """
+
+
+        self.mapped = None
+
+        self.released = 0
+
+
+        with contextlib.nullcontext( filename ) if hasattr( filename, 'fileno' ) else open( filename, 'rb' ) as file:
+
+
+            if os.fstat( file.fileno( ) ).st_size == 0:
+
+                # empty files can not be mapped
+
+                self.view = memoryview( b'' )
+
+                return
+
+
+            self.mapped = mmap.mmap( file.fileno( ), 0, access = mmap.ACCESS_READ )
+
+
+
+        if hasattr( self.mapped, 'madvise' ) and hasattr( mmap, 'MADV_SEQUENTIAL' ):
+
+            self.mapped.madvise( mmap.MADV_SEQUENTIAL )
+
+
+        self.view = memoryview( self.mapped )
+
+
+
+
+    def release_before( self, position: int ):
+
+        """
+        Tell the kernel that the pages before 'position' are no longer needed, so they stop counting towards
+        the resident memory of the process. The file contents stay in the page cache and are read back if accessed again.
+
+
+        Params:
+        -------
+        position : int
+            The offset before which all data has been processed
+
+        """
+
+
+        if self.mapped is None or not hasattr( mmap, 'MADV_DONTNEED' ):
+
+            return
+
+
+        end = position - position % mmap.PAGESIZE
+
+
+        if end <= self.released:
+
+            return
+
+
+        self.mapped.madvise( mmap.MADV_DONTNEED, self.released, end - self.released )
+
+
+        self.released = end
+
+
+
+
+    def close( self ):
+
+        """
+        Release the view and unmap the file.
+        If slices of the view are still referenced, the map is released once they are garbage collected.
+        """
+
+
+        self.view.release( )
+
+
+        if self.mapped is None:
+
+            return
+
+
+        try:
+
+            self.mapped.close( )
+
+        except BufferError:
+
+            pass
+
+
+
+
+    def __enter__( self ):
+
+        return self
+
+
+
+
+    def __exit__( self, *exc_info ):
+
+        self.close( )
+
+
+
+
+
+class BufferReader:
+
+    """
+    File-like reader over a buffer whose read( ) returns memoryview slices instead of copies.
+    """
+
+
+
+    def __init__( self, buffer ):
+
+        self.view = memoryview( buffer )
+
+        self.position = 0
+
+
+
+
+    def read( self, length: int = -1 ):
+
+        start = self.position
+
+
+        end = len( self.view ) if length < 0 else min( start + length, len( self.view ) )
+
+
+        self.position = end
+
+
+        return self.view[ start : end ]
+
+
+
+
+    def seek( self, position: int ):
+
+        self.position = position
+
+
+
+
+    def tell( self ) -> int:
+
+        return self.position
+
+
+
+
+
+class InMemory:
+
+    """
+    Data that is already in memory, with the interface of MappedFile.
+    """
+
+
+
+    def __init__( self, data ):
+
+        self.view = memoryview( data )
+
+
+
+
+    def release_before( self, position: int ):
+
+        pass
+
+
+
+
+    def close( self ):
+
+        self.view.release( )
+
+
+
+
+    def __enter__( self ):
+
+        return self
+
+
+
+
+    def __exit__( self, *exc_info ):
+
+        self.close( )
+
+
+
+
+
+def is_regular_file( file ) -> bool:
+
+    """
+    Whether the binary file object 'file' is a regular file at its start, so it can be mapped.
+    """
+
+
+    try:
+
+        return file.seekable( ) and file.tell( ) == 0 and stat.S_ISREG( os.fstat( file.fileno( ) ).st_mode )
+
+    except ( OSError, ValueError ):
+
+        return False
+
+
+
+
+
+def open_source( source ):
+
+    """
+    Open data to read it as a whole.
+
+
+    Params:
+    -------
+    source : str | Path | bytes | bytearray | memoryview | binary file object
+        A filename, the data itself, or an open file. Files are mapped. Other file objects are read into memory.
+
+
+    Returns:
+    -------
+    MappedFile | InMemory
+        The opened data, with its contents in 'view'
+
+
+    Raises:
+    -------
+    OSError
+        If the data can not be read.
+
+    """
+
+
+    if isinstance( source, ( bytes, bytearray, memoryview ) ):
+
+        return InMemory( source )
+
+
+    if hasattr( source, 'read' ):
+
+        return MappedFile( source ) if is_regular_file( source ) else InMemory( source.read( ) )
+
+
+    return MappedFile( Path( source ).resolve( ) )
+
+
+
+
+
+def describe( target ) -> str:
+
+    """
+    Name 'target' ( a filename, file object, or data in memory ) in error messages.
+    """
+
+
+    if isinstance( target, ( str, Path ) ):
+
+        return f'file at "{ target }"'
+
+
+    if isinstance( target, ( bytes, bytearray, memoryview ) ):
+
+        return 'memory'
+
+
+    name = getattr( target, 'name', None )
+
+
+    return f'file at "{ name }"' if isinstance( name, str ) else 'the given file'
@@ -0,0 +1,265 @@
+
+
+"""
+
+Module for running segment work on multiple cores while keeping the segments in order.
+
+"""
+
+
+
+import os
+
+
+import queue
+
+import threading
+
+import collections
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+
+# how many items each worker may have queued up before the caller waits for the oldest result
+
+IN_FLIGHT_PER_JOB = 2
+
+
+# how often a blocked pipeline reader checks whether the pipeline was abandoned, in seconds
+
+POLL_INTERVAL = 0.1
+
+
+
+
+def resolve_jobs( jobs: int ) -> int:
+
+    """
+    Turn a '--jobs' value into a worker count. Values <= 0 mean one worker per available CPU.
+    """
+
+
+    if jobs > 0:
+
+        return jobs
+
+
+    return os.cpu_count( ) or 1
+
+
+
+
+
+def ordered_map( function, items, jobs: int = 1 ):
+
+    """
+    Apply 'function' to each of 'items' on a pool of 'jobs' threads and yield the results in the order of 'items'.
+
+    The ciphers used by sharelock release the GIL, so threads run the segment crypto on separate cores.
+    Only a bounded number of items is in flight at a time, so 'items' may be an unbounded stream.
+
+
+    Params:
+    -------
+    function
+        The function to call with each item
+    items
+        An iterable of items. It is consumed lazily, from the calling thread.
+    jobs : int - default 1
+        The number of worker threads. With 1 job, 'function' runs in the calling thread.
+
+
+    Yields:
+    -------
+    The result of 'function' for each item, in order.
+    An exception raised by 'function' or while iterating 'items' is raised here.
+
+    """
+
+
+    if jobs <= 1:
+
+        yield from map( function, items )
+
+        return
+
+
+
+    executor = ThreadPoolExecutor( max_workers = jobs )
+
+
+    pending = collections.deque( )
+
+
+
+    try:
+
+
+        for item in items:
+
+
+            pending.append( executor.submit( function, item ) )
+
+
+            if len( pending ) >= jobs * IN_FLIGHT_PER_JOB:
+
+                yield pending.popleft( ).result( )
+
+
+
+        while pending:
+
+            yield pending.popleft( ).result( )
+
+
+
+    finally:
+
+        executor.shutdown( wait = True, cancel_futures = True )
+
+
+
+
+
+def pipeline( function, items, jobs: int = 1, queue_depth: int = None ):
+
+    """
+    Run 'items' through a reader thread, a pool of 'jobs' worker threads applying 'function', and the calling thread,
+    which receives the results in the order of 'items'.
+
+    The reader thread iterates 'items' ( reading the input ) and hands each item to the workers while the calling thread
+    writes the earlier results, so reading, the ciphers, and writing all overlap.
+    The reader stays at most 'queue_depth' items ahead of the calling thread, so a slow writer holds back the reader
+    instead of filling memory.
+
+
+    Params:
+    -------
+    function
+        The function to call with each item
+    items
+        An iterable of items. It is consumed lazily, from the reader thread.
+    jobs : int - default 1
+        The number of worker threads
+    queue_depth : int | None - default None
+        The number of items the reader may be ahead of the calling thread. If set to None, IN_FLIGHT_PER_JOB per job.
+        With 0, every stage runs in the calling thread, one item at a time.
+
+
+    Yields:
+    -------
+    The result of 'function' for each item, in order.
+    An exception raised by 'function' or while iterating 'items' is raised here, after the results of the items before it.
+
+    """
+
+
+    if queue_depth is None:
+
+        queue_depth = max( jobs, 1 ) * IN_FLIGHT_PER_JOB
+
+
+    if queue_depth <= 0:
+
+        yield from map( function, items )
+
+        return
+
+
+
+    executor = ThreadPoolExecutor( max_workers = max( jobs, 1 ) )
+
+
+    pending = queue.Queue( maxsize = queue_depth )
+
+
+    stop = threading.Event( )
+
+
+
+    def put( entry ):
+
+        while not stop.is_set( ):
+
+            try:
+
+                pending.put( entry, timeout = POLL_INTERVAL )
+
+                return
+
+            except queue.Full:
+
+                continue
+
+
+
+    def read( ):
+
+        try:
+
+            for item in items:
+
+                put( ( executor.submit( function, item ), None ) )
+
+
+                if stop.is_set( ):
+
+                    return
+
+        except BaseException as e:
+
+            put( ( None, e ) )
+
+            return
+
+
+        put( ( None, None ) )
+
+
+
+    # daemon, so a reader blocked on input can not keep the process alive after the pipeline is abandoned
+
+    reader = threading.Thread( target = read, daemon = True )
+
+    reader.start( )
+
+
+
+    try:
+
+
+        while True:
+
+
+            future, failure = pending.get( )
+
+
+            if future is None:
+
+                break
+
+
+            yield future.result( )
+
+
+
+        if failure is not None:
+
+            raise failure
+
+
+
+    finally:
+
+        stop.set( )
+
+
+        while not pending.empty( ):
+
+            pending.get_nowait( )
+
+
+        executor.shutdown( wait = True, cancel_futures = True )
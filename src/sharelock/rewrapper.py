@@ -0,0 +1,470 @@
+"""
+
+Module for rewrapping Data Encryption Keys for a new Key Encryption Key.
+
+Rotating the Key Encryption Key only changes how each DEK is wrapped. The data stays encrypted under the same DEK,
+so rewrapping a file costs one ECIES decryption and one ECIES encryption however large the data is.
+
+"""
+
+
+
+import os
+
+import shutil
+
+import tempfile
+
+from pathlib import Path
+
+
+
+import sharelock.errors as errors
+
+import sharelock.kek as kek
+
+import sharelock.parallel as parallel
+
+import sharelock.container as container
+
+import sharelock.decrypter as decrypter
+
+import sharelock.stream_format as stream_format
+
+import sharelock.stats as stats
+
+
+
+
+# files larger than this are not DEK files ( a wrapped 32 byte DEK is 129 bytes )
+
+MAX_DEK_FILE_SIZE = 4096
+
+
+
+# suffix of the copy of a container header that is kept next to the container while the header is rewritten
+
+HEADER_BACKUP_SUFFIX = '.header-backup'
+
+
+
+
+class Rewrapper:
+
+
+
+    def __init__( self, phase_stats = stats.NULL_STATS ):
+
+        self.stats = phase_stats
+
+
+
+
+    def rewrap( self, paths: list[ str ], public_key_filename: str, jobs: int = 1, agent_socket: str = None, private_kek: bytes = None ):
+
+        """
+
+        Rewrap the DEKs held by 'paths' for a new Public Key Encryption Key.
+
+        DEK files are replaced. In a container, the DEK encrypted for the old key is replaced in the container header, in place,
+        without reading or moving the segments. DEKs the container holds for other keys are kept.
+        Containers that already hold a DEK for the new key are skipped, so an interrupted rewrap can be run again with the same files.
+        DEK files can not tell which key they were encrypted for, so DEK files that can not be decrypted with the old key
+        ( such as those rewrapped by an earlier run ) are skipped and returned instead of failing the other files.
+        If the old key decrypts none of the DEKs, the key is taken to be wrong and nothing is rewrapped.
+
+        Every DEK is read and unwrapped before any file is changed. A container header is backed up next to the container
+        until its replacement is synced, and a backup left by an interrupted rewrap is restored before the container is read.
+
+
+        Params:
+        -------
+        paths : list[ str ]
+            Containers and DEK files
+        public_key_filename : str
+            The filename that holds the new Public Key Encryption Key
+        jobs : int - default 1
+            The number of files to read, unwrap, and rewrap in parallel
+        agent_socket : str | None - default None
+            The socket of a running agent holding the old Private Key Encryption Key
+        private_kek : bytes | None - default None
+            The old Private Key Encryption Key. If neither this nor 'agent_socket' is set, key shares are read from stdin.
+
+
+        Returns:
+        -------
+        rewrapped : int
+            The number of files that were rewrapped
+        skipped : list[ str ]
+            The DEK files that were skipped because their DEK could not be decrypted with the old key
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If a file can not be read or written, the DEK of a container can not be unwrapped with the old key,
+            or no DEK can be unwrapped with the old key.
+
+        """
+
+
+        with self.stats.phase( 'load_kek' ):
+
+            public_kek = kek.KEK( ).load( public_key_filename )
+
+
+        new_fingerprint = container.fingerprint( public_kek )
+
+
+
+        # read every dek before asking for shares
+
+        targets = [
+            target for target in parallel.ordered_map( self.read_target, paths, jobs )
+            if target[ 1 ] is None or not any( recipient[ 'kek' ] == new_fingerprint for recipient in target[ 2 ][ 'recipients' ] )
+        ]
+
+
+        if not targets:
+
+            return 0, [ ]
+
+
+
+        opened = decrypter.Decrypter( self.stats ).open_recipients( [ target[ 3 ] for target in targets ], jobs, agent_socket, private_kek, skip_failures = True )
+
+
+        skipped = [ ]
+
+        unwrapped = [ ]
+
+
+        for target, opened_dek in zip( targets, opened ):
+
+
+            if opened_dek is not None:
+
+                unwrapped.append( ( target, opened_dek ) )
+
+            elif target[ 1 ] is None:
+
+                skipped.append( target[ 0 ] )
+
+            else:
+
+                raise errors.IntegrityError( f'Could not decrypt the DEK of "{ target[ 0 ] }" with the old key. Either the keys are wrong or the container has been modified.' )
+
+
+
+        # a wrong old key fails every DEK file, which must not pass for a finished rewrap
+
+        if not unwrapped:
+
+            raise errors.IntegrityError( 'Could not decrypt any DEK with the old key. Either the keys are wrong or every file has already been rewrapped.' )
+
+
+
+
+        def rewrap_target( entry ):
+
+
+            ( path, header_length, params, _ ), ( recipient_index, decrypted_dek ) = entry
+
+
+
+            with self.stats.phase( 'wrap_dek' ):
+
+                encrypted_dek = kek.KEK( ).encrypt( decrypted_dek, public_kek )
+
+
+
+            if header_length is None:
+
+                self.replace_dek_file( path, encrypted_dek )
+
+                return
+
+
+
+            params[ 'recipients' ][ recipient_index ] = container.new_recipient( public_kek, encrypted_dek )
+
+
+            self.rewrite_header( path, header_length, container.rewrite_header( header_length, params ) )
+
+
+
+        for _ in parallel.ordered_map( rewrap_target, unwrapped, jobs ):
+
+            pass
+
+
+
+        return len( unwrapped ), skipped
+
+
+
+
+    def read_target( self, path: str ):
+
+        """
+
+        Read the encrypted DEKs of a container or DEK file.
+
+
+        Returns:
+        -------
+        tuple[ str, int | None, dict | None, list[ dict ] ]
+            The path, the header length and header parameters of a container ( None for DEK files ),
+            and the recipients ( see decrypter.Decrypter.read_recipients( ) )
+
+        """
+
+
+        self.restore_header( path )
+
+
+
+        try:
+
+            with self.stats.phase( 'read_dek' ), Path( path ).resolve( ).open( 'rb' ) as file:
+
+
+                prefix = file.read( MAX_DEK_FILE_SIZE + 1 )
+
+
+                if container.is_container( prefix ):
+
+                    file.seek( 0 )
+
+
+                    header_length, params = container.read_header( file )
+
+
+                    return path, header_length, params, params[ 'recipients' ]
+
+        except ValueError as e:
+
+            raise errors.IntegrityError( f'Could not read encrypted DEK from file at "{ path }": { e.args[ 0 ] }' )
+
+        except OSError:
+
+            raise errors.InputError( f'Could not read encrypted DEK from file at "{ path }".' )
+
+
+
+        if stream_format.is_segmented( prefix ) or len( prefix ) > MAX_DEK_FILE_SIZE:
+
+            raise errors.UsageError( f'"{ path }" is neither a container nor a DEK file. Rewrap the DEK file of older encrypted data instead.' )
+
+
+
+        return path, None, None, [ { 'kek': None, 'dek': prefix } ]
+
+
+
+
+    def replace_dek_file( self, path: str, encrypted_dek: bytes ):
+
+        """
+        Replace the DEK file at 'path' through a temporary file, so it holds either the old or the new DEK if interrupted.
+        """
+
+
+        path = Path( path ).resolve( )
+
+        temporary_name = None
+
+
+        try:
+
+            with self.stats.phase( 'write_dek', len( encrypted_dek ) ):
+
+
+                with tempfile.NamedTemporaryFile( dir = path.parent, prefix = f'.{ path.name }.', delete = False ) as temporary:
+
+                    temporary_name = temporary.name
+
+                    temporary.write( encrypted_dek )
+
+                    temporary.flush( )
+
+                    os.fsync( temporary.fileno( ) )
+
+
+                shutil.copymode( path, temporary_name )
+
+                os.replace( temporary_name, path )
+
+        except OSError:
+
+            if temporary_name is not None and os.path.exists( temporary_name ):
+
+                os.unlink( temporary_name )
+
+
+            raise errors.OutputError( f'Could not write encrypted DEK to file at "{ path }".' )
+
+
+
+
+    def rewrite_header( self, path: str, header_length: int, header: bytes ):
+
+        """
+
+        Overwrite the header of the container at 'path' with 'header', which has the same length.
+
+        The old header is first written to a backup next to the container and synced, and the backup is only removed once
+        the new header is synced. A crash or a full disk part way through therefore never loses the only wrapped copy of the DEK:
+        restore_header( ) puts the old header back, which still decrypts the container with the old key.
+
+        """
+
+
+        path = Path( path ).resolve( )
+
+        backup_path = self.header_backup_path( path )
+
+        temporary_name = None
+
+
+
+        try:
+
+            with self.stats.phase( 'write_dek', len( header ) ), path.open( 'r+b' ) as file:
+
+
+                old_header = file.read( header_length )
+
+
+
+                with tempfile.NamedTemporaryFile( dir = path.parent, prefix = f'{ backup_path.name }.', delete = False ) as temporary:
+
+                    temporary_name = temporary.name
+
+                    temporary.write( old_header )
+
+                    temporary.flush( )
+
+                    os.fsync( temporary.fileno( ) )
+
+
+                os.replace( temporary_name, backup_path )
+
+                temporary_name = None
+
+                self.sync_directory( path.parent )
+
+
+
+                file.seek( 0 )
+
+                file.write( header )
+
+                file.flush( )
+
+                os.fsync( file.fileno( ) )
+
+
+            backup_path.unlink( )
+
+        except OSError:
+
+            if temporary_name is not None and os.path.exists( temporary_name ):
+
+                os.unlink( temporary_name )
+
+
+            if backup_path.exists( ):
+
+                raise errors.OutputError( f'Could not write the container header of "{ path }". Run rewrap again to restore the old header from "{ backup_path }".' )
+
+
+            raise errors.OutputError( f'Could not write the container header of "{ path }".' )
+
+
+
+
+
+    def restore_header( self, path: str ):
+
+        """
+        Put back the header backed up by an interrupted rewrite_header( ), if there is one.
+        """
+
+
+        path = Path( path ).resolve( )
+
+        backup_path = self.header_backup_path( path )
+
+
+        if not backup_path.exists( ):
+
+            return
+
+
+
+        try:
+
+            old_header = backup_path.read_bytes( )
+
+
+            if not container.is_container( old_header ):
+
+                raise errors.IntegrityError( f'The header backup "{ backup_path }" is not a container header. Move it away to rewrap "{ path }".' )
+
+
+
+            with self.stats.phase( 'write_dek', len( old_header ) ), path.open( 'r+b' ) as file:
+
+                file.write( old_header )
+
+                file.flush( )
+
+                os.fsync( file.fileno( ) )
+
+
+            backup_path.unlink( )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not restore the container header of "{ path }" from "{ backup_path }".' )
+
+
+
+
+
+    def header_backup_path( self, path: Path ) -> Path:
+
+        return path.parent / f'.{ path.name }{ HEADER_BACKUP_SUFFIX }'
+
+
+
+
+
+    def sync_directory( self, directory: Path ):
+
+        """
+        Sync a directory so a file just renamed into it survives a crash ( where the platform allows it ).
+        """
+
+
+        try:
+
+            descriptor = os.open( directory, os.O_RDONLY )
+
+        except OSError:
+
+            return
+
+
+        try:
+
+            os.fsync( descriptor )
+
+        except OSError:
+
+            pass
+
+        finally:
+
+            os.close( descriptor )
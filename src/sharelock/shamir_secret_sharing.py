@@ -1,14 +1,22 @@
-
 """
 This module handles splitting and combining Shamir Secret Sharing shares.
 
+The data is split in 16 byte chunks, each of which is an element of GF(2^128)
+( the same field and encoding as Crypto.Protocol.SecretSharing.Shamir, so shares are interchangeable with it ).
+Instead of handling one chunk at a time, all chunks of the data are packed side by side into one Python integer
+( one LANE_BYTES wide lane per chunk ), so each field operation is applied to every chunk at once.
+
 """
 
 
+import sys
+
 import base64
 
+import functools
+
 
-from Crypto.Protocol.SecretSharing import Shamir
+from Crypto.Random import get_random_bytes
 
 
 
@@ -27,13 +35,35 @@ ALTERNATE_PADDING_BYTE = b'\x01'
 
 
 
+# the field is GF(2^128) with the irreducible polynomial x^128 + x^7 + x^2 + x + 1
+
+FIELD_BITS = 128
+
+
+IRREDUCIBLE_POLYNOMIAL = ( 1 << FIELD_BITS ) | 0x87
+
+
+
+# each packed chunk gets one spare byte above its 128 bits to catch the carry of a multiplication by x
+
+LANE_BYTES = SHAMIR_SPLIT_LENGTH + 1
+
+
+
+# number of distinct sets of share indices whose interpolation coefficients are kept
+
+LAGRANGE_CACHE_SIZE = 64
+
+
+
+
 def split( data: bytes, shares: int, threshold: int, padding_byte: bytes = PADDING_BYTE ):
 
     """
     Use Shamir's Secret Sharing to split 'data' into 'shares' keys.
     The combine() function requires 'threshold' of these keys to reconstruct the data.
 
-    Since the Shamir.split function ( that this is built upon ) can only use 16 byte chunks,
+    Since the data is split in 16 byte chunks ( one field element each ),
     the last chunk will be right-padded with 'padding_byte', meaning that the combine function will remove all
     trailing 'padding_byte' bytes. Keep this in mind if the 'data' ends with that byte.
 
@@ -47,7 +77,7 @@ def split( data: bytes, shares: int, threshold: int, padding_byte: bytes = PADDI
     threshold : int
         The number of created secret shares to require to reconstruct the 'data'.
     padding_byte : bytes | None - default b'\x00'
-        The byte with which to right-pad the last chunk to make Shamir.split work. 
+        The byte with which to right-pad the last chunk to a whole field element.
         If set to None, use the default.
 
 
@@ -89,42 +119,60 @@ def split( data: bytes, shares: int, threshold: int, padding_byte: bytes = PADDI
 
 
 
-    data_shares = [ 
-        ( index, b'' ) 
-        for index in range( 1, shares + 1 ) 
-    ]
+    data = data + ALTERNATE_PADDING_BYTE
 
 
+    chunk_count = -( -len( data ) // SHAMIR_SPLIT_LENGTH )
 
 
-    data = data + ALTERNATE_PADDING_BYTE
+    data = data.ljust( chunk_count * SHAMIR_SPLIT_LENGTH, padding_byte )
+
+
+
+    # random coefficients for every chunk at once, highest degree first, with the data as the constant term
+
+    coefficients = [ pack( get_random_bytes( chunk_count * SHAMIR_SPLIT_LENGTH ) ) for _ in range( threshold - 1 ) ]
+
+    coefficients.append( pack( data ) )
+
+
+
+    # evaluate the polynomials at every share index at once with Horner's method:
+    # the lanes of all shares are packed together and each share's lanes are multiplied by its own index
 
+    lane_count = shares * chunk_count
 
 
-    for i in range( 0, len( data ), SHAMIR_SPLIT_LENGTH ):
+    ones = lane_ones( lane_count )
 
 
-        current_chunk = data[ i : i + SHAMIR_SPLIT_LENGTH ]
+    index_masks = share_index_masks( shares, chunk_count )
 
 
-        current_chunk = current_chunk.ljust( SHAMIR_SPLIT_LENGTH, padding_byte )
+    repeat = lane_ones( shares, chunk_count * LANE_BYTES )
 
 
-        result = Shamir.split( threshold, shares, current_chunk, False )
 
+    share_values = 0
 
 
-        for ( index, share ) in result:
+    for coefficient in coefficients:
 
+        share_values = multiply_by_share_indices( share_values, index_masks, ones ) ^ ( coefficient * repeat )
 
-            share_index, share_value = data_shares[ index - 1 ]
 
 
-            data_shares[ index - 1 ] = ( share_index, share_value + share )
+    share_lanes = unpack( share_values, lane_count )
 
 
+    share_length = chunk_count * SHAMIR_SPLIT_LENGTH
 
-    return data_shares
+
+
+    return [
+        ( index, share_lanes[ ( index - 1 ) * share_length : index * share_length ] )
+        for index in range( 1, shares + 1 )
+    ]
 
 
 
@@ -153,6 +201,12 @@ def combine( shares: list[ tuple[ int, bytes ] ], padding_byte: bytes = PADDING_
     bytes
         The original data that was split into the shares.
 
+
+    Raises:
+    -------
+    ValueError
+        If share indices are repeated or invalid, or the shares have different lengths.
+
     """
 
 
@@ -168,25 +222,45 @@ def combine( shares: list[ tuple[ int, bytes ] ], padding_byte: bytes = PADDING_
 
 
 
+    indices = [ index for index, _ in shares ]
+
+
+    if len( set( indices ) ) != len( indices ):
+
+        raise ValueError( 'Duplicate share.' )
+
+
+    if any( index <= 0 or index >= 1 << FIELD_BITS for index in indices ):
+
+        raise ValueError( 'Share indices must be > 0 and < 2^128.' )
+
 
-    result = b''
+    if any( len( share ) != len( shares[ 0 ][ 1 ] ) or len( share ) % SHAMIR_SPLIT_LENGTH != 0 for _, share in shares ):
 
+        raise ValueError( f'Shares must all have the same length, a multiple of { SHAMIR_SPLIT_LENGTH } bytes.' )
 
 
 
-    for i in range( 0, len( shares[ 0 ][ 1 ] ), SHAMIR_SPLIT_LENGTH ):
+    chunk_count = len( shares[ 0 ][ 1 ] ) // SHAMIR_SPLIT_LENGTH
 
 
-        chunks = [ 
-            ( index, share[ i : i + SHAMIR_SPLIT_LENGTH ] ) 
-            for ( index, share ) in shares 
-        ]
 
+    # Lagrange interpolation at 0: the data is the sum of each share value times its basis coefficient
 
-        combined_chunk = Shamir.combine( chunks, False )
+    coefficients = lagrange_coefficients( tuple( indices ) )
 
 
-        result += combined_chunk
+    packed_result = 0
+
+
+    for ( _, share ), coefficient in zip( shares, coefficients ):
+
+        packed_result ^= multiply( pack( share ), coefficient, chunk_count )
+
+
+
+    result = unpack( packed_result, chunk_count )
+
 
 
     # remove the padding_byte bytes and the alternate padding byte
@@ -202,10 +276,11 @@ def combine( shares: list[ tuple[ int, bytes ] ], padding_byte: bytes = PADDING_
 
 
 
-def print_secrets( shares: list[ tuple[ int, bytes ] ], threshold: int = None, quiet = False ):
+def print_secrets( shares: list[ tuple[ int, bytes ] ], threshold: int = None, quiet = False, output = None ):
 
     """
     Write secret shares to stdout.
+    The shares are encoded and written as a stream of lines, so large numbers of shares are written in a few buffered writes.
 
 
     Params:
@@ -218,17 +293,22 @@ def print_secrets( shares: list[ tuple[ int, bytes ] ], threshold: int = None, q
     quiet : bool - default False
         If set to true, do not print user instructions - only print the shares.
         Useful for scripting.
+    output : text file | None - default None
+        Where to write the shares. If set to None, use stdout.
 
     """
 
 
+    output = sys.stdout if output is None else output
+
+
     threshold_text = f'( Any { threshold } shares are required for reconstruction )' if threshold is not None else ''
 
 
 
     if not quiet:
 
-        print( f'Secret Shares: { threshold_text }' )
+        print( f'Secret Shares: { threshold_text }', file = output )
 
 
 
@@ -236,13 +316,299 @@ def print_secrets( shares: list[ tuple[ int, bytes ] ], threshold: int = None, q
 
 
 
-    for index, secret in shares:
+    output.writelines(
+        f'{ str( index ).ljust( padding_required ) } - { base64.b64encode( secret ).decode( ) }\n'
+        for index, secret in shares
+    )
+
+
+    output.flush( )
+
+
+
+
+
+
+@functools.lru_cache( maxsize = LAGRANGE_CACHE_SIZE )
+def lagrange_coefficients( indices: tuple[ int, ... ] ) -> tuple[ int, ... ]:
+
+    """
+    The Lagrange basis coefficients for interpolating at 0 from shares with 'indices'.
+
+    They only depend on which shares are combined, so they are computed once per set of indices
+    and applied to every chunk. Recently used sets are cached for repeated combines over the same quorum.
+
+
+    Params:
+    -------
+    indices : tuple[ int, ... ]
+        The distinct share indices, in the order of the shares
+
+
+    Returns:
+    -------
+    tuple[ int, ... ]
+        The coefficient of each share, in the same order
+
+    """
+
+
+    coefficients = [ ]
+
+
+
+    for j, index_j in enumerate( indices ):
+
+
+        numerator = 1
+
+        denominator = 1
+
+
+        for m, index_m in enumerate( indices ):
+
+            if m != j:
+
+                numerator = multiply( numerator, index_m )
+
+                denominator = multiply( denominator, index_j ^ index_m )
+
+
+
+        coefficients.append( multiply( numerator, inverse( denominator ) ) )
+
+
+
+    return tuple( coefficients )
+
+
+
+
+
+
+def pack( data: bytes ) -> int:
+
+    """
+    Pack 16 byte chunks of 'data' into the lanes of a single integer ( the first chunk in the highest lane ).
+    """
+
+
+    return int.from_bytes(
+        b''.join(
+            b'\x00' + data[ i : i + SHAMIR_SPLIT_LENGTH ]
+            for i in range( 0, len( data ), SHAMIR_SPLIT_LENGTH )
+        ),
+        'big',
+    )
+
+
+
+
+
+
+def unpack( packed: int, chunk_count: int ) -> bytes:
+
+    """
+    Undo pack( ) for 'chunk_count' chunks.
+    """
+
+
+    lanes = packed.to_bytes( chunk_count * LANE_BYTES, 'big' )
+
+
+    return b''.join(
+        lanes[ i + 1 : i + LANE_BYTES ]
+        for i in range( 0, len( lanes ), LANE_BYTES )
+    )
+
+
+
+
+
+
+def lane_ones( lane_count: int, lane_bytes: int = LANE_BYTES ) -> int:
+
+    """
+    An integer with the lowest bit of each of 'lane_count' lanes of 'lane_bytes' bytes set.
+    """
+
+
+    return int.from_bytes( ( bytes( lane_bytes - 1 ) + b'\x01' ) * lane_count, 'big' )
+
+
+
+
+
+
+def share_index_masks( shares: int, chunk_count: int ) -> list[ int ]:
+
+    """
+    For each bit of the largest share index, a mask selecting the lanes of every share whose index has that bit set.
+    Share 1 occupies the highest 'chunk_count' lanes, share 2 the next, and so on.
+    """
+
+
+    share_block = b'\xff' * ( chunk_count * LANE_BYTES )
+
+    empty_block = bytes( chunk_count * LANE_BYTES )
+
+
+
+    return [
+        int.from_bytes(
+            b''.join( share_block if index >> bit & 1 else empty_block for index in range( 1, shares + 1 ) ),
+            'big',
+        )
+        for bit in range( shares.bit_length( ) )
+    ]
+
+
+
+
+
+
+def multiply_by_share_indices( packed: int, index_masks: list[ int ], ones: int ) -> int:
+
+    """
+    Multiply the lanes of each share in 'packed' by that share's index.
+
+
+    Params:
+    -------
+    packed : int
+        The packed lanes of every share
+    index_masks : list[ int ]
+        The masks from share_index_masks( )
+    ones : int
+        lane_ones( ) for the total number of lanes
+
+    """
+
+
+    result = 0
+
+
+
+    for bit, mask in enumerate( index_masks ):
+
+
+        if bit:
+
+            packed <<= 1
+
+            packed ^= ( ( packed >> FIELD_BITS ) & ones ) * IRREDUCIBLE_POLYNOMIAL
+
+
+        result ^= packed & mask
+
+
+
+    return result
+
+
+
+
+
+
+def multiply( packed: int, factor: int, chunk_count: int = 1 ) -> int:
+
+    """
+    Multiply every lane of 'packed' by the field element 'factor'.
+    With the default 'chunk_count' of 1, this is the product of two field elements.
+
+
+    Params:
+    -------
+    packed : int
+        The packed field elements
+    factor : int
+        The field element to multiply each lane by
+    chunk_count : int - default 1
+        The number of lanes in 'packed'
+
+    """
+
+
+    ones = lane_ones( chunk_count )
+
+    result = 0
+
+
+
+    while factor:
+
+
+        if factor & 1:
+
+            result ^= packed
+
+
+        factor >>= 1
+
+
+
+        if factor:
+
+
+            # multiply every lane by x: shift, then reduce the lanes that overflowed into bit 128
+
+            packed <<= 1
+
+
+            packed ^= ( ( packed >> FIELD_BITS ) & ones ) * IRREDUCIBLE_POLYNOMIAL
+
+
+
+    return result
+
+
+
+
+
+
+def inverse( value: int ) -> int:
+
+    """
+    The multiplicative inverse of the field element 'value' ( binary extended Euclidean algorithm ).
+    """
+
+
+    if value == 0:
+
+        raise ValueError( 'Inversion of zero.' )
+
+
+
+    u, v = value, IRREDUCIBLE_POLYNOMIAL
+
+    g1, g2 = 1, 0
+
+
+
+    while u != 1:
+
+
+        shift = u.bit_length( ) - v.bit_length( )
+
+
+        if shift < 0:
+
+            u, v = v, u
+
+            g1, g2 = g2, g1
+
+            shift = -shift
+
+
+
+        u ^= v << shift
+
+        g1 ^= g2 << shift
 
 
-        encoded_secret = base64.b64encode( secret ).decode( )
 
+    return g1
 
-        print( f'{ str( index ).ljust( padding_required ) } - { encoded_secret }' )
 
 
 
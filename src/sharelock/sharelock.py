@@ -13,14 +13,16 @@ import sys
 import argparse
 
 
+from pathlib import Path
 
-import sharelock.kek as kek
 
 
-import sharelock.encrypter as encrypter
+import sharelock.errors as errors
 
 
-import sharelock.decrypter as decrypter
+
+# the sharelock modules ( and the crypto backends they load ) are imported by run( ) for the mode that needs them,
+# so '-h' and argument errors return without loading them
 
 
 
@@ -34,7 +36,10 @@ __version__ = '0.1.2'
 DEFAULT_PUBLIC_KEY_FILE = 'KEK.bin'
 
 
-DEFAULT_DEK_FILE = 'DEK.bin'
+
+# value of '-a' without a socket path, replaced with the default agent socket once the arguments are parsed
+
+DEFAULT_AGENT_SOCKET = ''
 
 
 
@@ -74,38 +79,159 @@ def create_parser( ) -> argparse.ArgumentParser:
     )
 
 
+    rewrap_parser = subparser.add_parser(
+        'rewrap',
+        help = 'Commands for rewrapping DEKs for a new Key Encryption Key without re-encrypting the data',
+    )
+
+
+    verify_parser = subparser.add_parser(
+        'verify',
+        help = 'Commands for checking that encrypted data is intact without writing the decrypted data',
+    )
 
-    decrypt_parser.add_argument(
+
+    agent_parser = subparser.add_parser(
+        'agent',
+        help = 'Commands for running an agent that holds the combined Key Encryption Key for repeated decryptions',
+    )
+
+
+
+    for stats_parser in ( encrypt_parser, decrypt_parser, generate_parser, rewrap_parser, verify_parser ):
+
+        stats_parser.add_argument(
+            '--stats',
+            nargs = '?',
+            const = '-',
+            metavar = 'FILE',
+            help = 'Write the time, bytes, and throughput of each phase as JSON to FILE ( defaults to stderr )',
+        )
+
+
+
+    decrypt_input_group = decrypt_parser.add_mutually_exclusive_group( required = True )
+
+
+    decrypt_input_group.add_argument(
         '-i',
         '--input-file',
-        required = True,
         help = 'File from which to read encrypted data and attempt decryption',
     )
 
 
+    decrypt_input_group.add_argument(
+        '-m',
+        '--manifest',
+        help = 'Manifest written by "encrypt --output-dir" listing the files to decrypt into --output-dir',
+    )
+
+
+    decrypt_input_group.add_argument(
+        '-p',
+        '--pair',
+        nargs = '+',
+        action = 'append',
+        metavar = ( 'INPUT_FILE', 'DEK_FILE' ),
+        help = 'An encrypted data file, and its DEK file if it is not a container, to decrypt into --output-dir ( may be repeated )',
+    )
+
+
     decrypt_parser.add_argument(
         '-d',
         '--dek-file',
-        help = 'Path from which to read the encrypted Data Encryption Key',
-        default = DEFAULT_DEK_FILE,
+        help = 'Path from which to read the encrypted Data Encryption Key ( defaults to the DEK embedded in a container, or DEK.bin for older files )',
+    )
+
+
+
+    decrypt_parser.add_argument(
+        '-a',
+        '--agent',
+        nargs = '?',
+        const = DEFAULT_AGENT_SOCKET,
+        metavar = 'SOCKET',
+        help = 'Decrypt the DEK with a running agent instead of reading key shares from stdin ( defaults to the default agent socket )',
+    )
+
+
+
+    decrypt_parser.add_argument(
+        '--offset',
+        help = 'The offset in the decrypted data of the first byte to write ( -i only )',
+        type = int,
+        default = 0,
+    )
+
+
+    decrypt_parser.add_argument(
+        '--length',
+        help = 'The number of bytes to write from --offset ( defaults to the rest of the data, -i only )',
+        type = int,
+    )
+
+
+
+    decrypt_parser.add_argument(
+        '--output-dir',
+        help = 'Directory to which to write the files decrypted with --manifest or --pair',
+    )
+
+
+    decrypt_parser.add_argument(
+        '--store',
+        help = 'Chunk store from which to reassemble a backup written with "encrypt --store" ( -i only )',
+    )
+
+
+
+    decrypt_parser.add_argument(
+        '--queue-depth',
+        help = 'The number of segments that may be read ahead of the writer ( defaults to 2 per job, 0 runs every stage in one thread )',
+        type = int,
+    )
+
+
+
+    decrypt_parser.add_argument(
+        '-j',
+        '--jobs',
+        help = 'The number of segments ( or files, with --output-dir ) to decrypt in parallel ( 0 uses every CPU )',
+        type = int,
+        default = 1,
     )
 
 
 
     encrypt_parser.add_argument(
+        '-i',
+        '--input-file',
+        nargs = '+',
+        help = 'File from which to read the data to encrypt ( defaults to stdin ). With --output-dir, any number of files or directories',
+    )
+
+
+    encrypt_output_group = encrypt_parser.add_mutually_exclusive_group( required = True )
+
+
+    encrypt_output_group.add_argument(
         '-o',
         '--output-file',
-        required = True,
         help = 'File to which to write encrypted data ( use - for stdout )',
     )
 
 
+    encrypt_output_group.add_argument(
+        '--output-dir',
+        help = 'Directory to which to write the encrypted data and DEK of each input file, along with a manifest',
+    )
+
+
 
     encrypt_parser.add_argument(
         '-d',
         '--dek-file',
-        help = 'Path at which Data Encryption Key file will be written',
-        default = DEFAULT_DEK_FILE,
+        help = 'Path at which to also write the encrypted Data Encryption Key, which is always embedded in the output file',
     )
 
 
@@ -113,8 +239,90 @@ def create_parser( ) -> argparse.ArgumentParser:
     encrypt_parser.add_argument(
         '-k',
         '--kek-file',
-        help = 'Path to Public Key Encryption Key file',
-        default = DEFAULT_PUBLIC_KEY_FILE,
+        nargs = '+',
+        action = 'extend',
+        help = 'Path to Public Key Encryption Key file ( defaults to KEK.bin ). With more than one, the data can be decrypted with the key shares of any of them',
+    )
+
+
+
+    encrypt_parser.add_argument(
+        '--append',
+        action = 'store_true',
+        help = 'Append the input to the existing container at --output-file under its existing DEK. Key shares are read from stdin ( or use -a )',
+    )
+
+
+    encrypt_parser.add_argument(
+        '-a',
+        '--agent',
+        nargs = '?',
+        const = DEFAULT_AGENT_SOCKET,
+        metavar = 'SOCKET',
+        help = 'With --append, decrypt the DEK with a running agent instead of reading key shares from stdin ( defaults to the default agent socket )',
+    )
+
+
+
+    encrypt_parser.add_argument(
+        '--store',
+        help = 'Split the input into content-defined chunks and write only the chunks that are not yet in this chunk store ( created if missing ). The output file holds the manifest of the chunks',
+    )
+
+
+    encrypt_parser.add_argument(
+        '--chunk-size',
+        help = 'The average number of bytes in each chunk of a new --store, a power of 2 ( defaults to 1 MiB )',
+        type = int,
+    )
+
+
+
+    encrypt_parser.add_argument(
+        '--segment-size',
+        help = 'The number of bytes of input in each separately authenticated segment ( defaults to 1 MiB )',
+        type = int,
+    )
+
+
+
+    encrypt_parser.add_argument(
+        '-c',
+        '--compress',
+        help = 'Compress each segment with this codec before it is encrypted',
+        choices = [ 'zlib', 'lzma' ],
+    )
+
+
+    encrypt_parser.add_argument(
+        '--cipher',
+        help = 'The cipher to encrypt the segments with ( defaults to aes-256-gcm ). "auto" benchmarks both once on this host and uses the faster one.',
+        choices = [ 'auto', 'aes-256-gcm', 'chacha20-poly1305' ],
+    )
+
+
+    encrypt_parser.add_argument(
+        '--compress-level',
+        help = 'The compression level from 0 ( fastest ) to 9 ( smallest ) ( defaults to the codec\'s default )',
+        type = int,
+    )
+
+
+
+    encrypt_parser.add_argument(
+        '--queue-depth',
+        help = 'The number of segments that may be read ahead of the writer ( defaults to 2 per job, 0 runs every stage in one thread )',
+        type = int,
+    )
+
+
+
+    encrypt_parser.add_argument(
+        '-j',
+        '--jobs',
+        help = 'The number of segments ( or files, with --output-dir ) to encrypt in parallel ( 0 uses every CPU )',
+        type = int,
+        default = 1,
     )
 
 
@@ -155,6 +363,135 @@ def create_parser( ) -> argparse.ArgumentParser:
 
 
 
+    rewrap_parser.add_argument(
+        '-i',
+        '--input-file',
+        nargs = '+',
+        default = [ ],
+        help = 'Containers and DEK files whose DEKs to rewrap',
+    )
+
+
+    rewrap_parser.add_argument(
+        '-m',
+        '--manifest',
+        action = 'append',
+        default = [ ],
+        help = 'Manifest written by "encrypt --output-dir" listing the files to rewrap ( may be repeated )',
+    )
+
+
+    rewrap_parser.add_argument(
+        '-k',
+        '--kek-file',
+        help = 'Path to the new Public Key Encryption Key file',
+        required = True,
+    )
+
+
+    rewrap_parser.add_argument(
+        '-a',
+        '--agent',
+        nargs = '?',
+        const = DEFAULT_AGENT_SOCKET,
+        metavar = 'SOCKET',
+        help = 'Unwrap the DEKs with a running agent holding the old key instead of reading key shares from stdin ( defaults to the default agent socket )',
+    )
+
+
+    rewrap_parser.add_argument(
+        '-j',
+        '--jobs',
+        help = 'The number of files to rewrap in parallel ( 0 uses every CPU )',
+        type = int,
+        default = 1,
+    )
+
+
+
+    verify_parser.add_argument(
+        '-i',
+        '--input-file',
+        nargs = '+',
+        action = 'extend',
+        default = [ ],
+        help = 'Encrypted files to verify',
+    )
+
+
+    verify_parser.add_argument(
+        '-d',
+        '--dek-file',
+        help = 'Path from which to read the encrypted Data Encryption Key of an older file that is not a container ( requires a single input file )',
+    )
+
+
+    verify_parser.add_argument(
+        '-m',
+        '--manifest',
+        action = 'append',
+        default = [ ],
+        help = 'Manifest written by "encrypt --output-dir" listing the files to verify ( may be repeated )',
+    )
+
+
+    verify_parser.add_argument(
+        '--store',
+        help = 'Chunk store of backups written with "encrypt --store", to also verify their chunks',
+    )
+
+
+    verify_parser.add_argument(
+        '-a',
+        '--agent',
+        nargs = '?',
+        const = DEFAULT_AGENT_SOCKET,
+        metavar = 'SOCKET',
+        help = 'Decrypt the DEKs with a running agent instead of reading key shares from stdin ( defaults to the default agent socket )',
+    )
+
+
+    verify_parser.add_argument(
+        '-j',
+        '--jobs',
+        help = 'The number of segments ( or files, when verifying more than one ) to verify in parallel ( 0 uses every CPU )',
+        type = int,
+        default = 1,
+    )
+
+
+
+    agent_parser.add_argument(
+        '-s',
+        '--socket',
+        help = 'Path of the agent\'s Unix socket',
+    )
+
+
+    agent_parser.add_argument(
+        '--ttl',
+        help = 'The number of idle seconds after which the agent wipes the key and exits ( defaults to 900 )',
+        type = float,
+    )
+
+
+    agent_parser.add_argument(
+        '--evict',
+        help = 'Tell the running agent to wipe the key and exit',
+        action = 'store_true',
+        default = False,
+    )
+
+
+    agent_parser.add_argument(
+        '--status',
+        help = 'Print how long the running agent will hold the key while idle',
+        action = 'store_true',
+        default = False,
+    )
+
+
+
     return parser
 
 
@@ -174,10 +511,55 @@ def main( ):
 
 
 
+    try:
+
+        run( parser, args )
+
+    except errors.SharelockError as e:
+
+        print( e.args[ 0 ], file = sys.stderr )
+
+        exit( 1 )
+
+
+
+
+
+def run( parser, args ):
+
+    """
+    Run the mode selected by 'args'. Errors are raised as sharelock.errors.SharelockError for main( ) to report.
+    """
+
+
+
+    if getattr( args, 'queue_depth', None ) is not None and args.queue_depth < 0:
+
+        parser.error( '--queue-depth must be >= 0.' )
+
+
+
+    import sharelock.stats as stats
+
+
+
+    if getattr( args, 'stats', None ) is not None:
+
+        phase_stats = stats.PhaseStats( args.mode )
+
+    else:
+
+        phase_stats = stats.NULL_STATS
+
+
+
 
     if args.mode == 'generate':
 
-        generator = kek.KEK( )
+        import sharelock.kek as kek
+
+
+        generator = kek.KEK( phase_stats )
 
 
         generator.generate( 
@@ -188,38 +570,487 @@ def main( ):
         )
 
 
-        exit( 0 )
+        finish( args, phase_stats )
 
 
 
     if args.mode == 'encrypt':
 
-        encrypt_context = encrypter.Encrypter( )
+        import sharelock.encrypter as encrypter
+
+        import sharelock.parallel as parallel
+
+        import sharelock.stream_format as stream_format
+
+        import sharelock.compression as compression
+
+
+
+        encrypt_context = encrypter.Encrypter( phase_stats )
+
+
+
+        if args.append:
+
+
+            import sharelock.agent as agent
+
+
+            if args.output_file is None or args.output_file == '-':
+
+                parser.error( '--append requires the container to append to ( -o ).' )
+
+
+            if args.store is not None:
+
+                parser.error( '--store can not be used with --append.' )
+
+
+            if args.dek_file is not None or args.kek_file is not None or args.segment_size is not None or args.compress is not None or args.cipher is not None:
+
+                parser.error( '--append keeps the keys, segment size, compression, and cipher of the container and can not be used with -d, -k, --segment-size, -c, or --cipher.' )
+
+
+            if args.input_file is not None and len( args.input_file ) > 1:
+
+                parser.error( 'More than one input file requires --output-dir.' )
+
+
+            if args.input_file is None and args.agent is None:
+
+                parser.error( '--append reads key shares from stdin, so the data to append must be given with -i ( or use -a ).' )
+
+
+            if args.agent == DEFAULT_AGENT_SOCKET:
+
+                args.agent = agent.default_socket_path( )
+
+
+
+            encrypt_context.append(
+                output_filename = args.output_file,
+                input_filename = args.input_file[ 0 ] if args.input_file is not None else None,
+                jobs = parallel.resolve_jobs( args.jobs ),
+                agent_socket = args.agent,
+                compression_level = args.compress_level,
+                queue_depth = args.queue_depth,
+            )
+
+
+            finish( args, phase_stats )
+
+
+
+        if args.agent is not None:
+
+            parser.error( '-a is only used with --append.' )
+
+
+        if args.chunk_size is not None and args.store is None:
+
+            parser.error( '--chunk-size requires --store.' )
+
+
+        if args.segment_size is None:
+
+            args.segment_size = stream_format.DEFAULT_SEGMENT_SIZE
+
+
+        if args.kek_file is None:
+
+            args.kek_file = [ DEFAULT_PUBLIC_KEY_FILE ]
+
+
+        if args.dek_file is not None and len( args.kek_file ) > 1:
+
+            parser.error( '--dek-file can only be used with a single --kek-file.' )
+
+
+        if args.cipher is None:
+
+            args.cipher = stream_format.DEFAULT_CIPHER
+
+
+        if args.compress is None:
+
+            if args.compress_level is not None:
+
+                parser.error( '--compress-level requires --compress.' )
+
+
+            args.compress = compression.NONE
+
+
+
+        if args.output_dir is not None:
+
+
+            if args.input_file is None:
+
+                parser.error( '--output-dir requires at least one input file or directory ( -i ).' )
+
+
+            if args.store is not None:
+
+                parser.error( '--store can not be used with --output-dir.' )
+
+
+
+            encrypt_context.encrypt_many(
+                public_key_filename = args.kek_file,
+                input_paths = args.input_file,
+                output_directory = args.output_dir,
+                segment_size = args.segment_size,
+                jobs = parallel.resolve_jobs( args.jobs ),
+                compression_codec = args.compress,
+                compression_level = args.compress_level,
+                queue_depth = args.queue_depth,
+                cipher = args.cipher,
+            )
+
+
+            finish( args, phase_stats )
+
+
+
+        if args.input_file is not None and len( args.input_file ) > 1:
+
+            parser.error( 'More than one input file requires --output-dir.' )
+
+
+
+        if args.store is not None:
+
+
+            if args.dek_file is not None:
+
+                parser.error( '--store can not be used with -d.' )
+
+
+            if args.cipher != stream_format.DEFAULT_CIPHER:
+
+                parser.error( f'--store always encrypts chunks with { stream_format.DEFAULT_CIPHER } and can not be used with --cipher.' )
+
+
+
+            written_chunks, total_chunks, written_bytes, total_bytes = encrypt_context.encrypt_deduplicated(
+                public_key_filename = args.kek_file,
+                output_filename = args.output_file,
+                store_path = args.store,
+                chunk_size = args.chunk_size,
+                jobs = parallel.resolve_jobs( args.jobs ),
+                input_filename = args.input_file[ 0 ] if args.input_file is not None else None,
+                compression_codec = args.compress,
+                compression_level = args.compress_level,
+                queue_depth = args.queue_depth,
+            )
+
+
+            print( f'Stored { written_chunks } of { total_chunks } chunks ( { written_bytes } of { total_bytes } bytes ).', file = sys.stderr )
+
+
+            finish( args, phase_stats )
+
 
 
         encrypt_context.encrypt(
             public_key_filename = args.kek_file,
             output_filename = args.output_file,
             dek_filename = args.dek_file,
+            segment_size = args.segment_size,
+            jobs = parallel.resolve_jobs( args.jobs ),
+            input_filename = args.input_file[ 0 ] if args.input_file is not None else None,
+            compression_codec = args.compress,
+            compression_level = args.compress_level,
+            queue_depth = args.queue_depth,
+            cipher = args.cipher,
         )
 
 
-        exit( 0 )
+        finish( args, phase_stats )
 
 
 
     if args.mode == 'decrypt':
 
+        import sharelock.encrypter as encrypter
+
+        import sharelock.decrypter as decrypter
+
+        import sharelock.agent as agent
+
+        import sharelock.parallel as parallel
+
+
+
+        if args.agent == DEFAULT_AGENT_SOCKET:
+
+            args.agent = agent.default_socket_path( )
+
+
+
+        decrypt_context = decrypter.Decrypter( phase_stats )
+
+
+
+        if args.offset < 0 or ( args.length is not None and args.length < 0 ):
+
+            parser.error( '--offset and --length must be >= 0.' )
+
+
+
+        if args.input_file is None:
+
+
+            if args.output_dir is None:
+
+                parser.error( '--manifest and --pair require --output-dir.' )
+
+
+            if args.offset != 0 or args.length is not None:
+
+                parser.error( '--offset and --length can only be used with --input-file.' )
+
+
+            if args.store is not None:
+
+                parser.error( '--store can only be used with --input-file.' )
+
+
+
+            if args.manifest is not None:
+
+                encrypted_files = decrypt_context.read_manifest( args.manifest )
+
+            else:
+
+
+                if any( len( pair ) > 2 for pair in args.pair ):
+
+                    parser.error( '--pair takes an input file and at most one DEK file.' )
+
+
+
+                encrypted_files = [
+                    ( pair[ 0 ], pair[ 1 ] if len( pair ) == 2 else None, Path( pair[ 0 ] ).name.removesuffix( encrypter.ENCRYPTED_SUFFIX ) )
+                    for pair in args.pair
+                ]
+
+
+
+            decrypt_context.decrypt_many(
+                encrypted_files = encrypted_files,
+                output_directory = args.output_dir,
+                jobs = parallel.resolve_jobs( args.jobs ),
+                agent_socket = args.agent,
+                queue_depth = args.queue_depth,
+            )
+
+
+            finish( args, phase_stats )
 
-        decrypt_context = decrypter.Decrypter( )
 
 
         decrypt_context.decrypt(
-            encrypted_data_filename = args.input_file,
+            encrypted_data = args.input_file,
             encrypted_dek_filename = args.dek_file,
+            jobs = parallel.resolve_jobs( args.jobs ),
+            agent_socket = args.agent,
+            offset = args.offset,
+            length = args.length,
+            queue_depth = args.queue_depth,
+            chunk_store = args.store,
         )
 
 
+        finish( args, phase_stats )
+
+
+
+    if args.mode == 'rewrap':
+
+        import sharelock.decrypter as decrypter
+
+        import sharelock.rewrapper as rewrapper
+
+        import sharelock.agent as agent
+
+        import sharelock.parallel as parallel
+
+
+
+        if not args.input_file and not args.manifest:
+
+            parser.error( 'rewrap requires at least one input file ( -i ) or manifest ( -m ).' )
+
+
+        if args.agent == DEFAULT_AGENT_SOCKET:
+
+            args.agent = agent.default_socket_path( )
+
+
+
+        paths = list( args.input_file )
+
+
+        for manifest in args.manifest:
+
+            paths.extend(
+                encrypted_dek_filename if encrypted_dek_filename is not None else encrypted_data_filename
+                for encrypted_data_filename, encrypted_dek_filename, _ in decrypter.Decrypter( ).read_manifest( manifest )
+            )
+
+
+
+        rewrapped, skipped = rewrapper.Rewrapper( phase_stats ).rewrap(
+            paths = paths,
+            public_key_filename = args.kek_file,
+            jobs = parallel.resolve_jobs( args.jobs ),
+            agent_socket = args.agent,
+        )
+
+
+        for path in skipped:
+
+            print( f'Skipped "{ path }": its DEK could not be decrypted with the old key ( it may already have been rewrapped ).', file = sys.stderr )
+
+
+        print( f'Rewrapped { rewrapped } of { len( paths ) } files.', file = sys.stderr )
+
+
+        # skipped DEK files may still be wrapped for the old key, so a rotation that skipped any is not reported as a success
+
+        finish( args, phase_stats, 1 if skipped else 0 )
+
+
+
+    if args.mode == 'verify':
+
+        import sharelock.decrypter as decrypter
+
+        import sharelock.verifier as verifier
+
+        import sharelock.agent as agent
+
+        import sharelock.parallel as parallel
+
+
+
+        if not args.input_file and not args.manifest:
+
+            parser.error( 'verify requires at least one input file ( -i ) or manifest ( -m ).' )
+
+
+        if args.dek_file is not None and len( args.input_file ) != 1:
+
+            parser.error( 'verify --dek-file requires exactly one input file ( -i ).' )
+
+
+        if args.agent == DEFAULT_AGENT_SOCKET:
+
+            args.agent = agent.default_socket_path( )
+
+
+
+        encrypted_files = [ ( encrypted_data_filename, args.dek_file ) for encrypted_data_filename in args.input_file ]
+
+
+        for manifest in args.manifest:
+
+            encrypted_files.extend(
+                ( encrypted_data_filename, encrypted_dek_filename )
+                for encrypted_data_filename, encrypted_dek_filename, _ in decrypter.Decrypter( ).read_manifest( manifest )
+            )
+
+
+
+        results = verifier.Verifier( phase_stats ).verify(
+            encrypted_files = encrypted_files,
+            jobs = parallel.resolve_jobs( args.jobs ),
+            agent_socket = args.agent,
+            chunk_store = args.store,
+        )
+
+
+        failed = 0
+
+
+        for encrypted_data_filename, failure in results:
+
+
+            if failure is None:
+
+                print( f'OK      { encrypted_data_filename }' )
+
+            else:
+
+                print( f'FAILED  { encrypted_data_filename }: { failure }' )
+
+                failed += 1
+
+
+            sys.stdout.flush( )
+
+
+
+        print( f'Verified { len( encrypted_files ) - failed } of { len( encrypted_files ) } files.', file = sys.stderr )
+
+
+        finish( args, phase_stats, 1 if failed else 0 )
+
+
+
+    if args.mode == 'agent':
+
+        import sharelock.decrypter as decrypter
+
+        import sharelock.agent as agent
+
+
+
+        if args.socket is None:
+
+            args.socket = agent.default_socket_path( )
+
+
+        if args.ttl is None:
+
+            args.ttl = agent.DEFAULT_TTL
+
+
+
+        if args.evict or args.status:
+
+
+            try:
+
+                response = agent.AgentClient( args.socket ).request( { 'op': 'evict' if args.evict else 'status' } )
+
+            except ( errors.AgentError, ValueError ) as e:
+
+                print( e.args[ 0 ], file = sys.stderr )
+
+                exit( 1 )
+
+
+
+            if args.status:
+
+                print( f'Agent holds the key for { round( response[ "expires_in" ] ) } more idle seconds.' )
+
+
+            exit( 0 )
+
+
+
+        # a bytearray, so the agent can zero it once the key is in locked memory
+
+        private_kek = bytearray( decrypter.Decrypter( ).read_private_kek( ) )
+
+
+        agent.Agent( ).serve( private_kek, args.socket, args.ttl )
+
+
         exit( 0 )
 
 
@@ -233,6 +1064,25 @@ def main( ):
 
 
 
+
+def finish( args, phase_stats, status: int = 0 ):
+
+    """
+    Write the '--stats' report if it was requested, then exit with 'status' ( successfully by default ).
+    """
+
+
+    if args.stats is not None:
+
+        phase_stats.write( args.stats )
+
+
+    exit( status )
+
+
+
+
+
 if __name__ == '__main__':
 
     main( )
@@ -0,0 +1,287 @@
+"""
+
+Module for timing the phases of a run ( reading input, loading keys, the ciphers, writing output ) for the '--stats' report.
+
+"""
+
+
+
+import sys
+
+import json
+
+import time
+
+import threading
+
+import contextlib
+
+
+from pathlib import Path
+
+
+
+import sharelock.errors as errors
+
+
+
+
+class PhaseStats:
+
+    """
+    Collects the wall time, number of calls, and bytes processed of each named phase.
+
+    Phases that run on worker threads ( such as the segment ciphers with '--jobs' ) add up the time of every worker,
+    so their time can exceed the wall time of the whole run.
+    """
+
+
+
+    def __init__( self, command: str ):
+
+        self.command = command
+
+        self.started = time.perf_counter( )
+
+        self.phases = { }
+
+        self.lock = threading.Lock( )
+
+
+
+
+    def add( self, name: str, seconds: float, byte_count: int = 0 ):
+
+        """
+        Add one call of 'seconds' that processed 'byte_count' bytes to the phase 'name'.
+        """
+
+
+        with self.lock:
+
+
+            phase = self.phases.setdefault( name, { 'seconds': 0.0, 'calls': 0, 'bytes': 0 } )
+
+
+            phase[ 'seconds' ] += seconds
+
+            phase[ 'calls' ] += 1
+
+            phase[ 'bytes' ] += byte_count
+
+
+
+
+    @contextlib.contextmanager
+    def phase( self, name: str, byte_count: int = 0 ):
+
+        """
+        Time the body of a with statement as one call of the phase 'name'.
+        """
+
+
+        start = time.perf_counter( )
+
+
+        try:
+
+            yield
+
+        finally:
+
+            self.add( name, time.perf_counter( ) - start, byte_count )
+
+
+
+
+    def timed( self, name: str, function, count = None ):
+
+        """
+        Wrap 'function' so every call is timed as the phase 'name'.
+
+
+        Params:
+        -------
+        name : str
+            The phase name
+        function
+            The function to wrap
+        count : callable | None - default None
+            Called with the result of each call to get the number of bytes it processed
+
+        """
+
+
+        def timed_function( *args ):
+
+
+            start = time.perf_counter( )
+
+
+            result = function( *args )
+
+
+            self.add( name, time.perf_counter( ) - start, 0 if count is None else count( result ) )
+
+
+            return result
+
+
+
+        return timed_function
+
+
+
+
+    def timed_iter( self, name: str, iterable ):
+
+        """
+        Wrap 'iterable' so producing each item is timed as the phase 'name', counting the length of each item as its bytes.
+        """
+
+
+        iterator = iter( iterable )
+
+
+
+        while True:
+
+
+            start = time.perf_counter( )
+
+
+            try:
+
+                item = next( iterator )
+
+            except StopIteration:
+
+                return
+
+
+            self.add( name, time.perf_counter( ) - start, len( item ) )
+
+
+            yield item
+
+
+
+
+    def report( self ) -> dict:
+
+        """
+        The collected phases, with the throughput of each phase in bytes per second.
+        """
+
+
+        phases = { }
+
+
+
+        with self.lock:
+
+
+            for name, phase in self.phases.items( ):
+
+
+                phases[ name ] = dict( phase )
+
+
+                if phase[ 'bytes' ] > 0 and phase[ 'seconds' ] > 0:
+
+                    phases[ name ][ 'bytes_per_second' ] = phase[ 'bytes' ] / phase[ 'seconds' ]
+
+
+
+        return {
+            'command': self.command,
+            'wall_seconds': time.perf_counter( ) - self.started,
+            'phases': phases,
+        }
+
+
+
+
+    def write( self, destination: str ):
+
+        """
+        Write the report as JSON to the file at 'destination' ( or stderr if it is '-' ).
+
+
+        Raises:
+        -------
+        sharelock.errors.OutputError
+            If the file can not be written.
+        """
+
+
+        encoded_report = json.dumps( self.report( ), indent = 4 )
+
+
+
+        if destination == '-':
+
+            print( encoded_report, file = sys.stderr )
+
+            return
+
+
+
+        try:
+
+            Path( destination ).resolve( ).write_text( encoded_report + '\n' )
+
+        except OSError:
+
+            raise errors.OutputError( f'Could not write stats to file at "{ destination }".' )
+
+
+
+
+
+class NullStats:
+
+    """
+    Stand-in for PhaseStats when '--stats' is off. Nothing is timed, and wrapped functions and iterables are returned as they are.
+    """
+
+
+
+    NO_PHASE = contextlib.nullcontext( )
+
+
+
+
+    def add( self, name: str, seconds: float, byte_count: int = 0 ):
+
+        pass
+
+
+
+
+    def phase( self, name: str, byte_count: int = 0 ):
+
+        return self.NO_PHASE
+
+
+
+
+    def timed( self, name: str, function, count = None ):
+
+        return function
+
+
+
+
+    def timed_iter( self, name: str, iterable ):
+
+        return iterable
+
+
+
+
+
+NULL_STATS = NullStats( )
+
+
+
@@ -0,0 +1,78 @@
+"""
+
+This module holds the constants shared by the sharelock file formats.
+New files are written as containers ( see sharelock.container ), which start with MAGIC.
+Files without it are in the original single-nonce layout.
+
+"""
+
+
+
+import hashlib
+
+
+
+import sharelock.errors as errors
+
+import sharelock.dek as dek
+
+
+
+
+MAGIC = b'SLCK'
+
+
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+
+
+MAX_SEGMENT_SIZE = 2 ** 31 - 1
+
+
+DEFAULT_CIPHER = dek.AES_256_GCM
+
+
+COUNT_BYTES = 8
+
+
+MAC_LENGTH = hashlib.sha256( ).digest_size
+
+
+
+
+def is_segmented( prefix: bytes ) -> bool:
+
+    """
+    Whether 'prefix' ( the first bytes of a file ) starts a file in a segmented format ( a container ).
+    Files without it are in the original single-nonce layout.
+    """
+
+
+    return bytes( prefix[ : len( MAGIC ) ] ) == MAGIC
+
+
+
+
+
+def read_exact( reader, length: int ):
+
+    """
+    Read exactly 'length' bytes from 'reader'.
+
+
+    Raises:
+    -------
+    ValueError
+        If the reader ends first.
+
+    """
+
+
+    data = reader.read( length )
+
+
+    if len( data ) != length:
+
+        raise errors.IntegrityError( 'Unexpected end of encrypted data. The encrypted file may have been truncated.' )
+
+
+    return data
@@ -0,0 +1,233 @@
+"""
+
+Module for verifying encrypted data without writing the decrypted data anywhere.
+
+Verifying a container authenticates its index and the tag of every segment, which is everything decryption checks.
+The segments still have to be decrypted ( GCM only offers decrypt-and-verify ), but the decrypted data is discarded as soon as
+each tag is checked, so whole directories of backups can be scrubbed at the speed the disk and "-j" cores allow.
+Compressed segments are not decompressed: the tag authenticates each segment as it was compressed, and the
+authenticated index records its lengths.
+
+"""
+
+
+
+import sharelock.errors as errors
+
+import sharelock.mapping as mapping
+
+import sharelock.parallel as parallel
+
+import sharelock.container as container
+
+import sharelock.decrypter as decrypter
+
+import sharelock.dedup as dedup
+
+import sharelock.stream_format as stream_format
+
+import sharelock.stats as stats
+
+
+
+
+class Verifier:
+
+
+
+    def __init__( self, phase_stats = stats.NULL_STATS ):
+
+        self.stats = phase_stats
+
+        self.decrypter = decrypter.Decrypter( phase_stats )
+
+        # chunks shared by several backups are only verified once
+
+        self.verified_chunks = set( )
+
+
+
+
+    def verify( self, encrypted_files: list[ tuple[ str, str ] ], jobs: int = 1, agent_socket: str = None, private_kek: bytes = None, chunk_store: str = None ):
+
+        """
+
+        Verify encrypted files, yielding the result of each file as it is verified.
+
+        A file that fails verification does not stop the others. Key shares are read once, before the first file is verified.
+        With a single file, its segments are verified "jobs" at a time. With more, "jobs" files are verified at a time.
+
+
+        Params:
+        -------
+        encrypted_files : list[ tuple[ str, str | None ] ]
+            The filename of each encrypted file and of its DEK file ( None for containers )
+        jobs : int - default 1
+            The number of segments, or files, to verify in parallel
+        agent_socket : str | None - default None
+            The socket of a running agent holding the Private Key Encryption Key
+        private_kek : bytes | None - default None
+            The Private Key Encryption Key. If neither this nor 'agent_socket' is set, key shares are read from stdin.
+        chunk_store : str | None - default None
+            The directory of the chunk store of deduplicated backups. If set to None, only their manifests are verified.
+
+
+        Yields:
+        -------
+        tuple[ str, str | None ]
+            The filename of each encrypted file and why it failed verification ( None if it was verified ), in order
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the key shares can not be read or combined.
+
+        """
+
+
+        if not encrypted_files:
+
+            return
+
+
+
+        if agent_socket is None and private_kek is None:
+
+            private_kek = self.decrypter.read_private_kek( )
+
+
+
+        file_jobs, segment_jobs = ( jobs, 1 ) if len( encrypted_files ) > 1 else ( 1, jobs )
+
+
+
+        def verify_file( encrypted_file ):
+
+
+            encrypted_data_filename, encrypted_dek_filename = encrypted_file
+
+
+            try:
+
+                self.verify_file( encrypted_data_filename, encrypted_dek_filename, segment_jobs, agent_socket, private_kek, chunk_store )
+
+            except errors.SharelockError as e:
+
+                return encrypted_data_filename, e.args[ 0 ]
+
+
+            return encrypted_data_filename, None
+
+
+
+        yield from parallel.ordered_map( verify_file, encrypted_files, file_jobs )
+
+
+
+
+    def verify_file( self, encrypted_data_filename: str, encrypted_dek_filename: str = None, jobs: int = 1, agent_socket: str = None, private_kek: bytes = None, chunk_store: str = None ):
+
+        """
+
+        Verify a single encrypted file. See verify( ).
+
+
+        Raises:
+        -------
+        sharelock.errors.SharelockError
+            If the file can not be read, its DEK can not be decrypted, or any part of it fails authentication.
+
+        """
+
+
+        try:
+
+            encrypted_file = mapping.MappedFile( encrypted_data_filename )
+
+        except OSError:
+
+            raise errors.InputError( f'Could not read encrypted data from file at "{ encrypted_data_filename }".' )
+
+
+
+        with encrypted_file:
+
+
+            view = encrypted_file.view
+
+
+            if not stream_format.is_segmented( view ):
+
+                raise errors.IntegrityError( 'Written by an earlier version without authentication tags, so it can not be verified.' )
+
+
+            if not container.is_container( view ):
+
+                raise errors.IntegrityError( 'Could not verify data: unsupported format version.' )
+
+
+
+            recipients = self.decrypter.read_recipients( encrypted_data_filename, encrypted_dek_filename, view )
+
+
+            ( _, key ), = self.decrypter.open_recipients( [ recipients ], 1, agent_socket, private_kek )
+
+
+
+            try:
+
+                if self.decrypter.is_chunk_manifest( view ) and chunk_store is not None:
+
+                    self.verify_chunks( view, key, chunk_store, jobs )
+
+                    return
+
+
+
+                # the tag of a segment authenticates it as it was compressed, so it is not decompressed as well
+
+                decrypted_segments = self.decrypter.decrypt_container( view, key, jobs, encrypted_file.release_before, decompress = False )
+
+
+
+                for _ in decrypted_segments:
+
+                    pass
+
+
+            except ValueError as e:
+
+                raise errors.IntegrityError( e.args[ 0 ] )
+
+
+
+
+    def verify_chunks( self, view, key: bytes, chunk_store: str, jobs: int = 1 ):
+
+        """
+        Verify the manifest of a deduplicated backup and every chunk it names that has not been verified yet.
+        """
+
+
+        chunks = dedup.read_manifest( b''.join( self.decrypter.decrypt_container( view, key, jobs ) ) )
+
+
+        store = dedup.ChunkStore( chunk_store, self.stats )
+
+
+
+        def verify_chunk( chunk ):
+
+            store.get( *chunk )
+
+            return chunk[ 0 ]
+
+
+
+        unverified_chunks = [ chunk for chunk in chunks if chunk[ 0 ] not in self.verified_chunks ]
+
+
+        for chunk_id in parallel.ordered_map( verify_chunk, unverified_chunks, jobs ):
+
+            self.verified_chunks.add( chunk_id )
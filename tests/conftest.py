@@ -0,0 +1,79 @@
+"""
+
+Shared fixtures for the sharelock tests.
+
+"""
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.encrypter as encrypter
+
+
+
+
+@pytest.fixture( scope = 'session' )
+def keys( ):
+
+    """
+    A Key Encryption Key as ( public key, encoded key shares, combined private key ), split into 3 shares with a threshold of 2.
+    """
+
+
+    public_kek, shares = api.generate_kek( 3, 2 )
+
+
+    return public_kek, shares, api.combine_shares( shares[ : 2 ] )
+
+
+
+
+
+@pytest.fixture
+def kek_file( tmp_path, keys ):
+
+    """
+    The public key of 'keys', written to a file.
+    """
+
+
+    path = tmp_path / 'KEK.bin'
+
+    path.write_bytes( keys[ 0 ] )
+
+
+    return path
+
+
+
+
+
+@pytest.fixture
+def manifest( tmp_path, kek_file ):
+
+    """
+    A deduplicated backup as ( manifest path, chunk store path, backed up data ).
+    """
+
+
+    data = bytes( range( 256 ) ) * 2000
+
+    input_path = tmp_path / 'backup.bin'
+
+    input_path.write_bytes( data )
+
+
+    manifest_path = tmp_path / 'backup.enc'
+
+    store_path = tmp_path / 'store'
+
+
+    encrypter.Encrypter( ).encrypt_deduplicated( kek_file, manifest_path, store_path, input_filename = input_path )
+
+
+    return manifest_path, store_path, data
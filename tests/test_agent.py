@@ -0,0 +1,242 @@
+"""
+
+Tests for sharelock.agent.
+
+"""
+
+
+
+import os
+
+import sys
+
+import time
+
+import socket
+
+import threading
+
+import subprocess
+
+
+
+import pytest
+
+
+
+import sharelock.agent as agent
+
+import sharelock.errors as errors
+
+import sharelock.kek as kek
+
+
+
+
+def test_locked_key_zeroes_the_callers_copy( ):
+
+
+    key = bytearray( os.urandom( 32 ) )
+
+    original = bytes( key )
+
+
+    locked_key = agent.LockedKey( key )
+
+
+    assert key == bytes( 32 )
+
+
+
+    with locked_key.key( ) as view:
+
+        assert view.readonly
+
+        assert view == original
+
+
+
+    locked_key.wipe( )
+
+
+    assert len( locked_key.buffer ) == 0
+
+
+
+
+
+def test_client_without_agent_raises_agent_error( tmp_path ):
+
+
+    with pytest.raises( errors.AgentError ):
+
+        agent.AgentClient( str( tmp_path / 'missing.sock' ) ).request( { 'op': 'status' } )
+
+
+
+
+
+def test_client_with_silent_agent_raises_agent_error( tmp_path ):
+
+
+    socket_path = str( tmp_path / 'silent.sock' )
+
+
+    server = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+
+    server.bind( socket_path )
+
+    server.listen( )
+
+
+
+    def close_without_answering( ):
+
+        connection, _ = server.accept( )
+
+        connection.close( )
+
+
+
+    thread = threading.Thread( target = close_without_answering )
+
+    thread.start( )
+
+
+    try:
+
+        with pytest.raises( errors.AgentError ):
+
+            agent.AgentClient( socket_path ).request( { 'op': 'status' } )
+
+    finally:
+
+        thread.join( )
+
+        server.close( )
+
+
+
+
+
+def test_agent_unwraps_and_evicts( tmp_path, keys ):
+
+
+    public_kek, shares, _ = keys
+
+    socket_path = str( tmp_path / 'agent.sock' )
+
+
+    process = subprocess.Popen(
+        [ sys.executable, '-m', 'sharelock.sharelock', 'agent', '-s', socket_path ],
+        stdin = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+    )
+
+
+    process.stdin.write( '\n'.join( shares[ : 2 ] ).encode( ) )
+
+    process.stdin.close( )
+
+
+
+    try:
+
+
+        deadline = time.monotonic( ) + 30
+
+
+        while not os.path.exists( socket_path ) and time.monotonic( ) < deadline:
+
+            time.sleep( 0.05 )
+
+
+
+        client = agent.AgentClient( socket_path )
+
+
+        dek = os.urandom( 32 )
+
+
+        assert client.unwrap( kek.KEK( ).encrypt( dek, public_kek ) ) == dek
+
+
+        with pytest.raises( ValueError ):
+
+            client.unwrap( b'not an encrypted dek' )
+
+
+        client.evict( )
+
+
+        assert process.wait( timeout = 30 ) == 0
+
+    finally:
+
+        if process.poll( ) is None:
+
+            process.kill( )
+
+            process.wait( )
+
+
+
+
+
+def test_serve_raises_agent_error_and_wipes_the_key_if_it_can_not_listen( tmp_path, keys ):
+
+
+    socket_path = str( tmp_path / 'agent.sock' )
+
+    private_kek = keys[ 2 ]
+
+
+    running = threading.Thread( target = agent.Agent( ).serve, args = ( bytearray( private_kek ), socket_path, 30 ) )
+
+    running.start( )
+
+
+
+    try:
+
+
+        deadline = time.monotonic( ) + 30
+
+
+        while not os.path.exists( socket_path ) and time.monotonic( ) < deadline:
+
+            time.sleep( 0.05 )
+
+
+
+        # an agent is already listening on the socket
+
+        key = bytearray( private_kek )
+
+
+        with pytest.raises( errors.AgentError ):
+
+            agent.Agent( ).serve( key, socket_path )
+
+
+        assert key == bytes( len( private_kek ) )
+
+
+
+        # the socket can not be created
+
+        key = bytearray( private_kek )
+
+
+        with pytest.raises( errors.AgentError ):
+
+            agent.Agent( ).serve( key, str( tmp_path / 'missing' / 'agent.sock' ) )
+
+
+        assert key == bytes( len( private_kek ) )
+
+    finally:
+
+        agent.AgentClient( socket_path ).evict( )
+
+        running.join( )
@@ -0,0 +1,88 @@
+"""
+
+Tests for sharelock.aio.
+
+"""
+
+
+
+import asyncio
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.aio as aio
+
+import sharelock.errors as errors
+
+import sharelock.encrypter as encrypter
+
+
+
+
+async def collect( source, private_kek: bytes, **kwargs ) -> bytes:
+
+    return b''.join( [ segment async for segment in aio.decrypt_iter( source, private_kek, **kwargs ) ] )
+
+
+
+
+
+def test_decrypt_iter( tmp_path, keys ):
+
+
+    data = bytes( range( 256 ) ) * 1000
+
+    path = tmp_path / 'data.enc'
+
+    path.write_bytes( api.encrypt( data, keys[ 0 ], segment_size = 4096 ) )
+
+
+    assert asyncio.run( collect( path, keys[ 2 ] ) ) == data
+
+    assert asyncio.run( collect( path, keys[ 2 ], offset = 5000, length = 10000 ) ) == data[ 5000 : 15000 ]
+
+
+
+
+
+def test_decrypt_iter_refuses_manifest( keys, manifest ):
+
+
+    manifest_path, _, _ = manifest
+
+
+    with pytest.raises( errors.UsageError ):
+
+        asyncio.run( collect( manifest_path, keys[ 2 ] ) )
+
+
+
+
+
+def test_decrypt_iter_matches_the_library_api_on_appended_compressed_containers( tmp_path, keys ):
+
+
+    data = bytes( range( 256 ) ) * 1000
+
+    path = tmp_path / 'data.enc'
+
+    path.write_bytes( api.encrypt( data, keys[ 0 ], segment_size = 4096, compression_codec = 'zlib' ) )
+
+
+    input_path = tmp_path / 'more.bin'
+
+    input_path.write_bytes( data[ : 10000 ] )
+
+    encrypter.Encrypter( ).append( path, input_path, private_kek = keys[ 2 ] )
+
+
+
+    assert asyncio.run( collect( path, keys[ 2 ], jobs = 2 ) ) == api.decrypt( path, keys[ 2 ] ) == data + data[ : 10000 ]
+
+    assert asyncio.run( collect( path, keys[ 2 ], offset = len( data ) - 5, length = 10 ) ) == ( data + data )[ len( data ) - 5 : len( data ) + 5 ]
@@ -0,0 +1,127 @@
+"""
+
+Tests for sharelock.api.
+
+"""
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.errors as errors
+
+import sharelock.dek as dek
+
+import sharelock.kek as kek
+
+
+
+
+@pytest.mark.parametrize( 'public_kek', [ b'\x01' * 64, b'not a key' ] )
+def test_encrypt_with_invalid_public_key_raises_usage_error( public_kek ):
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.encrypt( b'data', public_kek )
+
+
+
+
+
+def test_encrypt_with_invalid_public_key_file_raises_input_error( tmp_path ):
+
+
+    kek_file = tmp_path / 'notkey.bin'
+
+    kek_file.write_bytes( b'\x01' * 64 )
+
+
+    with pytest.raises( errors.InputError ):
+
+        api.encrypt( b'data', kek_file )
+
+
+
+
+
+@pytest.mark.parametrize( 'shares', [ [ '1 - !!!!' ], [ '1 - ' ], [ '1 - QUJD' ], [ 'one - QUJD' ], [ ], '\n' ] )
+def test_combine_invalid_shares_raises_key_share_error( shares ):
+
+
+    with pytest.raises( errors.KeyShareError ):
+
+        api.combine_shares( shares )
+
+
+
+
+
+def test_combine_shares( keys ):
+
+
+    public_kek, shares, private_kek = keys
+
+
+    assert api.combine_shares( shares[ 1 : ] ) == private_kek
+
+    assert api.combine_shares( '\n'.join( [ shares[ 0 ], shares[ 2 ] ] ) ) == private_kek
+
+
+
+
+
+def test_decrypt_manifest_with_chunk_store( keys, manifest ):
+
+
+    manifest_path, store_path, data = manifest
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.decrypt( manifest_path, keys[ 2 ] )
+
+
+    assert api.decrypt( manifest_path, keys[ 2 ], chunk_store = store_path ) == data
+
+    assert api.decrypt( manifest_path, keys[ 2 ], chunk_store = store_path, offset = 1000, length = 5000 ) == data[ 1000 : 6000 ]
+
+
+
+
+
+def test_decrypt_without_container_requires_dek_file( tmp_path, keys, monkeypatch ):
+
+
+    # data in the original layout: the nonce followed by the ciphertext, with the DEK in its own file
+
+    data = b'older data ' * 100
+
+    dek_key = dek.DEK( ).generate( )
+
+    ciphertext, nonce = dek.DEK( ).encrypt( data, dek_key )
+
+    encrypted = nonce + ciphertext
+
+
+    dek_path = tmp_path / 'DEK.bin'
+
+    dek_path.write_bytes( kek.KEK( ).encrypt( dek_key, keys[ 0 ] ) )
+
+
+
+    # the DEK file in the working directory is not read
+
+    monkeypatch.chdir( tmp_path )
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.decrypt( encrypted, keys[ 2 ] )
+
+
+    assert api.decrypt( encrypted, keys[ 2 ], dek_filename = str( dek_path ) ) == data
@@ -0,0 +1,255 @@
+"""
+
+Tests for appending to containers.
+
+"""
+
+
+
+import sys
+
+import time
+
+import threading
+
+import subprocess
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.dek as dek
+
+import sharelock.errors as errors
+
+import sharelock.encrypter as encrypter
+
+
+
+
+SEGMENT_SIZE = 4096
+
+
+
+
+
+class SlowInput:
+
+    """
+    An input that reads 'data' one segment at a time, sleeping before each read. After 'fail_after' reads it raises OSError.
+    """
+
+
+    def __init__( self, data: bytes, delay: float = 0, fail_after: int = None ):
+
+        self.data = data
+
+        self.position = 0
+
+        self.delay = delay
+
+        self.fail_after = fail_after
+
+        self.reads = 0
+
+        self.started = threading.Event( )
+
+
+
+    def read( self, size: int ) -> bytes:
+
+        self.started.set( )
+
+        time.sleep( self.delay )
+
+
+        if self.fail_after is not None and self.reads >= self.fail_after:
+
+            raise OSError( 'The input went away.' )
+
+
+        self.reads += 1
+
+        chunk = self.data[ self.position : self.position + size ]
+
+        self.position += len( chunk )
+
+
+        return chunk
+
+
+
+    def seekable( self ) -> bool:
+
+        return False
+
+
+
+
+
+@pytest.fixture
+def container_file( tmp_path, keys ):
+
+    """
+    A container of three segments, written to a file.
+    """
+
+
+    data = b'a' * SEGMENT_SIZE * 3
+
+    path = tmp_path / 'data.enc'
+
+    path.write_bytes( api.encrypt( data, keys[ 0 ], segment_size = SEGMENT_SIZE ) )
+
+
+    return path, data
+
+
+
+
+
+def test_retry_after_failed_append_uses_new_nonces( container_file, keys, monkeypatch ):
+
+
+    path, data = container_file
+
+    nonces = [ ]
+
+    encrypt_segment = dek.DEK.encrypt_segment
+
+
+    def recording_encrypt_segment( self, data, key, nonce_prefix, index, *args ):
+
+        nonces.append( self.segment_nonce( nonce_prefix, index ) )
+
+        return encrypt_segment( self, data, key, nonce_prefix, index, *args )
+
+
+    monkeypatch.setattr( dek.DEK, 'encrypt_segment', recording_encrypt_segment )
+
+
+
+    with pytest.raises( OSError ):
+
+        encrypter.Encrypter( ).append( path, SlowInput( b'b' * SEGMENT_SIZE * 4, fail_after = 2 ), private_kek = keys[ 2 ] )
+
+
+    assert api.decrypt( path, keys[ 2 ] ) == data
+
+    failed_nonces = list( nonces )
+
+    assert failed_nonces
+
+
+
+    appended = b'c' * SEGMENT_SIZE * 4
+
+    encrypter.Encrypter( ).append( path, SlowInput( appended ), private_kek = keys[ 2 ] )
+
+
+    assert api.decrypt( path, keys[ 2 ] ) == data + appended
+
+    assert api.decrypt( path, keys[ 2 ], offset = len( data ) - 10, length = 20 ) == ( data + appended )[ len( data ) - 10 : len( data ) + 10 ]
+
+    assert len( set( nonces ) ) == len( nonces )
+
+
+
+
+
+def test_concurrent_appends_run_one_after_the_other( container_file, keys ):
+
+
+    path, data = container_file
+
+    first = SlowInput( b'b' * SEGMENT_SIZE * 5, delay = 0.05 )
+
+    second = SlowInput( b'c' * SEGMENT_SIZE * 5 )
+
+    failures = [ ]
+
+
+    def append( source ):
+
+        try:
+
+            encrypter.Encrypter( ).append( path, source, private_kek = keys[ 2 ] )
+
+        except Exception as e:
+
+            failures.append( e )
+
+
+
+    first_thread = threading.Thread( target = append, args = ( first, ) )
+
+    first_thread.start( )
+
+    first.started.wait( 5 )
+
+
+    second_thread = threading.Thread( target = append, args = ( second, ) )
+
+    second_thread.start( )
+
+
+    first_thread.join( )
+
+    second_thread.join( )
+
+
+
+    assert failures == [ ]
+
+    assert api.decrypt( path, keys[ 2 ] ) == data + first.data + second.data
+
+
+
+
+
+def test_append_to_manifest_raises_usage_error( keys, manifest ):
+
+
+    manifest_path, store_path, data = manifest
+
+    contents = manifest_path.read_bytes( )
+
+
+    with pytest.raises( errors.UsageError ):
+
+        encrypter.Encrypter( ).append( manifest_path, SlowInput( b'b' * SEGMENT_SIZE ), private_kek = keys[ 2 ] )
+
+
+    assert manifest_path.read_bytes( ) == contents
+
+    assert api.decrypt( manifest_path, keys[ 2 ], chunk_store = store_path ) == data
+
+
+
+
+
+def test_library_imports_without_fcntl( ):
+
+
+    # sys.modules[ 'fcntl' ] = None makes importing fcntl fail, as it does on platforms without it
+
+    script = (
+        'import sys; sys.modules[ "fcntl" ] = None\n'
+        'import sharelock.api, sharelock.aio, sharelock.errors as errors, sharelock.encrypter as encrypter\n'
+        'try:\n'
+        '    encrypter.Encrypter( ).append( "missing.enc", b"data" )\n'
+        'except errors.UsageError:\n'
+        '    print( "refused" )\n'
+    )
+
+
+    result = subprocess.run( [ sys.executable, '-c', script ], capture_output = True, text = True )
+
+
+    assert result.returncode == 0, result.stderr
+
+    assert result.stdout.strip( ) == 'refused'
@@ -0,0 +1,232 @@
+"""
+
+Tests for sharelock.cipher_benchmark and the segment ciphers.
+
+"""
+
+
+
+import io
+
+import json
+
+import socket
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.dek as dek
+
+import sharelock.errors as errors
+
+import sharelock.container as container
+
+import sharelock.cipher_benchmark as cipher_benchmark
+
+
+
+
+DATA = bytes( range( 256 ) ) * 100
+
+
+
+
+@pytest.fixture
+def cache( tmp_path, monkeypatch ):
+
+    """
+    The cache file under an empty $XDG_CACHE_HOME, and a list that grows each time the ( stubbed ) benchmark is run.
+    """
+
+
+    monkeypatch.setenv( 'XDG_CACHE_HOME', str( tmp_path / 'cache' ) )
+
+
+    runs = [ ]
+
+
+    def benchmark( ):
+
+        runs.append( 1 )
+
+        return { dek.AES_256_GCM: 1.0, dek.CHACHA20_POLY1305: 2.0 }
+
+
+    monkeypatch.setattr( cipher_benchmark, 'benchmark', benchmark )
+
+
+    return tmp_path / 'cache' / 'sharelock' / cipher_benchmark.CACHE_FILENAME, runs
+
+
+
+
+
+@pytest.mark.parametrize( 'cipher', dek.CIPHERS )
+def test_round_trip( keys, cipher ):
+
+
+    encrypted = bytearray( api.encrypt( DATA, keys[ 0 ], segment_size = 4096, cipher = cipher, jobs = 2 ) )
+
+
+    header_length, params = container.read_header( io.BytesIO( encrypted ) )
+
+
+    assert params[ 'cipher' ] == cipher
+
+    assert api.decrypt( bytes( encrypted ), keys[ 2 ] ) == DATA
+
+    assert api.decrypt( bytes( encrypted ), keys[ 2 ], offset = 5000, length = 5000 ) == DATA[ 5000 : 10000 ]
+
+
+
+    encrypted[ header_length + 10 ] ^= 0x01
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( bytes( encrypted ), keys[ 2 ] )
+
+
+
+
+
+def test_ciphers_use_different_keystreams( ):
+
+
+    dek_context = dek.DEK( )
+
+    key = dek_context.generate( )
+
+    nonce_prefix = bytes( dek.SEGMENT_NONCE_PREFIX_LENGTH )
+
+
+    ciphertexts = [ dek_context.encrypt_segment( DATA, key, nonce_prefix, 0, cipher ) for cipher in dek.CIPHERS ]
+
+
+    assert ciphertexts[ 0 ] != ciphertexts[ 1 ]
+
+
+    for cipher, ( ciphertext, tag ) in zip( dek.CIPHERS, ciphertexts ):
+
+        assert dek_context.decrypt_segment( ciphertext, tag, key, nonce_prefix, 0, cipher ) == DATA
+
+
+
+
+
+def test_auto_benchmarks_once_and_caches_the_choice( cache ):
+
+
+    path, runs = cache
+
+
+    assert cipher_benchmark.resolve( cipher_benchmark.AUTO ) == dek.CHACHA20_POLY1305
+
+    assert cipher_benchmark.resolve( cipher_benchmark.AUTO ) == dek.CHACHA20_POLY1305
+
+    assert len( runs ) == 1
+
+
+
+    cached = json.loads( path.read_text( ) )
+
+
+    assert cached[ 'version' ] == cipher_benchmark.CACHE_VERSION
+
+    assert cached[ 'hosts' ][ socket.gethostname( ) ][ 'cipher' ] == dek.CHACHA20_POLY1305
+
+    assert cached[ 'hosts' ][ socket.gethostname( ) ][ 'pycryptodome' ] == cipher_benchmark.host_info( )[ 'pycryptodome' ]
+
+
+
+
+
+def test_cached_choice_is_used_without_benchmarking( cache ):
+
+
+    path, runs = cache
+
+
+    path.parent.mkdir( parents = True )
+
+    path.write_text( json.dumps( { 'version': cipher_benchmark.CACHE_VERSION, 'hosts': { socket.gethostname( ): { 'cipher': dek.AES_256_GCM, **cipher_benchmark.host_info( ) } } } ) )
+
+
+    assert cipher_benchmark.resolve( cipher_benchmark.AUTO ) == dek.AES_256_GCM
+
+    assert runs == [ ]
+
+
+
+
+
+@pytest.mark.parametrize( 'contents', [
+    'not json',
+    '[]',
+    json.dumps( { 'version': cipher_benchmark.CACHE_VERSION + 1, 'hosts': { } } ),
+    json.dumps( { 'version': cipher_benchmark.CACHE_VERSION, 'hosts': { socket.gethostname( ): { 'cipher': 'rot13' } } } ),
+    json.dumps( { 'version': cipher_benchmark.CACHE_VERSION, 'hosts': { socket.gethostname( ): { 'cipher': dek.AES_256_GCM, 'machine': 'other', 'pycryptodome': '0' } } } ),
+] )
+def test_corrupt_or_stale_cache_is_benchmarked_again_and_replaced( cache, contents ):
+
+
+    path, runs = cache
+
+
+    path.parent.mkdir( parents = True )
+
+    path.write_text( contents )
+
+
+    assert cipher_benchmark.resolve( cipher_benchmark.AUTO ) == dek.CHACHA20_POLY1305
+
+    assert len( runs ) == 1
+
+    assert json.loads( path.read_text( ) )[ 'hosts' ][ socket.gethostname( ) ][ 'cipher' ] == dek.CHACHA20_POLY1305
+
+
+
+
+
+def test_unwritable_cache_is_ignored( cache ):
+
+
+    path, runs = cache
+
+
+    # a file where the cache directory should be
+
+    path.parent.parent.mkdir( parents = True )
+
+    path.parent.write_text( '' )
+
+
+    assert cipher_benchmark.resolve( cipher_benchmark.AUTO ) == dek.CHACHA20_POLY1305
+
+    assert cipher_benchmark.resolve( cipher_benchmark.AUTO ) == dek.CHACHA20_POLY1305
+
+    assert len( runs ) == 2
+
+
+
+
+
+def test_named_cipher_is_used_without_the_cache( cache ):
+
+
+    path, runs = cache
+
+
+    assert cipher_benchmark.resolve( dek.AES_256_GCM ) == dek.AES_256_GCM
+
+    assert runs == [ ] and not path.exists( )
+
+
+    with pytest.raises( errors.UsageError ):
+
+        cipher_benchmark.resolve( 'rot13' )
@@ -0,0 +1,116 @@
+"""
+
+Tests for sharelock.compression.
+
+"""
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.errors as errors
+
+import sharelock.compression as compression
+
+
+
+
+DATA = b'compress me, compress me again. ' * 4000
+
+
+
+
+@pytest.mark.parametrize( 'codec', compression.CODECS )
+@pytest.mark.parametrize( 'level', [ None, 0, 1, compression.MAX_LEVEL ] )
+def test_round_trip( codec, level ):
+
+
+    compressed = compression.compress( codec, DATA, level )
+
+
+    if level != 0:
+
+        assert len( compressed ) < len( DATA )
+
+
+    assert compression.decompress( codec, compressed, len( DATA ) ) == DATA
+
+
+
+
+
+@pytest.mark.parametrize( 'codec', compression.CODECS )
+def test_compressed_container_round_trip( keys, codec ):
+
+
+    encrypted = api.encrypt( DATA, keys[ 0 ], segment_size = 4096, compression_codec = codec, compression_level = 6, jobs = 2 )
+
+
+    assert len( encrypted ) < len( DATA )
+
+    assert api.decrypt( encrypted, keys[ 2 ] ) == DATA
+
+    assert api.decrypt( encrypted, keys[ 2 ], offset = 5000, length = 10000 ) == DATA[ 5000 : 15000 ]
+
+
+
+
+
+@pytest.mark.parametrize( 'codec, level', [ ( 'zlib', -1 ), ( 'lzma', compression.MAX_LEVEL + 1 ), ( 'gzip', None ) ] )
+def test_invalid_codec_or_level_raises_usage_error( keys, codec, level ):
+
+
+    with pytest.raises( errors.UsageError ):
+
+        compression.check( codec, level )
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.encrypt( DATA, keys[ 0 ], compression_codec = codec, compression_level = level )
+
+
+
+
+
+@pytest.mark.parametrize( 'codec', compression.CODECS )
+def test_segment_that_inflates_past_its_length_is_rejected( codec ):
+
+
+    # a segment that would inflate to 8 MiB is only decompressed one byte past the indexed length
+
+    compressed = compression.compress( codec, bytes( 8 * 1024 * 1024 ), 9 )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        compression.decompress( codec, compressed, 4096 )
+
+
+
+
+
+@pytest.mark.parametrize( 'codec', compression.CODECS )
+def test_segment_shorter_than_its_length_or_corrupt_is_rejected( codec ):
+
+
+    compressed = compression.compress( codec, DATA )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        compression.decompress( codec, compressed, len( DATA ) + 1 )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        compression.decompress( codec, compressed[ : len( compressed ) // 2 ], len( DATA ) )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        compression.decompress( codec, b'not compressed data', len( DATA ) )
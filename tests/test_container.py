@@ -0,0 +1,423 @@
+"""
+
+Tests for sharelock.container.
+
+"""
+
+
+
+import io
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.errors as errors
+
+import sharelock.container as container
+
+import sharelock.encrypter as encrypter
+
+
+
+
+SEGMENT_SIZE = 4096
+
+
+DATA = bytes( range( 256 ) ) * 64
+
+
+
+
+@pytest.fixture
+def encrypted( keys ) -> bytearray:
+
+    """
+    A container of four segments.
+    """
+
+
+    return bytearray( api.encrypt( DATA, keys[ 0 ], segment_size = SEGMENT_SIZE ) )
+
+
+
+
+
+@pytest.fixture
+def appended( tmp_path, keys ) -> bytearray:
+
+    """
+    A container of four segments that has been appended to twice, so it holds a session table.
+    """
+
+
+    path = tmp_path / 'data.enc'
+
+    path.write_bytes( api.encrypt( DATA, keys[ 0 ], segment_size = SEGMENT_SIZE ) )
+
+
+    input_path = tmp_path / 'more.bin'
+
+    input_path.write_bytes( DATA )
+
+
+    for _ in range( 2 ):
+
+        encrypter.Encrypter( ).append( path, input_path, private_kek = keys[ 2 ] )
+
+
+    return bytearray( path.read_bytes( ) )
+
+
+
+
+
+def layout( data: bytes ):
+
+    """
+    The header length, index offset, segment count, and offset of the footer of a container.
+    """
+
+
+    header_length, _ = container.read_header( io.BytesIO( data ) )
+
+
+    footer_offset = len( data ) - container.FOOTER.size
+
+    index_offset, count, _, _ = container.FOOTER.unpack( data[ footer_offset : ] )
+
+
+    return header_length, index_offset, count, footer_offset
+
+
+
+
+
+def flip( data: bytearray, offset: int ) -> bytes:
+
+
+    data[ offset ] ^= 0x01
+
+
+    return bytes( data )
+
+
+
+
+
+def test_round_trip( encrypted, appended, keys ):
+
+
+    assert api.decrypt( bytes( encrypted ), keys[ 2 ] ) == DATA
+
+    assert api.decrypt( bytes( appended ), keys[ 2 ] ) == DATA * 3
+
+
+    assert layout( encrypted )[ 2 ] == 4
+
+    assert bytes( encrypted[ -len( container.FOOTER_MAGIC ) : ] ) == container.FOOTER_MAGIC
+
+    assert bytes( appended[ -len( container.APPENDED_FOOTER_MAGIC ) : ] ) == container.APPENDED_FOOTER_MAGIC
+
+
+
+
+
+def test_modified_header_parameter_fails_authentication( encrypted, keys ):
+
+
+    data = bytes( encrypted ).replace( b'"segment_size": 4096', b'"segment_size": 4097', 1 )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( data, keys[ 2 ] )
+
+
+
+
+
+def test_flipped_header_byte_is_rejected( encrypted, keys ):
+
+
+    header_length, _, _, _ = layout( encrypted )
+
+
+    for offset in [ container.PREAMBLE_LENGTH, header_length // 2, header_length - 1 ]:
+
+        with pytest.raises( ValueError ):
+
+            api.decrypt( flip( bytearray( encrypted ), offset ), keys[ 2 ] )
+
+
+
+
+
+@pytest.mark.parametrize( 'field', [ 0, 8, 12, 16 ] )
+def test_flipped_index_entry_byte_fails_authentication( encrypted, keys, field ):
+
+
+    _, index_offset, _, _ = layout( encrypted )
+
+
+    # offset, ciphertext length, plaintext length, and tag of the second segment
+
+    with pytest.raises( ValueError ):
+
+        api.decrypt( flip( encrypted, index_offset + container.INDEX_ENTRY.size + field ), keys[ 2 ] )
+
+
+
+
+
+@pytest.mark.parametrize( 'footer_field', [ 0, 15, 16, container.FOOTER.size - 1 ] )
+def test_flipped_footer_byte_is_rejected( encrypted, keys, footer_field ):
+
+
+    # index offset, segment count, HMAC, and footer magic
+
+    _, _, _, footer_offset = layout( encrypted )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( flip( encrypted, footer_offset + footer_field ), keys[ 2 ] )
+
+
+
+
+
+@pytest.mark.parametrize( 'session_field', [ 0, 7, 8, container.SESSION_ENTRY.size - 1, container.SESSION_ENTRY.size + 8 ] )
+def test_flipped_session_byte_fails_authentication( appended, keys, session_field ):
+
+
+    _, index_offset, count, _ = layout( appended )
+
+
+    sessions_offset = index_offset + count * container.INDEX_ENTRY.size
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( flip( appended, sessions_offset + session_field ), keys[ 2 ] )
+
+
+
+
+
+def test_dropped_session_is_rejected( appended, keys ):
+
+
+    _, index_offset, count, _ = layout( appended )
+
+
+    sessions_offset = index_offset + count * container.INDEX_ENTRY.size
+
+
+    data = appended[ : sessions_offset ] + appended[ sessions_offset + container.SESSION_ENTRY.size : ]
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( bytes( data ), keys[ 2 ] )
+
+
+
+
+
+def test_flipped_segment_byte_fails_authentication( encrypted, keys ):
+
+
+    header_length, _, _, _ = layout( encrypted )
+
+
+    data = flip( encrypted, header_length + SEGMENT_SIZE + 10 )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( data, keys[ 2 ] )
+
+
+    # a range that does not include the modified segment still decrypts
+
+    assert api.decrypt( data, keys[ 2 ], offset = 0, length = SEGMENT_SIZE ) == DATA[ : SEGMENT_SIZE ]
+
+
+
+
+
+def test_reordered_segments_are_rejected( encrypted, keys ):
+
+
+    header_length, _, _, _ = layout( encrypted )
+
+
+    first = slice( header_length, header_length + SEGMENT_SIZE )
+
+    second = slice( header_length + SEGMENT_SIZE, header_length + 2 * SEGMENT_SIZE )
+
+
+    data = bytearray( encrypted )
+
+    data[ first ], data[ second ] = encrypted[ second ], encrypted[ first ]
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( bytes( data ), keys[ 2 ], offset = 0, length = SEGMENT_SIZE )
+
+
+
+
+
+def test_reordered_index_entries_are_rejected( encrypted, keys ):
+
+
+    _, index_offset, _, _ = layout( encrypted )
+
+
+    first = slice( index_offset, index_offset + container.INDEX_ENTRY.size )
+
+    second = slice( index_offset + container.INDEX_ENTRY.size, index_offset + 2 * container.INDEX_ENTRY.size )
+
+
+    data = bytearray( encrypted )
+
+    data[ first ], data[ second ] = encrypted[ second ], encrypted[ first ]
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( bytes( data ), keys[ 2 ] )
+
+
+
+
+
+@pytest.mark.parametrize( 'removed', [ 1, container.FOOTER.size, container.FOOTER.size + container.INDEX_ENTRY.size ] )
+def test_truncated_container_is_rejected( encrypted, keys, removed ):
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( bytes( encrypted[ : -removed ] ), keys[ 2 ] )
+
+
+
+
+
+def test_dropped_last_segment_is_rejected( encrypted, keys ):
+
+
+    # cut the last segment and its index entry, and keep the old footer with a count that matches what is left
+
+    _, index_offset, count, footer_offset = layout( encrypted )
+
+
+    last_segment_offset, _, _, _ = container.INDEX_ENTRY.unpack_from( encrypted, index_offset + ( count - 1 ) * container.INDEX_ENTRY.size )
+
+    _, _, mac, magic = container.FOOTER.unpack( encrypted[ footer_offset : ] )
+
+
+    data = (
+        encrypted[ : last_segment_offset ]
+        + encrypted[ index_offset : index_offset + ( count - 1 ) * container.INDEX_ENTRY.size ]
+        + container.FOOTER.pack( last_segment_offset, count - 1, mac, magic )
+    )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( bytes( data ), keys[ 2 ] )
+
+
+
+
+
+@pytest.mark.parametrize( 'offset, length', [
+    ( 0, None ),
+    ( 0, 1 ),
+    ( 0, SEGMENT_SIZE ),
+    ( SEGMENT_SIZE, SEGMENT_SIZE ),
+    ( SEGMENT_SIZE, None ),
+    ( SEGMENT_SIZE - 1, 2 ),
+    ( 100, 3 * SEGMENT_SIZE ),
+    ( 4 * SEGMENT_SIZE - 1, 100 ),
+    ( 0, 0 ),
+    ( SEGMENT_SIZE, 0 ),
+    ( len( DATA ), None ),
+    ( len( DATA ) + 1, 10 ),
+    ( 10 * len( DATA ), None ),
+] )
+def test_range_decrypt( encrypted, keys, offset, length ):
+
+
+    expected = DATA[ offset : ] if length is None else DATA[ offset : offset + length ]
+
+
+    assert api.decrypt( bytes( encrypted ), keys[ 2 ], offset = offset, length = length ) == expected
+
+
+
+
+
+@pytest.mark.parametrize( 'offset, length, selected', [
+    ( 0, None, range( 0, 4 ) ),
+    ( 0, SEGMENT_SIZE, range( 0, 1 ) ),
+    ( SEGMENT_SIZE, SEGMENT_SIZE, range( 1, 2 ) ),
+    ( SEGMENT_SIZE - 1, 2, range( 0, 2 ) ),
+    ( SEGMENT_SIZE, None, range( 1, 4 ) ),
+    ( 0, 0, range( 0 ) ),
+    ( 4 * SEGMENT_SIZE, None, range( 0 ) ),
+    ( 5 * SEGMENT_SIZE, 10, range( 0 ) ),
+] )
+def test_segment_range_selects_only_the_segments_in_the_range( offset, length, selected ):
+
+
+    entries = [ ( 0, SEGMENT_SIZE, SEGMENT_SIZE, b'' ) ] * 4
+
+
+    found, starts, range_end = container.segment_range( entries, offset, length )
+
+
+    assert found == selected
+
+    assert starts == [ 0, SEGMENT_SIZE, 2 * SEGMENT_SIZE, 3 * SEGMENT_SIZE, 4 * SEGMENT_SIZE ]
+
+    assert range_end == ( 4 * SEGMENT_SIZE if length is None else min( offset + length, 4 * SEGMENT_SIZE ) )
+
+
+
+
+
+@pytest.mark.parametrize( 'offset, length', [ ( 0, None ), ( 0, 0 ), ( 0, 10 ), ( 5, None ) ] )
+def test_range_decrypt_of_empty_container( keys, offset, length ):
+
+
+    encrypted = api.encrypt( b'', keys[ 0 ], segment_size = SEGMENT_SIZE )
+
+
+    assert layout( encrypted )[ 2 ] == 1
+
+    assert api.decrypt( encrypted, keys[ 2 ], offset = offset, length = length ) == b''
+
+
+
+
+
+def test_negative_range_raises_usage_error( encrypted, keys ):
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.decrypt( bytes( encrypted ), keys[ 2 ], offset = -1 )
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.decrypt( bytes( encrypted ), keys[ 2 ], length = -1 )
@@ -0,0 +1,128 @@
+"""
+
+Tests for sharelock.encrypter.
+
+"""
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.errors as errors
+
+import sharelock.encrypter as encrypter
+
+
+
+
+def test_invalid_arguments_are_reported_before_the_input_is_opened( tmp_path, keys ):
+
+
+    missing = tmp_path / 'missing.bin'
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.encrypt( missing, keys[ 0 ], segment_size = 0 )
+
+
+    with pytest.raises( errors.UsageError ):
+
+        api.encrypt( missing, keys[ 0 ], compression_codec = 'zlib', compression_level = 12 )
+
+
+    with pytest.raises( errors.InputError ):
+
+        api.encrypt( missing, keys[ 0 ] )
+
+
+
+
+
+@pytest.mark.parametrize( 'arguments', [
+    { 'segment_size': 0 },
+    { 'segment_size': -1 },
+    { 'compression_codec': 'zlib', 'compression_level': 12 },
+    { 'compression_codec': 'gzip' },
+    { 'cipher': 'rot13' },
+] )
+def test_invalid_arguments_of_many_files_are_reported_before_any_input_or_output( tmp_path, kek_file, arguments ):
+
+
+    missing = tmp_path / 'missing'
+
+    output_directory = tmp_path / 'out'
+
+
+    with pytest.raises( errors.UsageError ):
+
+        encrypter.Encrypter( ).encrypt_many( str( kek_file ), [ str( missing ) ], str( output_directory ), **arguments )
+
+
+    assert not output_directory.exists( )
+
+
+
+    with pytest.raises( errors.InputError ):
+
+        encrypter.Encrypter( ).encrypt_many( str( kek_file ), [ str( missing ) ], str( output_directory ) )
+
+
+    assert not output_directory.exists( )
+
+
+
+
+
+def test_round_trip( keys ):
+
+
+    data = bytes( range( 256 ) ) * 1000
+
+
+    encrypted = api.encrypt( data, keys[ 0 ], segment_size = 4096, jobs = 2 )
+
+
+    assert api.decrypt( encrypted, keys[ 2 ] ) == data
+
+    assert api.decrypt( encrypted, keys[ 2 ], offset = 5000, length = 10000 ) == data[ 5000 : 15000 ]
+
+
+
+
+
+def test_every_recipient_decrypts_and_other_keys_do_not( keys, tmp_path ):
+
+
+    others = [ api.generate_kek( 2, 2 ) for _ in range( 2 ) ]
+
+    other_private_keks = [ api.combine_shares( shares ) for _, shares in others ]
+
+
+    data = b'shared data ' * 1000
+
+
+    encrypted = api.encrypt( data, [ keys[ 0 ], others[ 0 ][ 0 ] ], segment_size = 4096 )
+
+
+
+    assert api.decrypt( encrypted, keys[ 2 ] ) == data
+
+    assert api.decrypt( encrypted, other_private_keks[ 0 ] ) == data
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        api.decrypt( encrypted, other_private_keks[ 1 ] )
+
+
+
+    # a DEK file holds a single encrypted DEK
+
+    with pytest.raises( errors.UsageError ):
+
+        encrypter.Encrypter( ).encrypt_with_kek( [ keys[ 0 ], others[ 0 ][ 0 ] ], str( tmp_path / 'data.enc' ), str( tmp_path / 'data.dek' ), source = data )
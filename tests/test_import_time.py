@@ -0,0 +1,61 @@
+"""
+
+Tests for the import-time budget of the command line ( see benchmarks/import_time.py ).
+
+"""
+
+
+
+import statistics
+
+import importlib.util
+
+from pathlib import Path
+
+
+
+
+def load_import_time( ):
+
+    """
+    Load benchmarks/import_time.py, which holds the budget and the list of deferred modules.
+    """
+
+
+    path = Path( __file__ ).resolve( ).parent.parent / 'benchmarks' / 'import_time.py'
+
+
+    spec = importlib.util.spec_from_file_location( 'import_time', path )
+
+    module = importlib.util.module_from_spec( spec )
+
+    spec.loader.exec_module( module )
+
+
+    return module
+
+
+
+
+import_time = load_import_time( )
+
+
+
+
+
+def test_deferred_modules_are_not_imported( ):
+
+
+    assert import_time.loaded_deferred_modules( ) == [ ]
+
+
+
+
+
+def test_import_time_is_within_budget( ):
+
+
+    median = statistics.median( import_time.measure_import( ) for _ in range( import_time.DEFAULT_RUNS ) )
+
+
+    assert median <= import_time.DEFAULT_BUDGET_MS
@@ -0,0 +1,216 @@
+"""
+
+Tests for sharelock.rewrapper.
+
+"""
+
+
+
+import sys
+
+import subprocess
+
+
+
+import pytest
+
+
+
+import sharelock.api as api
+
+import sharelock.errors as errors
+
+import sharelock.container as container
+
+import sharelock.encrypter as encrypter
+
+import sharelock.rewrapper as rewrapper
+
+
+
+
+DATA = b'rewrap me ' * 5000
+
+
+
+
+@pytest.fixture( scope = 'module' )
+def new_keys( ):
+
+
+    public_kek, shares = api.generate_kek( 3, 2 )
+
+
+    return public_kek, shares, api.combine_shares( shares[ : 2 ] )
+
+
+
+
+
+@pytest.fixture
+def new_kek_file( tmp_path, new_keys ):
+
+
+    path = tmp_path / 'NEW.bin'
+
+    path.write_bytes( new_keys[ 0 ] )
+
+
+    return path
+
+
+
+
+
+def header_length( path ) -> int:
+
+
+    with open( path, 'rb' ) as file:
+
+        return container.read_header( file )[ 0 ]
+
+
+
+
+
+def test_rerun_skips_rewrapped_containers_and_dek_files( tmp_path, keys, new_keys, new_kek_file ):
+
+
+    container_path = tmp_path / 'data.sharelock'
+
+    api.encrypt( DATA, keys[ 0 ], container_path )
+
+
+    dek_path = tmp_path / 'other.dek'
+
+    encrypter.Encrypter( ).encrypt_with_kek( keys[ 0 ], str( tmp_path / 'other.sharelock' ), str( dek_path ), source = DATA )
+
+
+
+    paths = [ str( container_path ), str( dek_path ) ]
+
+
+    assert rewrapper.Rewrapper( ).rewrap( paths, str( new_kek_file ), private_kek = keys[ 2 ] ) == ( 2, [ ] )
+
+
+
+    # the rerun also picks up a file added since the first run
+
+    added_dek_path = tmp_path / 'added.dek'
+
+    encrypter.Encrypter( ).encrypt_with_kek( keys[ 0 ], str( tmp_path / 'added.sharelock' ), str( added_dek_path ), source = DATA )
+
+
+    assert rewrapper.Rewrapper( ).rewrap( paths + [ str( added_dek_path ) ], str( new_kek_file ), private_kek = keys[ 2 ] ) == ( 1, [ str( dek_path ) ] )
+
+
+    assert api.decrypt( container_path, new_keys[ 2 ] ) == DATA
+
+    assert api.decrypt( tmp_path / 'added.sharelock', new_keys[ 2 ], dek_filename = str( added_dek_path ) ) == DATA
+
+
+
+
+
+def test_wrong_old_key_rewraps_nothing( tmp_path, keys, new_keys, new_kek_file ):
+
+
+    dek_path = tmp_path / 'data.dek'
+
+    encrypter.Encrypter( ).encrypt_with_kek( keys[ 0 ], str( tmp_path / 'data.sharelock' ), str( dek_path ), source = DATA )
+
+    encrypted_dek = dek_path.read_bytes( )
+
+
+    with pytest.raises( errors.IntegrityError ):
+
+        rewrapper.Rewrapper( ).rewrap( [ str( dek_path ) ], str( new_kek_file ), private_kek = new_keys[ 2 ] )
+
+
+    assert dek_path.read_bytes( ) == encrypted_dek
+
+
+
+
+
+def test_cli_exits_with_failure_when_files_are_skipped( tmp_path, keys, new_kek_file ):
+
+
+    dek_paths = [ tmp_path / 'first.dek', tmp_path / 'second.dek' ]
+
+
+    for dek_path in dek_paths:
+
+        encrypter.Encrypter( ).encrypt_with_kek( keys[ 0 ], str( dek_path.with_suffix( '.sharelock' ) ), str( dek_path ), source = DATA )
+
+
+    assert rewrapper.Rewrapper( ).rewrap( [ str( dek_paths[ 0 ] ) ], str( new_kek_file ), private_kek = keys[ 2 ] ) == ( 1, [ ] )
+
+
+
+    result = subprocess.run(
+        [ sys.executable, '-m', 'sharelock.sharelock', 'rewrap', '-i', *map( str, dek_paths ), '-k', str( new_kek_file ) ],
+        input = '\n'.join( keys[ 1 ][ : 2 ] ).encode( ),
+        capture_output = True,
+    )
+
+
+    assert result.returncode == 1
+
+    assert b'Skipped' in result.stderr and b'Rewrapped 1 of 2 files.' in result.stderr
+
+
+
+
+
+def test_failed_header_write_keeps_a_backup_that_the_next_run_restores( tmp_path, keys, new_keys, new_kek_file, monkeypatch ):
+
+
+    container_path = tmp_path / 'data.sharelock'
+
+    api.encrypt( DATA, keys[ 0 ], container_path )
+
+
+    length = header_length( container_path )
+
+
+
+    def fail( self, directory ):
+
+        raise OSError( 'No space left on device' )
+
+
+
+    with monkeypatch.context( ) as patch:
+
+
+        patch.setattr( rewrapper.Rewrapper, 'sync_directory', fail )
+
+
+        with pytest.raises( errors.OutputError ):
+
+            rewrapper.Rewrapper( ).rewrap( [ str( container_path ) ], str( new_kek_file ), private_kek = keys[ 2 ] )
+
+
+
+    backup_path = tmp_path / f'.data.sharelock{ rewrapper.HEADER_BACKUP_SUFFIX }'
+
+
+    assert backup_path.exists( )
+
+
+
+    # the crash tore the header in place
+
+    with open( container_path, 'r+b' ) as file:
+
+        file.write( bytes( length ) )
+
+
+
+    assert rewrapper.Rewrapper( ).rewrap( [ str( container_path ) ], str( new_kek_file ), private_kek = keys[ 2 ] ) == ( 1, [ ] )
+
+
+    assert not backup_path.exists( )
+
+    assert api.decrypt( container_path, new_keys[ 2 ] ) == DATA
@@ -0,0 +1,294 @@
+"""
+
+Tests for sharelock.shamir_secret_sharing.
+
+"""
+
+
+
+import itertools
+
+
+
+import pytest
+
+from Crypto.Protocol.SecretSharing import Shamir, _Element
+
+
+
+import sharelock.shamir_secret_sharing as sss
+
+
+
+
+SECRET = bytes( range( 1, 65 ) )
+
+
+
+
+def baseline_split( data: bytes, shares: int, threshold: int ):
+
+    """
+    Split 'data' one chunk at a time with Crypto.Protocol.SecretSharing.Shamir, as the first versions of sharelock did.
+    """
+
+
+    data = data + sss.ALTERNATE_PADDING_BYTE
+
+    share_values = [ b'' ] * shares
+
+
+    for i in range( 0, len( data ), sss.SHAMIR_SPLIT_LENGTH ):
+
+        chunk = data[ i : i + sss.SHAMIR_SPLIT_LENGTH ].ljust( sss.SHAMIR_SPLIT_LENGTH, sss.PADDING_BYTE )
+
+
+        for index, share in Shamir.split( threshold, shares, chunk, False ):
+
+            share_values[ index - 1 ] += share
+
+
+    return list( enumerate( share_values, 1 ) )
+
+
+
+
+
+def baseline_combine( shares: list[ tuple[ int, bytes ] ] ) -> bytes:
+
+    """
+    Combine shares one chunk at a time with Crypto.Protocol.SecretSharing.Shamir, as the first versions of sharelock did.
+    """
+
+
+    result = b''.join(
+        Shamir.combine( [ ( index, share[ i : i + sss.SHAMIR_SPLIT_LENGTH ] ) for index, share in shares ], False )
+        for i in range( 0, len( shares[ 0 ][ 1 ] ), sss.SHAMIR_SPLIT_LENGTH )
+    )
+
+
+    return result.rstrip( sss.PADDING_BYTE )[ : -1 ]
+
+
+
+
+
+@pytest.mark.parametrize( 'threshold, shares', [ ( 1, 1 ), ( 1, 3 ), ( 2, 3 ), ( 3, 3 ), ( 3, 5 ), ( 5, 5 ) ] )
+def test_any_threshold_subset_recovers_the_data( threshold, shares ):
+
+
+    split_shares = sss.split( SECRET, shares, threshold )
+
+
+    assert [ index for index, _ in split_shares ] == list( range( 1, shares + 1 ) )
+
+
+    for subset in itertools.combinations( split_shares, threshold ):
+
+        assert sss.combine( list( subset ) ) == SECRET
+
+
+    assert sss.combine( split_shares ) == SECRET
+
+
+
+
+
+@pytest.mark.parametrize( 'data', [ b'', b'a', b'\x00' * 15, b'\x00' * 16, bytes( range( 256 ) ) * 3 + b'\x00' ] )
+def test_round_trip_of_every_length( data ):
+
+
+    split_shares = sss.split( data, 4, 3 )
+
+
+    assert all( len( share ) % sss.SHAMIR_SPLIT_LENGTH == 0 for _, share in split_shares )
+
+    assert sss.combine( split_shares[ 1 : ] ) == data
+
+
+
+
+
+@pytest.mark.parametrize( 'threshold, shares', [ ( 2, 3 ), ( 3, 5 ), ( 4, 4 ) ] )
+def test_shares_are_interchangeable_with_pycryptodome( threshold, shares ):
+
+
+    # shares made chunk by chunk by pycryptodome ( and the first versions of sharelock ) still combine
+
+    baseline_shares = baseline_split( SECRET, shares, threshold )
+
+
+    assert sss.combine( baseline_shares[ : threshold ] ) == SECRET
+
+    assert sss.combine( baseline_shares[ -threshold : ] ) == SECRET
+
+
+
+    # and shares made here combine with pycryptodome, byte for byte
+
+    split_shares = sss.split( SECRET, shares, threshold )
+
+
+    assert baseline_combine( split_shares[ -threshold : ] ) == SECRET
+
+
+    padded = ( SECRET + sss.ALTERNATE_PADDING_BYTE ).ljust( len( split_shares[ 0 ][ 1 ] ), sss.PADDING_BYTE )
+
+
+    for i in range( 0, len( padded ), sss.SHAMIR_SPLIT_LENGTH ):
+
+        chunks = [ ( index, share[ i : i + sss.SHAMIR_SPLIT_LENGTH ] ) for index, share in split_shares[ : threshold ] ]
+
+        assert Shamir.combine( chunks, False ) == padded[ i : i + sss.SHAMIR_SPLIT_LENGTH ]
+
+
+
+
+
+def test_shares_match_pycryptodome_byte_for_byte( ):
+
+
+    # with a threshold of 1 the polynomials are constant, so both make the same shares without any randomness
+
+    assert sss.split( SECRET, 3, 1 ) == baseline_split( SECRET, 3, 1 )
+
+
+
+    # the same polynomials evaluated with pycryptodome's field arithmetic and by the packed engine give the same bytes
+
+    chunk_count = 3
+
+    coefficients = [ bytes( ( 37 * i + 11 ) % 256 for i in range( n * 48, n * 48 + 48 ) ) for n in range( 4 ) ]
+
+
+    for index in [ 1, 2, 3, 200, 255 ]:
+
+
+        expected = b''
+
+
+        for chunk in range( chunk_count ):
+
+            value = _Element( 0 )
+
+            for coefficient in coefficients:
+
+                value = value * _Element( index ) + _Element( coefficient[ chunk * 16 : chunk * 16 + 16 ] )
+
+            expected += value.encode( )
+
+
+        packed = 0
+
+        for coefficient in coefficients:
+
+            packed = sss.multiply( packed, index, chunk_count ) ^ sss.pack( coefficient )
+
+
+        assert sss.unpack( packed, chunk_count ) == expected
+
+
+
+
+
+@pytest.mark.parametrize( 'threshold, shares', [ ( 2, 3 ), ( 3, 5 ), ( 5, 5 ) ] )
+def test_fewer_than_threshold_shares_do_not_recover_the_data( threshold, shares ):
+
+
+    split_shares = sss.split( SECRET, shares, threshold )
+
+
+    for subset in itertools.combinations( split_shares, threshold - 1 ):
+
+        assert sss.combine( list( subset ) ) != SECRET
+
+
+
+
+
+@pytest.mark.parametrize( 'shares, threshold', [ ( 0, 1 ), ( 3, 0 ), ( 2, 3 ) ] )
+def test_invalid_split_arguments_raise_value_error( shares, threshold ):
+
+
+    with pytest.raises( ValueError ):
+
+        sss.split( SECRET, shares, threshold )
+
+
+
+
+
+def test_invalid_shares_raise_value_error( ):
+
+
+    split_shares = sss.split( SECRET, 3, 2 )
+
+
+    with pytest.raises( ValueError ):
+
+        sss.combine( [ split_shares[ 0 ], split_shares[ 0 ] ] )
+
+
+    with pytest.raises( ValueError ):
+
+        sss.combine( [ split_shares[ 0 ], ( 2, split_shares[ 1 ][ 1 ][ : -1 ] ) ] )
+
+
+    with pytest.raises( ValueError ):
+
+        sss.combine( [ split_shares[ 0 ], ( 0, split_shares[ 1 ][ 1 ] ) ] )
+
+
+
+
+
+def test_cached_coefficients_follow_the_share_indices_and_order( ):
+
+
+    sss.lagrange_coefficients.cache_clear( )
+
+
+    split_shares = sss.split( SECRET, 4, 2 )
+
+
+
+    # every pair in both orders, twice, so later combines use coefficients cached by earlier ones
+
+    for _ in range( 2 ):
+
+        for subset in itertools.permutations( split_shares, 2 ):
+
+            assert sss.combine( list( subset ) ) == SECRET
+
+
+
+    assert sss.lagrange_coefficients.cache_info( ).hits >= 12
+
+
+    assert sss.combine( split_shares[ : 3 ] ) == SECRET
+
+
+
+
+
+def test_large_share_counts( ):
+
+
+    data = bytes( range( 256 ) )
+
+    split_shares = sss.split( data, 300, 150 )
+
+
+    assert len( split_shares ) == 300
+
+    assert len( { share for _, share in split_shares } ) == 300
+
+
+
+    # indices above 255 take more than one byte of each lane of the packed share indices
+
+    assert sss.combine( split_shares[ -150 : ] ) == data
+
+    assert sss.combine( split_shares[ : : 2 ] ) == data
+
+    assert sss.combine( split_shares[ 1 : : 2 ][ : 149 ] ) != data
@@ -0,0 +1,54 @@
+"""
+
+Tests for sharelock.stats.
+
+"""
+
+
+
+import json
+
+
+
+import pytest
+
+
+
+import sharelock.stats as stats
+
+import sharelock.errors as errors
+
+
+
+
+def test_write_to_unwritable_path_raises_output_error( tmp_path ):
+
+
+    with pytest.raises( errors.OutputError ):
+
+        stats.PhaseStats( 'encrypt' ).write( str( tmp_path / 'missing' / 'stats.json' ) )
+
+
+
+
+
+def test_write_report( tmp_path ):
+
+
+    phase_stats = stats.PhaseStats( 'encrypt' )
+
+
+    with phase_stats.phase( 'encrypt', 10 ):
+
+        pass
+
+
+    phase_stats.write( str( tmp_path / 'stats.json' ) )
+
+
+    report = json.loads( ( tmp_path / 'stats.json' ).read_text( ) )
+
+
+    assert report[ 'command' ] == 'encrypt'
+
+    assert report[ 'phases' ][ 'encrypt' ][ 'bytes' ] == 10
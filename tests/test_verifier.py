@@ -0,0 +1,137 @@
+"""
+
+Tests for sharelock.verifier.
+
+"""
+
+
+
+import sys
+
+import subprocess
+
+
+
+import sharelock.api as api
+
+import sharelock.container as container
+
+import sharelock.compression as compression
+
+import sharelock.verifier as verifier
+
+
+
+
+DATA = b'verify me ' * 5000
+
+
+
+
+def run_verify( keys, *paths ):
+
+
+    return subprocess.run(
+        [ sys.executable, '-m', 'sharelock.sharelock', 'verify', '-i', *map( str, paths ) ],
+        input = '\n'.join( keys[ 1 ][ : 2 ] ).encode( ),
+        capture_output = True,
+    )
+
+
+
+
+
+def test_cli_exits_with_success_on_intact_containers( tmp_path, keys ):
+
+
+    path = tmp_path / 'data.enc'
+
+    api.encrypt( DATA, keys[ 0 ], path, segment_size = 4096, compression_codec = 'zlib' )
+
+
+    result = run_verify( keys, path )
+
+
+    assert result.returncode == 0
+
+    assert result.stdout.decode( ).startswith( 'OK' )
+
+
+
+
+
+def test_cli_exits_with_failure_on_a_modified_container( tmp_path, keys ):
+
+
+    intact_path = tmp_path / 'intact.enc'
+
+    api.encrypt( DATA, keys[ 0 ], intact_path, segment_size = 4096 )
+
+
+    modified_path = tmp_path / 'modified.enc'
+
+    modified = bytearray( intact_path.read_bytes( ) )
+
+    modified[ len( modified ) // 2 ] ^= 0x01
+
+    modified_path.write_bytes( modified )
+
+
+
+    result = run_verify( keys, modified_path, intact_path )
+
+
+    assert result.returncode == 1
+
+    assert result.stdout.decode( ).splitlines( )[ 0 ].startswith( 'FAILED' )
+
+    assert result.stdout.decode( ).splitlines( )[ 1 ].startswith( 'OK' )
+
+
+
+
+
+def test_compressed_segments_are_not_decompressed( tmp_path, keys, monkeypatch ):
+
+
+    path = tmp_path / 'data.enc'
+
+    api.encrypt( DATA, keys[ 0 ], path, segment_size = 4096, compression_codec = 'lzma' )
+
+
+
+    def fail( *args ):
+
+        raise AssertionError( 'verify decompressed a segment' )
+
+
+    monkeypatch.setattr( compression, 'decompress', fail )
+
+
+
+    assert list( verifier.Verifier( ).verify( [ ( str( path ), None ) ], private_kek = keys[ 2 ] ) ) == [ ( str( path ), None ) ]
+
+
+
+
+
+def test_unsupported_format_version_is_rejected( tmp_path, keys ):
+
+
+    path = tmp_path / 'data.enc'
+
+    api.encrypt( DATA, keys[ 0 ], path, segment_size = 4096 )
+
+
+    data = bytearray( path.read_bytes( ) )
+
+    data[ len( container.MAGIC ) ] = 1
+
+    path.write_bytes( data )
+
+
+
+    ( _, error ), = verifier.Verifier( ).verify( [ ( str( path ), None ) ], private_kek = keys[ 2 ] )
+
+
+    assert 'unsupported format version' in error